@@ -73,11 +73,13 @@ class Service:
             Dict: 解析后的响应结果，包含duration字段
             
         Raises:
-            ValueError: 当响应解析失败时
+            ValueError: 当消息格式不合法或响应解析失败时
             Exception: 当API调用失败时
         """
         if not messages:
             raise ValueError(i18n.t("log.llm_empty_messages"))
+        if not all(isinstance(message, dict) for message in messages):
+            raise ValueError(i18n.t("log.llm_invalid_messages"))
 
         # 设置默认参数
         chat_params = {
@@ -88,7 +90,7 @@ class Service:
         }
         chat_params.update(kwargs)
 
-        start_time = time.time()
+        start_ns = time.monotonic_ns()
         last_exception = None
 
         # 重试机制
@@ -101,7 +103,7 @@ class Service:
                 if not resp.choices or not resp.choices[0].message.content:
                     raise ValueError(i18n.t("log.llm_empty_response"))
 
-                duration = time.time() - start_time
+                duration = (time.monotonic_ns() - start_ns) / 1e9
 
                 # 记录成功日志
                 tokens = resp.usage.total_tokens if resp.usage else 'unknown'
@@ -120,6 +122,6 @@ class Service:
                     time.sleep(wait_time)
 
         # 所有重试都失败了
-        duration = time.time() - start_time
+        duration = (time.monotonic_ns() - start_ns) / 1e9
         logger.error(i18n.t("log.llm_request_final_failed", duration=duration))
         raise Exception(f"LLM请求失败，已重试{self.max_retries}次: {last_exception}")
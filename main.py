@@ -1,25 +1,41 @@
 import logging
+import logging.handlers
 from contextlib import asynccontextmanager
+from typing import Optional
 from urllib.parse import urlparse
 
-from fastapi import FastAPI, Request, BackgroundTasks, HTTPException
+import orjson
+from fastapi import APIRouter, FastAPI, Request, BackgroundTasks, HTTPException
 from fastapi.responses import JSONResponse
 
-from config import settings, engine
+from config import Settings, settings, engine
 from i18n import i18n, init_i18n
 from review_manager import ReviewManager
+from utils import warmup_templates
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s %(levelname)s %(name)s %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.handlers.RotatingFileHandler(
-            'app.log', maxBytes=10*1024*1024, backupCount=5
-        )
-    ]
-)
 logger = logging.getLogger(__name__)
+router = APIRouter()
+
+
+def setup_logging(debug: bool = False):
+    """配置日志
+    :param debug: 调试模式下输出 DEBUG 级别日志
+    """
+    level = logging.DEBUG if debug else logging.INFO
+    root_logger = logging.getLogger()
+    # 宿主（如 uvicorn --log-config）已配置根日志器处理器时保留其处理器，只在未配置时添加控制台和文件输出
+    if not root_logger.handlers:
+        logging.basicConfig(
+            format='%(asctime)s %(levelname)s %(name)s %(message)s',
+            handlers=[
+                logging.StreamHandler(),
+                logging.handlers.RotatingFileHandler(
+                    'app.log', maxBytes=10*1024*1024, backupCount=5
+                )
+            ]
+        )
+    # 级别单独设置，不受 basicConfig 只生效一次的限制
+    root_logger.setLevel(level)
 
 
 def filter_transactions(event, _):
@@ -37,20 +53,16 @@ def filter_transactions(event, _):
     return event
 
 
-# 初始化国际化
-init_i18n()
-i18n.set_locale(settings.locale)
-
-# 初始化增强审查管理器
-review_manager = ReviewManager()
-
-
 @asynccontextmanager
-async def lifespan(_):
+async def lifespan(app: FastAPI):
     """生命周期事件
     """
-    if not settings.debug:
-        await review_manager.check()
+    # 日志在服务启动时配置，导入模块或创建应用时不改动根日志器
+    setup_logging(app.state.settings.debug)
+    # 提示词模板在启动时编译，不占用第一次审查的时间
+    warmup_templates()
+    if not app.state.settings.debug:
+        await app.state.review_manager.check()
         # Mysql
         from sqlalchemy.exc import OperationalError
         try:
@@ -62,12 +74,7 @@ async def lifespan(_):
     yield
 
 
-app = FastAPI(
-    lifespan=lifespan
-)
-
-
-@app.post('/')
+@router.post('/')
 async def system_hooks(request: Request, background_tasks: BackgroundTasks):
     """
     处理系统钩子事件
@@ -76,15 +83,15 @@ async def system_hooks(request: Request, background_tasks: BackgroundTasks):
     :return:
     """
     try:
-        # 解析JSON数据
-        event_data = await request.json()
+        # 直接读取原始请求体用 orjson 解析，不经过 Starlette 的标准库 json 解码，也不做模型校验
+        event_data = orjson.loads(await request.body())
 
         # 获取事件类型
         object_kind = event_data.get('object_kind', '')
 
         # 处理合并请求事件
         if object_kind == "merge_request":
-            background_tasks.add_task(review_manager.process_merge_request_event, event_data)
+            background_tasks.add_task(request.app.state.review_manager.process_merge_request_event, event_data)
             return JSONResponse({
                 "status": i18n.t('status.accepted'),
                 "message": i18n.t('response.merge_request_queued')
@@ -101,5 +108,31 @@ async def system_hooks(request: Request, background_tasks: BackgroundTasks):
         raise HTTPException(status_code=500, detail=f"{i18n.t('response.internal_server_error')}: {str(e)}")
 
 
-@app.head("/health/")
+@router.head("/health/")
 async def health_check(): return
+
+
+def create_app(app_settings: Optional[Settings] = None) -> FastAPI:
+    """创建应用
+    国际化和审查管理器都在这里初始化，测试可直接传入配置调用而无需重新加载模块
+    :param app_settings: 应用配置，默认使用全局配置
+    :return:
+    """
+    app_settings = app_settings or settings
+
+    # 初始化国际化
+    init_i18n()
+    i18n.set_locale(app_settings.locale)
+
+    application = FastAPI(
+        lifespan=lifespan
+    )
+    application.state.settings = app_settings
+    # 初始化增强审查管理器
+    application.state.review_manager = ReviewManager()
+    application.include_router(router)
+    return application
+
+
+app = create_app()
+review_manager = app.state.review_manager
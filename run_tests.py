@@ -13,8 +13,11 @@ import subprocess
 import time
 from pathlib import Path
 
+# 所有 pytest 调用共用的前缀：不读写 .pytest_cache，测试模块以 importlib 模式导入而不修改 sys.path
+PYTEST_CMD = [sys.executable, "-m", "pytest", "-p", "no:cacheprovider", "--import-mode=importlib"]
 
-def run_command(cmd, description=""):
+
+def run_command(cmd, description="", env=None):
     """运行命令并处理结果"""
     if description:
         print(f"\n{'='*60}")
@@ -29,7 +32,8 @@ def run_command(cmd, description=""):
             cmd,
             capture_output=True,
             text=True,
-            check=False
+            check=False,
+            env=env
         )
         
         end_time = time.time()
@@ -74,6 +78,7 @@ def install_dependencies():
         "pytest-timeout>=2.1.0",
         "coverage>=7.0.0",
         "psutil>=5.9.0",  # 用于性能测试
+        "orjson>=3.9.0",  # 用于预先序列化测试负载
     ]
     
     for dep in test_deps:
@@ -84,9 +89,44 @@ def install_dependencies():
     print("\n✅ 依赖安装完成")
 
 
+def xdist_args(dist="loadfile"):
+    """pytest-xdist 并行参数
+
+    默认按文件分发，同一文件的测试在同一个 worker 上共享已导入的模块和模块级 fixture。
+    依赖模块级或会话级 fixture 的测试文件不能用 worksteal，被窃取的测试会在其他 worker 上重复构建这些 fixture。
+    CI 中保留两个核心给运行器本身，避免 worker 抢占全部 CPU。
+    """
+    workers = "auto"
+    if os.environ.get("CI"):
+        workers = str(max(1, (os.cpu_count() or 1) - 2))
+    return ["-n", workers, f"--dist={dist}"]
+
+
+# 集成测试显式加载的插件，其余已安装的插件不再自动注册
+INTEGRATION_PLUGINS = ["xdist", "asyncio", "pytest_mock", "html"]
+
+
+def explicit_plugin_args(plugins):
+    """显式加载插件的 pytest 参数
+
+    配合 PYTEST_DISABLE_PLUGIN_AUTOLOAD 使用，每个 xdist worker 启动时只加载列出的插件，
+    缺少任一插件时 pytest 直接报错；同时关闭用不到的 doctest 插件。
+    """
+    args = []
+    for plugin in plugins:
+        args.extend(["-p", plugin])
+    args.extend(["-p", "no:doctest"])
+    return args
+
+
+def no_autoload_env():
+    """禁用 pytest 插件自动加载的子进程环境变量"""
+    return {**os.environ, "PYTEST_DISABLE_PLUGIN_AUTOLOAD": "1"}
+
+
 def run_unit_tests(verbose=False, coverage=True):
     """运行单元测试"""
-    cmd = [sys.executable, "-m", "pytest"]
+    cmd = list(PYTEST_CMD)
     
     # 基础参数
     cmd.extend([
@@ -116,36 +156,97 @@ def run_unit_tests(verbose=False, coverage=True):
 
 
 def run_integration_tests(verbose=False):
-    """运行集成测试"""
-    cmd = [sys.executable, "-m", "pytest"]
+    """运行集成测试
+
+    各测试文件之间没有共享状态，始终并行运行。
+    """
+    cmd = list(PYTEST_CMD)
     
     cmd.extend([
         "tests/test_review_manager.py",
         "tests/test_main.py",
+        "tests/test_llm_integration.py",
         "-m", "not performance"
     ])
     
     if verbose:
         cmd.append("-v")
     
+    # test_main 的应用和客户端是模块级、会话级 fixture，按文件分发使其在每个 worker 上只构建一次
+    cmd.extend(xdist_args())
+    cmd.extend(explicit_plugin_args(INTEGRATION_PLUGINS))
+    
     cmd.extend([
         "--html=reports/integration_report.html",
         "--self-contained-html"
     ])
     
-    return run_command(cmd, "集成测试")
+    return run_command(cmd, "集成测试", env=no_autoload_env())
+
+
+BENCHMARK_STORAGE = Path("performance_baselines")
+
+
+def benchmark_baseline_args(name, save_baseline=False):
+    """生成保存或对比 pytest-benchmark 基线的参数
 
+    首次运行或指定 save_baseline 时保存名为 name 的基线；之后平均耗时退化超过 10% 或中位数退化超过 15% 即失败。
 
-def run_performance_tests(verbose=False):
-    """运行性能测试"""
-    cmd = [sys.executable, "-m", "pytest"]
+    Returns:
+        (pytest 参数列表, 是否为保存基线)
+    """
+    args = [f"--benchmark-storage=file://{BENCHMARK_STORAGE}"]
+    
+    # 基线文件名形如 0001_models_baseline.json，--benchmark-compare 需要其中的编号
+    baselines = sorted(BENCHMARK_STORAGE.glob(f"*/*_{name}.json"))
+    
+    if save_baseline or not baselines:
+        args.append(f"--benchmark-save={name}")
+        return args, True
+    
+    args.extend([
+        f"--benchmark-compare={baselines[-1].name.split('_')[0]}",
+        "--benchmark-compare-fail=mean:10%",
+        "--benchmark-compare-fail=median:15%"
+    ])
+    return args, False
+
+
+def run_performance_tests(verbose=False, save_baseline=False):
+    """运行性能测试
+
+    pytest-benchmark 在 xdist 下会自动停用，因此分两步：
+    先串行运行基准测试并与基线对比，再并行运行其余性能测试。
+    """
+    baseline_args, saving = benchmark_baseline_args("performance_baseline", save_baseline)
+    # pytest-benchmark 不会创建 --benchmark-json 的上级目录
+    Path("reports").mkdir(exist_ok=True)
+    cmd = list(PYTEST_CMD)
     
     cmd.extend([
         "tests/test_performance.py",
         "-m", "performance",
         "--benchmark-only",
         "--benchmark-sort=mean",
-        "--benchmark-json=reports/benchmark.json"
+        "--benchmark-json=reports/benchmark.json",
+        *baseline_args
+    ])
+    
+    if verbose:
+        cmd.append("-v")
+    
+    if not run_command(cmd, "性能基准测试（保存基线）" if saving else "性能基准测试（对比基线）"):
+        return False
+    
+    cmd = list(PYTEST_CMD)
+    
+    cmd.extend([
+        "tests/test_performance.py",
+        "-m", "performance",
+        "--benchmark-skip",
+        # 测试类相互独立并行运行，按 xdist_group 标记隔离计时和资源敏感的测试
+        "-n", "auto",
+        "--dist=loadgroup"
     ])
     
     if verbose:
@@ -154,9 +255,26 @@ def run_performance_tests(verbose=False):
     return run_command(cmd, "性能测试")
 
 
+def run_model_benchmarks(verbose=False, save_baseline=False):
+    """运行数据模型基准测试，并与 performance_baselines/ 中的基线对比"""
+    baseline_args, saving = benchmark_baseline_args("models_baseline", save_baseline)
+    cmd = list(PYTEST_CMD)
+    
+    cmd.extend([
+        "tests/test_models_bench.py",
+        "--benchmark-only",
+        *baseline_args
+    ])
+    
+    if verbose:
+        cmd.append("-v")
+    
+    return run_command(cmd, "数据模型基准测试（保存基线）" if saving else "数据模型基准测试（对比基线）")
+
+
 def run_all_tests(verbose=False, coverage=True, parallel=False):
     """运行所有测试"""
-    cmd = [sys.executable, "-m", "pytest"]
+    cmd = list(PYTEST_CMD)
     
     cmd.extend(["tests/"])
     
@@ -164,7 +282,8 @@ def run_all_tests(verbose=False, coverage=True, parallel=False):
         cmd.append("-v")
     
     if parallel:
-        cmd.extend(["-n", "auto"])
+        # 按文件分发，模块级 fixture 在每个 worker 上只构建一次
+        cmd.extend(xdist_args())
     
     if coverage:
         cmd.extend([
@@ -186,7 +305,7 @@ def run_all_tests(verbose=False, coverage=True, parallel=False):
 
 def run_specific_test(test_path, verbose=False):
     """运行特定测试"""
-    cmd = [sys.executable, "-m", "pytest", test_path]
+    cmd = [*PYTEST_CMD, test_path]
     
     if verbose:
         cmd.append("-v")
@@ -316,6 +435,7 @@ def main():
   python run_tests.py --unit                   # 只运行单元测试
   python run_tests.py --integration            # 只运行集成测试
   python run_tests.py --performance            # 只运行性能测试
+  python run_tests.py --model-benchmark        # 数据模型基准测试并对比基线
   python run_tests.py --lint                   # 运行代码检查
   python run_tests.py --format                 # 格式化代码
   python run_tests.py --install-deps           # 安装测试依赖
@@ -329,6 +449,7 @@ def main():
     test_group.add_argument("--unit", action="store_true", help="运行单元测试")
     test_group.add_argument("--integration", action="store_true", help="运行集成测试")
     test_group.add_argument("--performance", action="store_true", help="运行性能测试")
+    test_group.add_argument("--model-benchmark", action="store_true", help="运行数据模型基准测试并对比基线")
     test_group.add_argument("--test", type=str, help="运行特定测试文件或目录")
     
     # 工具选项
@@ -341,7 +462,8 @@ def main():
     # 运行选项
     parser.add_argument("-v", "--verbose", action="store_true", help="详细输出")
     parser.add_argument("--no-coverage", action="store_true", help="禁用覆盖率报告")
-    parser.add_argument("--parallel", action="store_true", help="并行运行测试")
+    parser.add_argument("--parallel", action="store_true", help="并行运行完整测试套件（集成测试始终并行）")
+    parser.add_argument("--save-baseline", action="store_true", help="重新保存性能和数据模型基准测试基线")
     
     args = parser.parse_args()
     
@@ -382,7 +504,11 @@ def main():
                 success = False
         
         elif args.performance:
-            if not run_performance_tests(args.verbose):
+            if not run_performance_tests(args.verbose, args.save_baseline):
+                success = False
+        
+        elif args.model_benchmark:
+            if not run_model_benchmarks(args.verbose, args.save_baseline):
                 success = False
         
         elif args.test:
@@ -9,17 +9,98 @@
 - 验证环境配置
 """
 
+import functools
+import importlib
 import os
 import sys
 import subprocess
 import sqlite3
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Callable, ClassVar, Dict, List, Optional, Tuple
+
+
+# 测试数据库表结构
+_SCHEMA_SQL = """
+-- Reviews 表
+CREATE TABLE IF NOT EXISTS reviews (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    project_id INTEGER NOT NULL,
+    merge_request_iid INTEGER NOT NULL,
+    status VARCHAR(50) DEFAULT 'pending',
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(project_id, merge_request_iid)
+);
+
+-- Review Discussions 表
+CREATE TABLE IF NOT EXISTS review_discussions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    review_id INTEGER NOT NULL,
+    discussion_id VARCHAR(255) NOT NULL,
+    file_path VARCHAR(1000) NOT NULL,
+    line_number INTEGER,
+    content TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (review_id) REFERENCES reviews(id) ON DELETE CASCADE,
+    UNIQUE(review_id, discussion_id)
+);
+
+-- Review File Records 表
+CREATE TABLE IF NOT EXISTS review_file_records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    review_id INTEGER NOT NULL,
+    file_path VARCHAR(1000) NOT NULL,
+    change_type VARCHAR(50) NOT NULL,
+    diff_content TEXT,
+    processed BOOLEAN DEFAULT FALSE,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (review_id) REFERENCES reviews(id) ON DELETE CASCADE,
+    UNIQUE(review_id, file_path)
+);
+
+-- Review File LLM Messages 表
+CREATE TABLE IF NOT EXISTS review_file_llm_messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    file_record_id INTEGER NOT NULL,
+    message_type VARCHAR(50) NOT NULL,
+    content TEXT NOT NULL,
+    tokens_used INTEGER DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    FOREIGN KEY (file_record_id) REFERENCES review_file_records(id) ON DELETE CASCADE
+);
+"""
+
+
+def _cached_check(check_func: Callable[..., bool]) -> Callable[..., bool]:
+    """缓存检查结果
+
+    仅用于结果在同一进程内不会变化的检查（Python 版本、项目结构等），
+    数据库连接和模块导入等依赖可变状态的检查不应使用。
+    """
+    @functools.wraps(check_func)
+    def wrapper(self) -> bool:
+        name = check_func.__name__
+        if name not in self._check_results:
+            self._check_results[name] = check_func(self)
+        return self._check_results[name]
+
+    return wrapper
 
 
 class TestEnvironmentSetup:
     """测试环境设置类"""
     
+    # 固定的测试环境变量（DATABASE_URL 与 PYTHONPATH 依赖实例路径，运行时拼接）
+    _TEST_ENV_TEMPLATE: ClassVar[Tuple[Tuple[str, str], ...]] = (
+        ("GITLAB_URL", "https://gitlab.test.com"),
+        ("GITLAB_TOKEN", "test-token"),
+        ("OPENAI_API_KEY", "test-key"),
+        ("DEBUG", "true"),
+        ("LOCALE", "zh_CN"),
+    )
+    
     def __init__(self, project_root: Optional[str] = None):
         self.project_root = Path(project_root) if project_root else Path.cwd()
         self.test_dir = self.project_root / "tests"
@@ -28,10 +109,17 @@ class TestEnvironmentSetup:
         self.logs_dir = self.project_root / "logs"
         self.reports_dir = self.project_root / "reports"
         
+        # 验证用的数据库连接（懒加载，重复验证时复用）
+        self._verify_conn: Optional[sqlite3.Connection] = None
+        
+        # 静态检查结果缓存
+        self._check_results: Dict[str, bool] = {}
+        
         # 确保目录存在
         for directory in [self.data_dir, self.logs_dir, self.reports_dir]:
             directory.mkdir(exist_ok=True)
     
+    @_cached_check
     def check_python_version(self) -> bool:
         """检查 Python 版本"""
         version = sys.version_info
@@ -74,15 +162,15 @@ class TestEnvironmentSetup:
             test_db_path = self.data_dir / "test.db"
             
             # 如果数据库已存在，先删除
+            self._close_verify_conn()
             if test_db_path.exists():
                 test_db_path.unlink()
             
             # 创建新的数据库连接
             conn = sqlite3.connect(str(test_db_path))
-            cursor = conn.cursor()
             
             # 创建表结构
-            self._create_test_tables(cursor)
+            self._create_test_tables(conn)
             
             conn.commit()
             conn.close()
@@ -93,65 +181,9 @@ class TestEnvironmentSetup:
             print(f"❌ 测试数据库创建失败: {e}")
             return False
     
-    def _create_test_tables(self, cursor: sqlite3.Cursor) -> None:
+    def _create_test_tables(self, conn: sqlite3.Connection) -> None:
         """创建测试表结构"""
-        # Reviews 表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS reviews (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                project_id INTEGER NOT NULL,
-                merge_request_iid INTEGER NOT NULL,
-                status VARCHAR(50) DEFAULT 'pending',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                UNIQUE(project_id, merge_request_iid)
-            )
-        """)
-        
-        # Review Discussions 表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS review_discussions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                review_id INTEGER NOT NULL,
-                discussion_id VARCHAR(255) NOT NULL,
-                file_path VARCHAR(1000) NOT NULL,
-                line_number INTEGER,
-                content TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (review_id) REFERENCES reviews(id) ON DELETE CASCADE,
-                UNIQUE(review_id, discussion_id)
-            )
-        """)
-        
-        # Review File Records 表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS review_file_records (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                review_id INTEGER NOT NULL,
-                file_path VARCHAR(1000) NOT NULL,
-                change_type VARCHAR(50) NOT NULL,
-                diff_content TEXT,
-                processed BOOLEAN DEFAULT FALSE,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (review_id) REFERENCES reviews(id) ON DELETE CASCADE,
-                UNIQUE(review_id, file_path)
-            )
-        """)
-        
-        # Review File LLM Messages 表
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS review_file_llm_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                file_record_id INTEGER NOT NULL,
-                message_type VARCHAR(50) NOT NULL,
-                content TEXT NOT NULL,
-                tokens_used INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (file_record_id) REFERENCES review_file_records(id) ON DELETE CASCADE
-            )
-        """)
+        conn.executescript(_SCHEMA_SQL)
     
     def setup_environment_variables(self) -> bool:
         """设置环境变量"""
@@ -159,25 +191,20 @@ class TestEnvironmentSetup:
             print("🔧 设置环境变量...")
             
             # 测试环境变量
-            test_env_vars = {
-                "DATABASE_URL": f"sqlite:///{self.data_dir}/test.db",
-                "GITLAB_URL": "https://gitlab.test.com",
-                "GITLAB_TOKEN": "test-token",
-                "OPENAI_API_KEY": "test-key",
-                "DEBUG": "true",
-                "LOCALE": "zh_CN",
-                "PYTHONPATH": str(self.project_root)
-            }
+            db_url = f"sqlite:///{self.data_dir}/test.db"
+            pairs = (
+                ("DATABASE_URL", db_url),
+                *self._TEST_ENV_TEMPLATE,
+                ("PYTHONPATH", str(self.project_root)),
+            )
             
             # 创建 .env.test 文件
             env_test_file = self.project_root / ".env.test"
             with open(env_test_file, "w", encoding="utf-8") as f:
-                for key, value in test_env_vars.items():
-                    f.write(f"{key}={value}\n")
+                f.writelines(f"{key}={value}\n" for key, value in pairs)
             
             # 设置当前进程的环境变量
-            for key, value in test_env_vars.items():
-                os.environ[key] = value
+            os.environ.update(dict(pairs))
             
             print(f"✅ 环境变量设置完成: {env_test_file}")
             return True
@@ -231,6 +258,7 @@ class TestEnvironmentSetup:
         
         return all_passed
     
+    @_cached_check
     def _check_project_structure(self) -> bool:
         """检查项目结构"""
         required_dirs = ["tests", "locales"]
@@ -248,6 +276,7 @@ class TestEnvironmentSetup:
         
         return True
     
+    @_cached_check
     def _check_test_files(self) -> bool:
         """检查测试文件"""
         test_files = [
@@ -262,6 +291,7 @@ class TestEnvironmentSetup:
         
         return True
     
+    @_cached_check
     def _check_config_files(self) -> bool:
         """检查配置文件"""
         config_files = ["pytest.ini", "pyproject.toml"]
@@ -280,11 +310,10 @@ class TestEnvironmentSetup:
             if not test_db_path.exists():
                 return False
             
-            conn = sqlite3.connect(str(test_db_path))
-            cursor = conn.cursor()
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-            tables = cursor.fetchall()
-            conn.close()
+            if self._verify_conn is None:
+                self._verify_conn = sqlite3.connect(str(test_db_path), check_same_thread=False)
+            
+            tables = self._verify_conn.execute("SELECT name FROM sqlite_master WHERE type='table';").fetchall()
             
             expected_tables = {"reviews", "review_discussions", "review_file_records", "review_file_llm_messages"}
             actual_tables = {table[0] for table in tables}
@@ -293,11 +322,24 @@ class TestEnvironmentSetup:
         except Exception:
             return False
     
+    def _close_verify_conn(self) -> None:
+        """关闭验证用的数据库连接"""
+        if self._verify_conn is not None:
+            self._verify_conn.close()
+            self._verify_conn = None
+    
     def _check_module_imports(self) -> bool:
-        """检查模块导入"""
+        """检查模块导入
+
+        推荐在安装依赖后以可编辑模式安装项目（pip install -e .），
+        此时无需修改 sys.path；否则仅在路径缺失时添加一次。
+        """
         try:
             # 添加项目根目录到 Python 路径
-            sys.path.insert(0, str(self.project_root))
+            root = str(self.project_root)
+            if root not in sys.path:
+                sys.path.insert(0, root)
+                importlib.invalidate_caches()
             
             # 尝试导入主要模块
             import config
@@ -340,6 +382,7 @@ class TestEnvironmentSetup:
         print("🧹 清理测试环境...")
         
         # 清理测试数据库
+        self._close_verify_conn()
         test_db_path = self.data_dir / "test.db"
         if test_db_path.exists():
             test_db_path.unlink()
@@ -347,15 +390,18 @@ class TestEnvironmentSetup:
         
         # 清理日志文件
         if self.logs_dir.exists():
-            for log_file in self.logs_dir.glob("*.log"):
-                log_file.unlink()
+            with os.scandir(self.logs_dir) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".log") and entry.is_file():
+                        os.unlink(entry.path)
             print("  已清理日志文件")
         
         # 清理报告文件
         if self.reports_dir.exists():
-            for report_file in self.reports_dir.glob("*"):
-                if report_file.is_file():
-                    report_file.unlink()
+            with os.scandir(self.reports_dir) as entries:
+                for entry in entries:
+                    if entry.is_file():
+                        os.unlink(entry.path)
             print("  已清理报告文件")
         
         print("✅ 测试环境清理完成")
@@ -10,11 +10,16 @@ import os
 import sys
 import tempfile
 from pathlib import Path
-from unittest.mock import Mock, patch
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, Mock, patch
 
+import orjson
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from openai import OpenAI
+from sqlalchemy import BigInteger, create_engine, event
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
 
 # 添加项目根目录到 Python 路径
 project_root = Path(__file__).parent.parent
@@ -23,6 +28,18 @@ sys.path.insert(0, str(project_root))
 from models import Base
 from config import Settings
 from i18n import init_i18n
+from llm import Service
+
+# 最简单的单条用户消息，Service.chat 不会修改传入的列表，可在测试模块间直接共享
+SIMPLE_MESSAGES = [{"role": "user", "content": "测试"}]
+
+
+def pytest_configure(config):
+    """注册自定义标记和警告过滤（pytest.ini 使用 [tool:pytest] 节，其中的配置不会生效）"""
+    config.addinivalue_line("markers", "integration: 集成测试")
+    config.addinivalue_line("markers", "performance: 性能测试")
+    config.addinivalue_line("filterwarnings", "ignore::DeprecationWarning")
+    config.addinivalue_line("filterwarnings", "ignore::PendingDeprecationWarning")
 
 
 @pytest.fixture(scope="session")
@@ -47,11 +64,50 @@ def test_settings():
     )
 
 
+@compiles(BigInteger, "sqlite")
+def _compile_big_integer_sqlite(type_, compiler, **kw):
+    """SQLite 只对 INTEGER PRIMARY KEY 自动分配主键，测试库中将 BigInteger 按 INTEGER 建表"""
+    return "INTEGER"
+
+
 @pytest.fixture(scope="session")
 def test_db_engine():
-    """测试数据库引擎夹具"""
-    # 使用内存数据库进行测试
-    engine = create_engine("sqlite:///:memory:", echo=False)
+    """测试数据库引擎夹具
+
+    整个测试会话共享一个内存数据库，表结构只创建一次。
+    使用 pytest-xdist 并行运行时，每个 worker 拥有独立命名的内存数据库。
+    """
+    worker_id = os.environ.get("PYTEST_XDIST_WORKER", "master")
+    # StaticPool 保证所有连接复用同一个内存数据库
+    engine = create_engine(
+        f"sqlite:///file:test_{worker_id}?mode=memory&uri=true",
+        connect_args={"check_same_thread": False},
+        poolclass=StaticPool,
+        query_cache_size=1200,
+        # JSON 列走 orjson 序列化，JSON 字段读写测试即作为切换到 orjson 的回归检查
+        json_serializer=lambda value: orjson.dumps(value).decode(),
+        json_deserializer=orjson.loads,
+        echo=False
+    )
+
+    # pysqlite 自带的事务处理会破坏 SAVEPOINT，改为由 SQLAlchemy 显式发出 BEGIN
+    @event.listens_for(engine, "connect")
+    def _disable_pysqlite_transaction(dbapi_connection, _):
+        dbapi_connection.isolation_level = None
+
+    # 测试库无需持久化保证，关闭日志同步以降低每次提交的开销
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragma(dbapi_connection, _):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=MEMORY")
+        cursor.execute("PRAGMA synchronous=OFF")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        cursor.close()
+
+    @event.listens_for(engine, "begin")
+    def _emit_begin(conn):
+        conn.exec_driver_sql("BEGIN")
+
     Base.metadata.create_all(engine)
     yield engine
     engine.dispose()
@@ -59,14 +115,48 @@ def test_db_engine():
 
 @pytest.fixture
 def test_db_session(test_db_engine):
-    """测试数据库会话夹具"""
-    Session = sessionmaker(bind=test_db_engine)
-    session = Session()
+    """测试数据库会话夹具
+
+    会话加入外部事务，测试中的 commit 只会释放 SAVEPOINT，结束时整体回滚。
+    提交后不过期对象，断言可直接读取身份映射中的实例而无需重新查询。
+    """
+    connection = test_db_engine.connect()
+    transaction = connection.begin()
+    session = Session(
+        bind=connection,
+        join_transaction_mode="create_savepoint",
+        expire_on_commit=False
+    )
     try:
         yield session
     finally:
-        session.rollback()
         session.close()
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture(scope="session")
+def app_client(test_settings):
+    """会话内共享的应用测试客户端
+
+    使用 pytest-xdist 并行运行时每个 worker 各自创建一个。不进入上下文管理器，不触发应用的 lifespan。
+    GitLab 与 OpenAI 客户端在创建应用期间被替换，合并请求的后台评审替换为异步模拟，请求不会访问外部服务。
+    创建后预热一次：编译提示词模板，并发送一个会被忽略的事件走通路由和请求解析，
+    避免这些一次性开销落进第一个计时测试的首次迭代。
+    """
+    from fastapi.testclient import TestClient
+    from utils import warmup_templates
+
+    with patch('review_manager.Gitlab'), patch('llm.OpenAIClient'):
+        from main import create_app
+        app = create_app(test_settings)
+    app.state.review_manager.process_merge_request_event = AsyncMock(return_value=True)
+
+    warmup_templates()
+
+    client = TestClient(app)
+    client.post("/", content=b'{"object_kind": "ping"}', headers={"content-type": "application/json"})
+    return client
 
 
 @pytest.fixture(scope="session")
@@ -76,38 +166,67 @@ def init_test_i18n():
 
 
 @pytest.fixture
-def mock_gitlab_client():
-    """模拟 GitLab 客户端"""
-    mock_client = Mock()
-    mock_project = Mock()
-    mock_project.id = 1
-    mock_project.path_with_namespace = "test/repo"
-    
-    mock_mr = Mock()
-    mock_mr.iid = 123
-    mock_mr.changes.return_value = {
-        'changes': [
-            {
-                'old_path': 'test.py',
-                'new_path': 'test.py',
-                'diff': '@@ -1,3 +1,4 @@\n def hello():\n-    print("hello")\n+    print("hello world")\n+    return True',
-                'new_file': False,
-                'deleted_file': False,
-                'renamed_file': False
-            }
-        ]
-    }
-    
-    mock_client.projects.get.return_value = mock_project
-    mock_project.mergerequests.get.return_value = mock_mr
-    
-    return mock_client
+def mock_discussion():
+    """模拟合并请求讨论，discussions.get 返回该对象"""
+    return SimpleNamespace(
+        id='discussion_123',
+        resolved=False,
+        asdict=Mock(return_value={'id': 'discussion_123', 'resolved': False, 'notes': []}),
+        notes=SimpleNamespace(create=Mock()),
+        save=Mock()
+    )
+
+
+@pytest.fixture
+def mock_mr(mock_discussion):
+    """模拟处于打开状态、尚未批准的合并请求，测试只需覆盖 changes.return_value
+
+    只有被测试配置或断言的可调用对象使用 Mock，其余数据字段用 SimpleNamespace 承载。
+    """
+    return SimpleNamespace(
+        iid=123,
+        state='opened',
+        approvals=SimpleNamespace(get=Mock(return_value=SimpleNamespace(approved=False))),
+        discussions=SimpleNamespace(
+            create=Mock(return_value=mock_discussion),
+            get=Mock(return_value=mock_discussion)
+        ),
+        approve=Mock(),
+        changes=Mock(return_value={
+            'changes': [
+                {
+                    'old_path': 'test.py',
+                    'new_path': 'test.py',
+                    'diff': '@@ -1,3 +1,4 @@\n def hello():\n-    print("hello")\n+    print("hello world")\n+    return True',
+                    'new_file': False,
+                    'deleted_file': False,
+                    'renamed_file': False
+                }
+            ]
+        })
+    )
+
+
+@pytest.fixture
+def mock_project(mock_mr):
+    """模拟项目，mergerequests.get 返回 mock_mr"""
+    return SimpleNamespace(
+        id=1,
+        path_with_namespace="test/repo",
+        mergerequests=SimpleNamespace(get=Mock(return_value=mock_mr))
+    )
+
+
+@pytest.fixture
+def mock_gitlab_client(mock_project):
+    """模拟 GitLab 客户端，projects.get 返回 mock_project"""
+    return SimpleNamespace(projects=SimpleNamespace(get=Mock(return_value=mock_project)))
 
 
 @pytest.fixture
 def mock_llm_client():
     """模拟 LLM 客户端"""
-    mock_client = Mock()
+    mock_client = Mock(spec=OpenAI)
     mock_response = Mock()
     mock_response.choices = [Mock()]
     mock_response.choices[0].message.content = '''
@@ -127,6 +246,34 @@ def mock_llm_client():
     return mock_client
 
 
+@pytest.fixture
+def no_sleep(monkeypatch):
+    """跳过 LLM 重试间的实际等待，并记录每次等待的秒数"""
+    calls = []
+    monkeypatch.setattr('llm.time.sleep', calls.append)
+    return calls
+
+
+@pytest.fixture
+def mock_parse(mocker):
+    """替换 llm.parse_response，需要时由测试覆盖 return_value"""
+    return mocker.patch('llm.parse_response', return_value={'result': 'success', 'duration': 1.0})
+
+
+@pytest.fixture(scope="module")
+def patched_llm_service():
+    """模块内共享的 LLM Service 实例，OpenAIClient 只在构造时替换"""
+    with patch('llm.OpenAIClient'):
+        return Service(model="gpt-4")
+
+
+@pytest.fixture
+def llm_service(patched_llm_service, mock_llm_client):
+    """共享的 LLM Service 实例，每个测试换上独立的模拟客户端"""
+    patched_llm_service.client = mock_llm_client
+    return patched_llm_service
+
+
 @pytest.fixture
 def sample_change_data():
     """示例变更数据"""
@@ -157,32 +304,77 @@ def sample_llm_response():
     }
 
 
+def _populate_templates(template_dir: Path) -> None:
+    """写入测试用的模板文件"""
+    (template_dir / 'file_system_zh_CN.j2').write_text(
+        '你是一个代码审查助手。请审查以下代码变更。'
+    )
+    (template_dir / 'file_system_en_US.j2').write_text(
+        'You are a code review assistant. Please review the following code changes.'
+    )
+    (template_dir / 'file_user_i18n.j2').write_text(
+        '文件路径: {{ change.new_path }}\n差异:\n{{ change.diff }}'
+    )
+    (template_dir / 'discussion_i18n.j2').write_text(
+        '## 代码审查结果\n\n评分: {{ score }}/10\n\n总结: {{ summary }}'
+    )
+
+
 @pytest.fixture
 def temp_template_dir():
-    """临时模板目录"""
+    """临时模板目录，测试可以在其中增删模板"""
     with tempfile.TemporaryDirectory() as temp_dir:
         template_dir = Path(temp_dir)
-        
-        # 创建测试模板文件
-        (template_dir / 'file_system_zh_CN.j2').write_text(
-            '你是一个代码审查助手。请审查以下代码变更。'
-        )
-        (template_dir / 'file_system_en_US.j2').write_text(
-            'You are a code review assistant. Please review the following code changes.'
-        )
-        (template_dir / 'file_user_i18n.j2').write_text(
-            '文件路径: {{ change.new_path }}\n差异:\n{{ change.diff }}'
-        )
-        (template_dir / 'discussion_i18n.j2').write_text(
-            '## 代码审查结果\n\n评分: {{ score }}/10\n\n总结: {{ summary }}'
-        )
-        
+        _populate_templates(template_dir)
         yield template_dir
 
 
-@pytest.fixture(autouse=True)
+@pytest.fixture
+def temp_jinja_env(temp_template_dir, monkeypatch):
+    """让 utils 使用临时模板目录和全新的 Jinja2 环境
+
+    环境在首次渲染时才创建，测试可以先增删模板文件；环境和模板缓存在测试结束后恢复，不影响其他测试。
+    """
+    import utils
+    monkeypatch.setattr(utils, 'TEMPLATE_DIR', temp_template_dir)
+    monkeypatch.setattr(utils, '_env', None)
+    monkeypatch.setattr(utils, '_templates', {})
+    monkeypatch.setattr(utils, '_file_system_prompts', {})
+    return temp_template_dir
+
+
+@pytest.fixture(scope="session")
+def _shared_jinja_state(tmp_path_factory):
+    """会话内共享的只读模板目录，以及在其上创建的 Jinja2 环境和模板缓存"""
+    template_dir = tmp_path_factory.mktemp('templates')
+    _populate_templates(template_dir)
+    return SimpleNamespace(template_dir=template_dir, env=None, templates={}, prompts={})
+
+
+@pytest.fixture
+def shared_jinja_env(_shared_jinja_state, monkeypatch):
+    """让 utils 使用会话内共享的 Jinja2 环境
+
+    模板目录和编译后的模板在整个会话中（xdist 下每个 worker）只创建一次，
+    适用于不修改模板文件、也不依赖缓存为空的测试。
+    """
+    import utils
+    state = _shared_jinja_state
+    monkeypatch.setattr(utils, 'TEMPLATE_DIR', state.template_dir)
+    monkeypatch.setattr(utils, '_env', state.env)
+    monkeypatch.setattr(utils, '_templates', state.templates)
+    monkeypatch.setattr(utils, '_file_system_prompts', state.prompts)
+    state.env = utils._get_jinja_env()
+    return state.env
+
+
+@pytest.fixture(scope="session", autouse=True)
 def setup_test_env(test_settings, init_test_i18n):
-    """自动设置测试环境"""
-    # 使用 patch 替换配置
-    with patch('config.settings', test_settings):
-        yield
\ No newline at end of file
+    """自动设置测试环境
+
+    整个测试会话只替换一次配置；需要单独修改配置的测试请使用 monkeypatch。
+    """
+    patcher = patch('config.settings', test_settings)
+    patcher.start()
+    yield
+    patcher.stop()
\ No newline at end of file
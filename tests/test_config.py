@@ -4,11 +4,12 @@
 配置模块测试
 """
 
+import io
 import os
-import tempfile
 from unittest.mock import patch
 
 import pytest
+from dotenv import dotenv_values
 from sqlalchemy import URL
 
 from config import Settings, engine_url, engine_config
@@ -131,23 +132,15 @@ class TestConfigIntegration:
     
     def test_dotenv_loading(self):
         """测试 .env 文件加载"""
-        with tempfile.NamedTemporaryFile(mode='w', suffix='.env', delete=False) as f:
-            f.write("GITLAB_URL=https://test.gitlab.com\n")
-            f.write("DEBUG=true\n")
-            env_file = f.name
+        values = dotenv_values(stream=io.StringIO(
+            "GITLAB_URL=https://test.gitlab.com\n"
+            "DEBUG=true\n"
+        ))
         
-        try:
-            # 模拟加载 .env 文件
-            with patch('config.load_dotenv') as mock_load_dotenv:
-                with patch.dict(os.environ, {
-                    "GITLAB_URL": "https://test.gitlab.com",
-                    "DEBUG": "true"
-                }):
-                    settings = Settings()
-                    assert settings.gitlab_url == "https://test.gitlab.com"
-                    assert settings.debug is True
-        finally:
-            os.unlink(env_file)
+        with patch.dict(os.environ, values):
+            settings = Settings()
+            assert settings.gitlab_url == "https://test.gitlab.com"
+            assert settings.debug is True
     
     def test_settings_validation(self):
         """测试设置验证"""
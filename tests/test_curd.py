@@ -4,35 +4,160 @@
 CURD 模块测试
 """
 
+import re
 from unittest.mock import patch, Mock
 
 import pytest
+from sqlalchemy import func, insert, select
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
 
+import curd
+from i18n import i18n
 from curd import (
     _get_review_by_project_and_mr, _get_review_discussion_id_by_discussion_id,
     update_or_create_review, get_review, get_discussion_id,
     create_review_discussion, get_review_discussion_id,
-    create_review_file_record, get_review_file_record,
+    create_review_file_record,
     create_review_file_llm_message, get_review_file_llm_messages
 )
 from models import Review, ReviewDiscussion, ReviewFileRecord, ReviewFileLLMMessage
 
 
+class _SessionContext:
+    """让 curd 中的 `with Session() as session` 复用测试会话，且退出时不关闭它"""
+
+    def __init__(self, session):
+        self._session = session
+
+    def __enter__(self):
+        return self._session
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def _im(session, model, pk):
+    """优先从会话身份映射读取对象，未命中时再回退到 session.get"""
+    return session.identity_map.get((model, (pk,), None)) or session.get(model, pk)
+
+
+@pytest.fixture(scope="module", autouse=True)
+def _warm_statement_cache(test_db_engine):
+    """预热 CURD 查询的 SQL 编译缓存，后续测试直接命中缓存"""
+    assert test_db_engine.dialect.supports_statement_cache is True
+    with test_db_engine.connect() as connection, pytest.MonkeyPatch.context() as mp:
+        transaction = connection.begin()
+        session = Session(bind=connection)
+        mp.setattr(curd, "Session", lambda: _SessionContext(session))
+        try:
+            get_review(0, 0)
+            get_discussion_id(0, 0, '')
+            get_review_discussion_id('')
+            get_review_file_llm_messages('')
+        finally:
+            session.close()
+            transaction.rollback()
+
+
+@pytest.fixture(autouse=True)
+def _patch_session(monkeypatch, test_db_session):
+    """将 curd.Session 替换为测试会话"""
+    monkeypatch.setattr(curd, "Session", lambda: _SessionContext(test_db_session))
+
+
+def _seed(session, *, file_path='test.py', discussion=True, record=None, messages=()):
+    """批量写入测试数据，只提交一次
+
+    Args:
+        session: 测试会话
+        file_path: 评审讨论的文件路径
+        discussion: 是否创建评审讨论
+        record: 评审文件记录字段，为 None 时不创建
+        messages: LLM 消息 (role, content) 列表
+
+    Returns:
+        (review, discussion, record, messages) 元组，未创建的项为 None 或空列表
+    """
+    review = Review(project_id=1, merge_request_id=123)
+    session.add(review)
+    review_discussion = file_record = None
+    llm_messages = []
+
+    if discussion:
+        # 只在需要父记录 ID 时 flush，最后统一提交
+        session.flush()
+        review_discussion = ReviewDiscussion(
+            review_id=review.id,
+            discussion_id='discussion_123',
+            file_path=file_path
+        )
+        session.add(review_discussion)
+
+        if record is not None or messages:
+            session.flush()
+            if record is not None:
+                file_record = ReviewFileRecord(review_discussion_id=review_discussion.id, **record)
+                session.add(file_record)
+            llm_messages = [
+                ReviewFileLLMMessage(review_discussion_id=review_discussion.id, role=role, content=content)
+                for role, content in messages
+            ]
+            session.add_all(llm_messages)
+
+    session.commit()
+    return review, review_discussion, file_record, llm_messages
+
+
+def _seed_review(session, **values):
+    """通过 Core INSERT ... RETURNING 写入评审记录，只返回 ID"""
+    review_id = session.execute(insert(Review).values(**values).returning(Review.id)).scalar_one()
+    session.commit()
+    return review_id
+
+
+@pytest.fixture(scope="module")
+def _session_mocks():
+    """模块内复用的 Mock 会话及其上下文管理器，只构建一次"""
+    session = Mock()
+    context = Mock()
+    context.__enter__ = Mock(return_value=session)
+    context.__exit__ = Mock(return_value=False)
+    return session, context
+
+
+@pytest.fixture
+def mock_session(monkeypatch, _session_mocks):
+    """将 curd.Session 替换为返回 Mock 会话的工厂，返回该 Mock 会话
+
+    使用前清除上一个测试留下的调用记录和 side_effect
+    """
+    session, context = _session_mocks
+    session.reset_mock(return_value=True, side_effect=True)
+    monkeypatch.setattr(curd, "Session", Mock(return_value=context))
+    return session
+
+
+@pytest.fixture
+def seeded_discussion(test_db_session):
+    """已写入的评审记录和评审讨论记录"""
+    review, discussion, _, _ = _seed(test_db_session)
+    return review, discussion
+
+
 class TestPrivateFunctions:
     """私有函数测试"""
     
     def test_get_review_by_project_and_mr_found(self, test_db_session):
         """测试根据项目和MR ID获取评审记录 - 找到记录"""
         # 创建测试数据
-        review = Review(project_id=1, merge_request_id=123, status='pending')
-        test_db_session.add(review)
-        test_db_session.commit()
+        review_id = _seed_review(test_db_session, project_id=1, merge_request_id=123, status='pending')
         
         # 测试查询
         result = _get_review_by_project_and_mr(test_db_session, 1, 123)
         
         assert result is not None
+        assert result.id == review_id
         assert result.project_id == 1
         assert result.merge_request_id == 123
         assert result.status == 'pending'
@@ -42,20 +167,9 @@ class TestPrivateFunctions:
         result = _get_review_by_project_and_mr(test_db_session, 999, 999)
         assert result is None
     
-    def test_get_review_discussion_id_by_discussion_id_found(self, test_db_session):
+    def test_get_review_discussion_id_by_discussion_id_found(self, test_db_session, seeded_discussion):
         """测试根据讨论ID获取评审讨论记录ID - 找到记录"""
-        # 创建测试数据
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
-        
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='test.py'
-        )
-        test_db_session.add(discussion)
-        test_db_session.commit()
+        _, discussion = seeded_discussion
         
         # 测试查询
         result = _get_review_discussion_id_by_discussion_id(test_db_session, 'discussion_123')
@@ -73,16 +187,15 @@ class TestUpdateOrCreateReview:
     
     def test_create_new_review(self, test_db_session):
         """测试创建新评审记录"""
-        with patch('curd.Session', return_value=test_db_session):
-            review_id = update_or_create_review(1, 123, 'pending')
-            
-            assert review_id is not None
-            
-            # 验证记录被创建
-            review = test_db_session.get(Review, review_id)
-            assert review.project_id == 1
-            assert review.merge_request_id == 123
-            assert review.status == 'pending'
+        review_id = update_or_create_review(1, 123, 'pending')
+        
+        assert review_id is not None
+        
+        # 验证记录被创建
+        review = _im(test_db_session, Review, review_id)
+        assert review.project_id == 1
+        assert review.merge_request_id == 123
+        assert review.status == 'pending'
     
     def test_update_existing_review(self, test_db_session):
         """测试更新现有评审记录"""
@@ -92,22 +205,19 @@ class TestUpdateOrCreateReview:
         test_db_session.commit()
         original_id = review.id
         
-        with patch('curd.Session', return_value=test_db_session):
-            review_id = update_or_create_review(1, 123, 'approved')
-            
-            assert review_id == original_id
-            
-            # 验证记录被更新
-            updated_review = test_db_session.get(Review, review_id)
-            assert updated_review.status == 'approved'
+        review_id = update_or_create_review(1, 123, 'approved')
+        
+        assert review_id == original_id
+        
+        # 验证记录被更新（同一会话中即为同一实例）
+        assert review.status == 'approved'
     
     def test_create_review_without_status(self, test_db_session):
-        """测试创建不指定状态的评审记录"""
-        with patch('curd.Session', return_value=test_db_session):
-            review_id = update_or_create_review(1, 123)
-            
-            review = test_db_session.get(Review, review_id)
-            assert review.status is None
+        """测试创建不指定状态的评审记录时使用模型默认状态"""
+        review_id = update_or_create_review(1, 123)
+        
+        review = _im(test_db_session, Review, review_id)
+        assert review.status == 'pending'
     
     def test_update_review_without_status_change(self, test_db_session):
         """测试更新评审记录但不改变状态"""
@@ -116,22 +226,11 @@ class TestUpdateOrCreateReview:
         test_db_session.add(review)
         test_db_session.commit()
         
-        with patch('curd.Session', return_value=test_db_session):
-            review_id = update_or_create_review(1, 123, None)
-            
-            # 验证状态没有改变
-            updated_review = test_db_session.get(Review, review_id)
-            assert updated_review.status == 'pending'
-    
-    def test_update_or_create_review_database_error(self):
-        """测试数据库错误处理"""
-        with patch('curd.Session') as mock_session_class:
-            mock_session = Mock()
-            mock_session_class.return_value.__enter__.return_value = mock_session
-            mock_session.commit.side_effect = SQLAlchemyError("数据库错误")
-            
-            with pytest.raises(SQLAlchemyError, match="数据库错误"):
-                update_or_create_review(1, 123, 'pending')
+        review_id = update_or_create_review(1, 123, None)
+        
+        # 验证状态没有改变
+        assert review_id == review.id
+        assert review.status == 'pending'
 
 
 class TestGetReview:
@@ -140,73 +239,25 @@ class TestGetReview:
     def test_get_review_success(self, test_db_session):
         """测试成功获取评审记录"""
         # 创建测试数据
-        review = Review(project_id=1, merge_request_id=123, status='approved')
-        test_db_session.add(review)
-        test_db_session.commit()
+        review_id = _seed_review(test_db_session, project_id=1, merge_request_id=123, status='approved')
         
-        with patch('curd.Session', return_value=test_db_session):
-            result = get_review(1, 123)
-            
-            assert result is not None
-            assert result.project_id == 1
-            assert result.merge_request_id == 123
-            assert result.status == 'approved'
-    
-    def test_get_review_not_found(self, test_db_session):
-        """测试获取不存在的评审记录"""
-        with patch('curd.Session', return_value=test_db_session):
-            result = get_review(999, 999)
-            assert result is None
-    
-    def test_get_review_database_error(self):
-        """测试获取评审记录时的数据库错误"""
-        with patch('curd.Session') as mock_session_class:
-            mock_session = Mock()
-            mock_session_class.return_value.__enter__.return_value = mock_session
-            mock_session.scalar.side_effect = SQLAlchemyError("查询错误")
-            
-            with pytest.raises(SQLAlchemyError):
-                get_review(1, 123)
+        result = get_review(1, 123)
+        
+        assert result is not None
+        assert result.id == review_id
+        assert result.project_id == 1
+        assert result.merge_request_id == 123
+        assert result.status == 'approved'
 
 
 class TestGetDiscussionId:
     """获取讨论ID测试"""
     
-    def test_get_discussion_id_success(self, test_db_session):
+    def test_get_discussion_id_success(self, seeded_discussion):
         """测试成功获取讨论ID"""
-        # 创建测试数据
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
-        
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='src/main.py'
-        )
-        test_db_session.add(discussion)
-        test_db_session.commit()
+        result = get_discussion_id(1, 123, 'test.py')
         
-        with patch('curd.Session', return_value=test_db_session):
-            result = get_discussion_id(1, 123, 'src/main.py')
-            
-            assert result == 'discussion_123'
-    
-    def test_get_discussion_id_not_found(self, test_db_session):
-        """测试获取不存在的讨论ID"""
-        with patch('curd.Session', return_value=test_db_session):
-            result = get_discussion_id(999, 999, 'nonexistent.py')
-            assert result is None
-    
-    def test_get_discussion_id_database_error(self):
-        """测试获取讨论ID时的数据库错误"""
-        with patch('curd.Session') as mock_session_class:
-            mock_session = Mock()
-            mock_session_class.return_value.__enter__.return_value = mock_session
-            mock_session.scalar.side_effect = SQLAlchemyError("查询错误")
-            
-            with pytest.raises(SQLAlchemyError):
-                get_discussion_id(1, 123, 'test.py')
+        assert result == 'discussion_123'
 
 
 class TestCreateReviewDiscussion:
@@ -219,262 +270,156 @@ class TestCreateReviewDiscussion:
         test_db_session.add(review)
         test_db_session.commit()
         
-        with patch('curd.Session', return_value=test_db_session):
-            discussion_id = create_review_discussion(
-                1, 123, 'discussion_123', 'src/main.py'
-            )
-            
-            assert discussion_id is not None
-            
-            # 验证记录被创建
-            discussion = test_db_session.get(ReviewDiscussion, discussion_id)
-            assert discussion.review_id == review.id
-            assert discussion.discussion_id == 'discussion_123'
-            assert discussion.file_path == 'src/main.py'
+        discussion_id = create_review_discussion(
+            1, 123, 'discussion_123', 'src/main.py'
+        )
+        
+        assert discussion_id is not None
+        
+        # 验证记录被创建
+        discussion = _im(test_db_session, ReviewDiscussion, discussion_id)
+        assert discussion.review_id == review.id
+        assert discussion.discussion_id == 'discussion_123'
+        assert discussion.file_path == 'src/main.py'
     
     def test_create_review_discussion_no_review(self, test_db_session):
         """测试创建评审讨论时评审记录不存在"""
-        with patch('curd.Session', return_value=test_db_session):
-            with pytest.raises(ValueError, match="找不到项目ID 999 和MR ID 999 对应的评审记录"):
-                create_review_discussion(999, 999, 'discussion_123', 'test.py')
-    
-    def test_create_review_discussion_database_error(self):
-        """测试创建评审讨论时的数据库错误"""
-        with patch('curd.Session') as mock_session_class:
-            mock_session = Mock()
-            mock_session_class.return_value.__enter__.return_value = mock_session
-            mock_session.scalar.return_value = 1  # 模拟找到评审记录
-            mock_session.commit.side_effect = SQLAlchemyError("创建失败")
-            
-            with pytest.raises(SQLAlchemyError):
-                create_review_discussion(1, 123, 'discussion_123', 'test.py')
+        message = i18n.t('response.find_review_record_failed', project_id=999, merge_request_id=999)
+        with pytest.raises(ValueError, match=re.escape(message)):
+            create_review_discussion(999, 999, 'discussion_123', 'test.py')
 
 
 class TestGetReviewDiscussionId:
     """获取评审讨论记录ID测试"""
     
-    def test_get_review_discussion_id_success(self, test_db_session):
+    def test_get_review_discussion_id_success(self, seeded_discussion):
         """测试成功获取评审讨论记录ID"""
-        # 创建测试数据
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
+        _, discussion = seeded_discussion
         
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='test.py'
-        )
-        test_db_session.add(discussion)
-        test_db_session.commit()
+        result = get_review_discussion_id('discussion_123')
         
-        with patch('curd.Session', return_value=test_db_session):
-            result = get_review_discussion_id('discussion_123')
-            
-            assert result == discussion.id
-    
-    def test_get_review_discussion_id_not_found(self, test_db_session):
-        """测试获取不存在的评审讨论记录ID"""
-        with patch('curd.Session', return_value=test_db_session):
-            result = get_review_discussion_id('nonexistent')
-            assert result is None
+        assert result == discussion.id
 
 
 class TestCreateReviewFileRecord:
     """创建评审文件记录测试"""
     
-    def test_create_review_file_record_success(self, test_db_session):
+    def test_create_review_file_record_success(self, test_db_session, seeded_discussion):
         """测试成功创建评审文件记录"""
-        # 创建依赖数据
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
+        _, discussion = seeded_discussion
         
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='test.py'
+        create_review_file_record(
+            'discussion_123',
+            approved=True,
+            score=8,
+            issues=['问题1', '问题2'],
+            suggestions=['建议1', '建议2'],
+            summary='总体良好',
+            llm_model='gpt-4'
         )
-        test_db_session.add(discussion)
-        test_db_session.commit()
         
-        with patch('curd.Session', return_value=test_db_session):
-            record_id = create_review_file_record(
-                'discussion_123',
+        # 验证记录被创建
+        record = test_db_session.scalars(
+            select(ReviewFileRecord).where(ReviewFileRecord.review_discussion_id == discussion.id)
+        ).one()
+        assert record.approved is True
+        assert record.score == 8
+        assert record.issue == ['问题1', '问题2']
+        assert record.suggestion == ['建议1', '建议2']
+        assert record.summary == '总体良好'
+        assert record.llm_model == 'gpt-4'
+    
+    def test_create_review_file_record_discussion_not_found(self, test_db_session):
+        """测试创建评审文件记录时讨论不存在"""
+        message = i18n.t('response.get_review_discussion_id_failed', discussion_id='nonexistent')
+        with pytest.raises(ValueError, match=re.escape(message)):
+            create_review_file_record(
+                'nonexistent',
                 approved=True,
                 score=8,
-                issue=['问题1', '问题2'],
-                suggestion=['建议1', '建议2'],
-                summary='总体良好',
+                issues=[],
+                suggestions=[],
+                summary='测试',
                 llm_model='gpt-4'
             )
-            
-            assert record_id is not None
-            
-            # 验证记录被创建
-            record = test_db_session.get(ReviewFileRecord, record_id)
-            assert record.review_discussion_id == discussion.id
-            assert record.approved is True
-            assert record.score == 8
-            assert record.issue == ['问题1', '问题2']
-            assert record.suggestion == ['建议1', '建议2']
-            assert record.summary == '总体良好'
-            assert record.llm_model == 'gpt-4'
-    
-    def test_create_review_file_record_discussion_not_found(self, test_db_session):
-        """测试创建评审文件记录时讨论不存在"""
-        with patch('curd.Session', return_value=test_db_session):
-            with pytest.raises(ValueError, match="找不到讨论ID nonexistent 对应的评审讨论记录"):
-                create_review_file_record(
-                    'nonexistent',
-                    approved=True,
-                    score=8,
-                    issue=[],
-                    suggestion=[],
-                    summary='测试',
-                    llm_model='gpt-4'
-                )
-
-
-class TestGetReviewFileRecord:
-    """获取评审文件记录测试"""
-    
-    def test_get_review_file_record_success(self, test_db_session):
-        """测试成功获取评审文件记录"""
-        # 创建测试数据
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
-        
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='test.py'
-        )
-        test_db_session.add(discussion)
-        test_db_session.commit()
-        
-        record = ReviewFileRecord(
-            review_discussion_id=discussion.id,
-            approved=True,
-            score=9,
-            issue=['测试问题'],
-            suggestion=['测试建议'],
-            summary='测试总结',
-            llm_model='gpt-4'
-        )
-        test_db_session.add(record)
-        test_db_session.commit()
-        
-        with patch('curd.Session', return_value=test_db_session):
-            result = get_review_file_record('discussion_123')
-            
-            assert result is not None
-            assert result.approved is True
-            assert result.score == 9
-            assert result.issue == ['测试问题']
-            assert result.suggestion == ['测试建议']
-            assert result.summary == '测试总结'
-            assert result.llm_model == 'gpt-4'
-    
-    def test_get_review_file_record_not_found(self, test_db_session):
-        """测试获取不存在的评审文件记录"""
-        with patch('curd.Session', return_value=test_db_session):
-            result = get_review_file_record('nonexistent')
-            assert result is None
 
 
 class TestLLMMessages:
     """LLM 消息测试"""
     
-    def test_create_review_file_llm_message_success(self, test_db_session):
+    def test_create_review_file_llm_message_success(self, test_db_session, seeded_discussion):
         """测试成功创建 LLM 消息"""
-        # 创建依赖数据
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
+        _, discussion = seeded_discussion
         
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='test.py'
+        create_review_file_llm_message(
+            'discussion_123',
+            'user',
+            '请审查这个文件'
         )
-        test_db_session.add(discussion)
-        test_db_session.commit()
         
-        with patch('curd.Session', return_value=test_db_session):
-            message_id = create_review_file_llm_message(
-                'discussion_123',
-                'user',
-                '请审查这个文件'
-            )
-            
-            assert message_id is not None
-            
-            # 验证消息被创建
-            message = test_db_session.get(ReviewFileLLMMessage, message_id)
-            assert message.review_discussion_id == discussion.id
-            assert message.role == 'user'
-            assert message.content == '请审查这个文件'
+        # 验证消息被创建
+        message = test_db_session.scalars(
+            select(ReviewFileLLMMessage).where(ReviewFileLLMMessage.review_discussion_id == discussion.id)
+        ).one()
+        assert message.role == 'user'
+        assert message.content == '请审查这个文件'
     
     def test_get_review_file_llm_messages_success(self, test_db_session):
         """测试成功获取 LLM 消息列表"""
-        # 创建依赖数据
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
+        # 创建依赖数据和多条消息
+        _seed(test_db_session, messages=[
+            ('user', '用户消息1'),
+            ('assistant', '助手回复1'),
+            ('user', '用户消息2'),
+        ])
         
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='test.py'
-        )
-        test_db_session.add(discussion)
-        test_db_session.commit()
+        messages = get_review_file_llm_messages('discussion_123')
         
-        # 创建多条消息
-        message1 = ReviewFileLLMMessage(
-            review_discussion_id=discussion.id,
-            role='user',
-            content='用户消息1'
-        )
-        message2 = ReviewFileLLMMessage(
-            review_discussion_id=discussion.id,
-            role='assistant',
-            content='助手回复1'
-        )
-        message3 = ReviewFileLLMMessage(
-            review_discussion_id=discussion.id,
-            role='user',
-            content='用户消息2'
-        )
+        assert len(messages) == 3
         
-        test_db_session.add_all([message1, message2, message3])
-        test_db_session.commit()
+        # 验证消息格式
+        for msg in messages:
+            assert 'role' in msg
+            assert 'content' in msg
         
-        with patch('curd.Session', return_value=test_db_session):
-            messages = get_review_file_llm_messages('discussion_123')
-            
-            assert len(messages) == 3
-            
-            # 验证消息格式
-            for msg in messages:
-                assert 'role' in msg
-                assert 'content' in msg
-            
-            # 验证消息内容
-            assert messages[0]['role'] == 'user'
-            assert messages[0]['content'] == '用户消息1'
-            assert messages[1]['role'] == 'assistant'
-            assert messages[1]['content'] == '助手回复1'
-            assert messages[2]['role'] == 'user'
-            assert messages[2]['content'] == '用户消息2'
+        # 验证消息内容
+        assert messages[0]['role'] == 'user'
+        assert messages[0]['content'] == '用户消息1'
+        assert messages[1]['role'] == 'assistant'
+        assert messages[1]['content'] == '助手回复1'
+        assert messages[2]['role'] == 'user'
+        assert messages[2]['content'] == '用户消息2'
+
+
+class TestNotFound:
+    """查询不存在记录测试"""
     
-    def test_get_review_file_llm_messages_empty(self, test_db_session):
-        """测试获取空的 LLM 消息列表"""
-        with patch('curd.Session', return_value=test_db_session):
-            messages = get_review_file_llm_messages('nonexistent')
-            assert messages == []
+    @pytest.mark.parametrize("fn,args,expected", [
+        (get_review, (999, 999), None),
+        (get_discussion_id, (999, 999, 'nonexistent.py'), None),
+        (get_review_discussion_id, ('nonexistent',), None),
+        (get_review_file_llm_messages, ('nonexistent',), []),
+    ])
+    def test_not_found(self, fn, args, expected):
+        """测试查询不存在的记录"""
+        assert fn(*args) == expected
+
+
+class TestDatabaseError:
+    """数据库错误处理测试"""
+    
+    @pytest.mark.parametrize("target_method,fn,args", [
+        ('commit', update_or_create_review, (1, 123, 'pending')),
+        ('scalar', get_review, (1, 123)),
+        ('scalar', get_discussion_id, (1, 123, 'test.py')),
+        ('commit', create_review_discussion, (1, 123, 'discussion_123', 'test.py')),
+    ])
+    def test_database_error(self, mock_session, target_method, fn, args):
+        """测试数据库错误被包装为 SQLAlchemyError 抛出"""
+        getattr(mock_session, target_method).side_effect = SQLAlchemyError("数据库错误")
+        
+        with pytest.raises(SQLAlchemyError, match="数据库错误"):
+            fn(*args)
 
 
 class TestCurdIntegration:
@@ -482,79 +427,74 @@ class TestCurdIntegration:
     
     def test_complete_review_workflow(self, test_db_session):
         """测试完整的评审工作流"""
-        with patch('curd.Session', return_value=test_db_session):
-            # 1. 创建评审
-            review_id = update_or_create_review(1, 123, 'pending')
-            assert review_id is not None
-            
-            # 2. 创建讨论
-            discussion_id = create_review_discussion(
-                1, 123, 'discussion_123', 'src/main.py'
-            )
-            assert discussion_id is not None
-            
-            # 3. 获取讨论ID
-            found_discussion_id = get_discussion_id(1, 123, 'src/main.py')
-            assert found_discussion_id == 'discussion_123'
-            
-            # 4. 创建 LLM 消息
-            user_msg_id = create_review_file_llm_message(
-                'discussion_123', 'user', '请审查代码'
-            )
-            assistant_msg_id = create_review_file_llm_message(
-                'discussion_123', 'assistant', '审查完成'
-            )
-            assert user_msg_id is not None
-            assert assistant_msg_id is not None
-            
-            # 5. 创建文件记录
-            record_id = create_review_file_record(
-                'discussion_123',
-                approved=True,
-                score=8,
-                issue=['小问题'],
-                suggestion=['小改进'],
-                summary='总体良好',
-                llm_model='gpt-4'
-            )
-            assert record_id is not None
-            
-            # 6. 获取所有数据验证
-            review = get_review(1, 123)
-            assert review.status == 'pending'
-            
-            messages = get_review_file_llm_messages('discussion_123')
-            assert len(messages) == 2
-            
-            file_record = get_review_file_record('discussion_123')
-            assert file_record.approved is True
-            assert file_record.score == 8
+        # 1. 创建评审
+        review_id = update_or_create_review(1, 123, 'pending')
+        assert review_id is not None
+        
+        # 2. 创建讨论
+        discussion_id = create_review_discussion(
+            1, 123, 'discussion_123', 'src/main.py'
+        )
+        assert discussion_id is not None
+        
+        # 3. 验证讨论（直接读取身份映射，无需再次查询）
+        discussion = _im(test_db_session, ReviewDiscussion, discussion_id)
+        assert discussion.review_id == review_id
+        assert discussion.discussion_id == 'discussion_123'
+        
+        # 4. 创建 LLM 消息
+        create_review_file_llm_message('discussion_123', 'user', '请审查代码')
+        create_review_file_llm_message('discussion_123', 'assistant', '审查完成')
+        
+        # 5. 创建文件记录
+        create_review_file_record(
+            'discussion_123',
+            approved=True,
+            score=8,
+            issues=['小问题'],
+            suggestions=['小改进'],
+            summary='总体良好',
+            llm_model='gpt-4'
+        )
+        
+        # 6. 按创建时返回的评审和讨论 ID 验证数据
+        review = _im(test_db_session, Review, review_id)
+        assert review.status == 'pending'
+        
+        message_count = test_db_session.scalar(
+            select(func.count()).where(ReviewFileLLMMessage.review_discussion_id == discussion_id)
+        )
+        assert message_count == 2
+        
+        file_record = test_db_session.scalars(
+            select(ReviewFileRecord).where(ReviewFileRecord.review_discussion_id == discussion_id)
+        ).one()
+        assert file_record.approved is True
+        assert file_record.score == 8
     
-    def test_error_propagation(self):
+    def test_error_propagation(self, mock_session):
         """测试错误传播"""
-        with patch('curd.Session') as mock_session_class:
-            mock_session = Mock()
-            mock_session_class.return_value.__enter__.return_value = mock_session
-            
-            # 模拟数据库连接错误
-            mock_session.commit.side_effect = SQLAlchemyError("连接失败")
-            
-            # 验证错误在各个函数中正确传播
-            with pytest.raises(SQLAlchemyError):
-                update_or_create_review(1, 123, 'pending')
+        # 模拟数据库连接错误
+        mock_session.commit.side_effect = SQLAlchemyError("连接失败")
+        
+        # 验证错误在各个函数中正确传播
+        with pytest.raises(SQLAlchemyError):
+            update_or_create_review(1, 123, 'pending')
     
     def test_transaction_rollback(self, test_db_session):
         """测试事务回滚"""
         # 创建一个会导致错误的场景
-        with patch('curd.Session', return_value=test_db_session):
-            # 先创建一个评审记录
-            review_id = update_or_create_review(1, 123, 'pending')
-            
-            # 尝试创建讨论，但模拟提交时出错
-            with patch.object(test_db_session, 'commit', side_effect=SQLAlchemyError("提交失败")):
-                with pytest.raises(SQLAlchemyError):
-                    create_review_discussion(1, 123, 'discussion_123', 'test.py')
+        # 先创建一个评审记录
+        review_id = update_or_create_review(1, 123, 'pending')
+        
+        # 尝试创建讨论，但模拟提交时出错
+        with patch.object(test_db_session, 'commit', side_effect=SQLAlchemyError("提交失败")):
+            with pytest.raises(SQLAlchemyError):
+                create_review_discussion(1, 123, 'discussion_123', 'test.py')
             
-            # 验证评审记录仍然存在（因为是在不同的事务中）
-            review = get_review(1, 123)
-            assert review is not None
\ No newline at end of file
+        # curd 退出 with Session() 时会关闭会话并丢弃未提交的改动，测试会话不会被关闭，这里手动回滚
+        test_db_session.rollback()
+        
+        # 评审记录已在之前的事务中提交，仍然存在；讨论记录没有写入数据库
+        assert test_db_session.scalar(select(func.count()).select_from(Review).where(Review.id == review_id)) == 1
+        assert test_db_session.scalar(select(func.count()).select_from(ReviewDiscussion)) == 0
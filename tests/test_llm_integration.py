@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LLM 模块集成测试
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import pytest
+
+from tests.conftest import SIMPLE_MESSAGES
+
+
+pytestmark = [pytest.mark.integration, pytest.mark.usefixtures("no_sleep", "mock_parse")]
+
+# 不同的消息格式
+MESSAGE_FORMAT_CASES = [
+    # 单条用户消息
+    [{"role": "user", "content": "简单测试"}],
+    
+    # 系统消息 + 用户消息
+    [
+        {"role": "system", "content": "你是助手"},
+        {"role": "user", "content": "请帮助我"}
+    ],
+    
+    # 完整对话
+    [
+        {"role": "system", "content": "你是代码审查助手"},
+        {"role": "user", "content": "请审查代码"},
+        {"role": "assistant", "content": "我来帮你审查"},
+        {"role": "user", "content": "这是新的代码"}
+    ]
+]
+
+
+class TestLLMServiceIntegration:
+    """LLM 服务集成测试"""
+    
+    def test_complete_workflow(self, llm_service, mock_llm_client, mock_parse):
+        """测试完整工作流"""
+        mock_parse.return_value = {
+            'issues': ['缺少错误处理'],
+            'suggestions': ['添加try-catch块'],
+            'score': 7,
+            'summary': '代码质量良好',
+            'approved': True,
+            'duration': 2.0
+        }
+        
+        # 1. 检查服务
+        assert llm_service.check() is True
+        
+        # 2. 进行聊天
+        messages = [
+            {"role": "system", "content": "你是代码审查助手"},
+            {"role": "user", "content": "请审查这段代码"}
+        ]
+        
+        result = llm_service.chat(messages)
+        
+        # 3. 验证结果
+        assert result['issues'] == ['缺少错误处理']
+        assert result['suggestions'] == ['添加try-catch块']
+        assert result['score'] == 7
+        assert result['approved'] is True
+        assert 'duration' in result
+    
+    def test_error_recovery(self, llm_service, mock_llm_client):
+        """测试错误恢复"""
+        # 第一次检查失败，第二次成功
+        mock_llm_client.models.retrieve.side_effect = [
+            Exception("网络错误"),
+            SimpleNamespace(id="gpt-4")  # 成功响应
+        ]
+        
+        # 第一次检查失败
+        assert llm_service.check() is False
+        
+        # 第二次检查成功
+        assert llm_service.check() is True
+    
+    def test_concurrent_requests_simulation(self, llm_service, mock_llm_client):
+        """测试并发请求模拟"""
+        # 并发发起多个请求
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda _: llm_service.chat(SIMPLE_MESSAGES), range(5)))
+        
+        # 验证所有请求都成功
+        assert len(results) == 5
+        for result in results:
+            assert result['result'] == 'success'
+        
+        # 验证多线程下 API 仍恰好被调用了5次
+        assert mock_llm_client.chat.completions.create.call_count == 5
+    
+    @pytest.mark.parametrize("messages", MESSAGE_FORMAT_CASES)
+    def test_different_message_formats(self, llm_service, mock_llm_client, messages):
+        """测试不同的消息格式"""
+        result = llm_service.chat(messages)
+        assert result['result'] == 'success'
+        
+        # 验证该格式被正确处理
+        assert mock_llm_client.chat.completions.create.call_count == 1
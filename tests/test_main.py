@@ -4,471 +4,457 @@
 主应用模块测试
 """
 
-from unittest.mock import patch, Mock, MagicMock
-import json
+from types import SimpleNamespace
+from unittest.mock import Mock, MagicMock, patch
+import asyncio
+import functools
 import logging
+import sys
 
+import orjson
 import pytest
+from fastapi import FastAPI
 from fastapi.testclient import TestClient
-from fastapi import HTTPException
+from httpx import ASGITransport, AsyncClient
 
-# 需要在导入 main 之前设置模拟
-with patch('main.Settings'), \
-     patch('main.gitlab.Gitlab'), \
-     patch('main.LLMService'), \
-     patch('main.ReviewManager'), \
-     patch('main.init_i18n'):
-    from main import app, webhook_handler, review_manager
+from i18n import i18n
+
+# 导入 main 前预先放入桩模块，使其初始化时拿到的 GitLab 客户端、LLM 服务和审查管理器都是模拟对象；
+# 导入完成后立即恢复 sys.modules，避免桩模块影响其他测试模块
+_IMPORT_STUBS = {
+    'gitlab': MagicMock(),
+    'llm': MagicMock(),
+    'review_manager': MagicMock(),
+}
+_saved_modules = {name: sys.modules.get(name) for name in _IMPORT_STUBS}
+sys.modules.update(_IMPORT_STUBS)
+try:
+    from main import app, create_app, lifespan, setup_logging
+finally:
+    for _name, _module in _saved_modules.items():
+        if _module is None:
+            sys.modules.pop(_name, None)
+        else:
+            sys.modules[_name] = _module
+
+
+JSON_HEADERS = {"content-type": "application/json"}
+
+
+def queued_body():
+    """合并请求事件入队后的响应体，按当前语言取文案"""
+    return {"status": i18n.t('status.accepted'), "message": i18n.t('response.merge_request_queued')}
+
+
+def ignored_body(object_kind):
+    """非合并请求事件被忽略时的响应体，按当前语言取文案"""
+    return {
+        "status": i18n.t('status.ignored'),
+        "message": i18n.t('response.event_not_handled', event_type=object_kind)
+    }
+
+
+@functools.lru_cache(maxsize=64)
+def mr_payload_bytes(action, mr_id, project_id):
+    """构建最小的合并请求 webhook 负载并用 orjson 序列化，相同参数复用已编码的字节"""
+    return orjson.dumps({
+        "object_kind": "merge_request",
+        "event_type": "merge_request",
+        "object_attributes": {
+            "action": action,
+            "id": mr_id,
+            "target_project_id": project_id
+        },
+        "project": {
+            "id": project_id
+        }
+    })
+
+
+@pytest.fixture(params=[True, False], ids=["debug", "prod"])
+def created_app(request, monkeypatch):
+    """按调试/生产模式调用 create_app，并返回初始化时用到的模拟对象"""
+    mocks = SimpleNamespace(
+        debug=request.param,
+        review_manager=Mock(),
+        init_i18n=Mock()
+    )
+    monkeypatch.setattr('main.ReviewManager', mocks.review_manager)
+    monkeypatch.setattr('main.init_i18n', mocks.init_i18n)
+    
+    mocks.app = create_app(MagicMock(debug=request.param, locale="zh_CN"))
+    return mocks
+
+
+@pytest.fixture(scope="session")
+def test_app(test_settings):
+    """会话内共享的应用，用测试配置创建
+
+    测试配置开启调试模式，lifespan 只预热模板，不检查 GitLab 和 MySQL 连接
+    """
+    return create_app(test_settings)
+
+
+@pytest.fixture(scope="session")
+def client(test_app):
+    """会话内共享的测试客户端，应用的 lifespan 只执行一次
+
+    lifespan 中的日志配置被替换，测试运行不添加根日志器处理器，也不写 app.log
+    """
+    with patch('main.setup_logging'), TestClient(test_app) as test_client:
+        yield test_client
+
+
+@pytest.fixture(scope="module")
+def _process_mock():
+    """模块内复用的 process_merge_request_event 模拟对象"""
+    return Mock()
+
+
+@pytest.fixture
+def mock_process(monkeypatch, test_app, _process_mock):
+    """替换测试应用审查管理器的 process_merge_request_event，webhook 入队的后台任务调用的就是它"""
+    _process_mock.reset_mock(return_value=True, side_effect=True)
+    _process_mock.return_value = True
+    monkeypatch.setattr(test_app.state.review_manager, "process_merge_request_event", _process_mock)
+    return _process_mock
+
+
+@pytest.fixture(scope="session")
+def full_mr_payload_bytes():
+    """完整的 GitLab 合并请求 webhook 负载，用 orjson 只序列化一次"""
+    # 模拟一个完整的 GitLab webhook 负载
+    webhook_data = {
+        "object_kind": "merge_request",
+        "event_type": "merge_request",
+        "user": {
+            "id": 1,
+            "name": "Test User",
+            "username": "testuser",
+            "email": "test@example.com"
+        },
+        "project": {
+            "id": 1,
+            "name": "Test Project",
+            "description": "A test project",
+            "web_url": "https://gitlab.example.com/test/project",
+            "namespace": "test",
+            "visibility_level": 20
+        },
+        "object_attributes": {
+            "id": 123,
+            "target_branch": "main",
+            "source_branch": "feature/test",
+            "source_project_id": 1,
+            "target_project_id": 1,
+            "title": "Test merge request",
+            "description": "This is a test merge request",
+            "state": "opened",
+            "action": "open",
+            "merge_status": "can_be_merged",
+            "url": "https://gitlab.example.com/test/project/-/merge_requests/123",
+            "source": {
+                "name": "Test Project",
+                "description": "A test project",
+                "web_url": "https://gitlab.example.com/test/project",
+                "namespace": "test",
+                "visibility_level": 20
+            },
+            "target": {
+                "name": "Test Project",
+                "description": "A test project",
+                "web_url": "https://gitlab.example.com/test/project",
+                "namespace": "test",
+                "visibility_level": 20
+            },
+            "last_commit": {
+                "id": "abc123def456",
+                "message": "Add new feature",
+                "timestamp": "2023-01-01T12:00:00Z",
+                "url": "https://gitlab.example.com/test/project/-/commit/abc123def456",
+                "author": {
+                    "name": "Test User",
+                    "email": "test@example.com"
+                }
+            },
+            "work_in_progress": False,
+            "assignee_id": None,
+            "assignee_ids": [],
+            "reviewer_ids": []
+        },
+        "labels": [],
+        "changes": {
+            "updated_at": {
+                "previous": "2023-01-01T11:00:00Z",
+                "current": "2023-01-01T12:00:00Z"
+            }
+        },
+        "repository": {
+            "name": "Test Project",
+            "url": "git@gitlab.example.com:test/project.git",
+            "description": "A test project",
+            "homepage": "https://gitlab.example.com/test/project"
+        }
+    }
+    return orjson.dumps(webhook_data)
+
+
+@pytest.fixture(scope="session")
+def large_payload_bytes():
+    """包含大量数据的 webhook 负载，只构建并用 orjson 序列化一次"""
+    large_description = "This is a very long description. " * 1000  # 约 34KB
+    
+    webhook_data = {
+        "object_kind": "merge_request",
+        "event_type": "merge_request",
+        "object_attributes": {
+            "action": "open",
+            "id": 129,
+            "target_project_id": 1,
+            "description": large_description
+        },
+        "project": {"id": 1},
+        "changes": {
+            "files": [f"file_{i}.py" for i in range(100)]  # 100 个文件
+        }
+    }
+    return orjson.dumps(webhook_data)
 
 
 class TestAppInitialization:
     """应用初始化测试"""
     
-    def test_app_creation(self):
+    def test_app_creation(self, test_app, test_settings):
         """测试 FastAPI 应用创建"""
-        assert app is not None
-        assert app.title == "GitLab Code Review LLM Service"
-        assert app.version == "1.0.0"
+        assert isinstance(app, FastAPI)
+        assert test_app.state.settings is test_settings
+        assert test_app.url_path_for("system_hooks") == "/"
     
-    @patch('main.Settings')
-    @patch('main.gitlab.Gitlab')
-    @patch('main.LLMService')
-    @patch('main.ReviewManager')
-    @patch('main.init_i18n')
-    def test_dependencies_initialization(self, mock_init_i18n, mock_review_manager, 
-                                       mock_llm_service, mock_gitlab, mock_settings):
+    def test_dependencies_initialization(self, created_app):
         """测试依赖项初始化"""
-        # 重新导入以触发初始化
-        import importlib
-        import main
-        importlib.reload(main)
-        
         # 验证各个组件被正确初始化
-        mock_settings.assert_called_once()
-        mock_gitlab.assert_called_once()
-        mock_llm_service.assert_called_once()
-        mock_review_manager.assert_called_once()
-        mock_init_i18n.assert_called_once()
+        created_app.init_i18n.assert_called_once()
+        created_app.review_manager.assert_called_once()
+        assert created_app.app.state.review_manager is created_app.review_manager.return_value
 
 
 class TestWebhookHandler:
     """Webhook 处理器测试"""
     
-    def setup_method(self):
-        """测试设置"""
-        self.client = TestClient(app)
-    
-    def test_webhook_merge_request_opened(self):
-        """测试合并请求打开事件"""
-        webhook_data = {
-            "object_kind": "merge_request",
-            "event_type": "merge_request",
-            "object_attributes": {
-                "action": "open",
-                "id": 123,
-                "target_project_id": 1
-            },
-            "project": {
-                "id": 1
-            }
-        }
-        
-        with patch.object(review_manager, 'process_merge_request', return_value=True) as mock_process:
-            response = self.client.post("/webhook", json=webhook_data)
-            
-            assert response.status_code == 200
-            assert response.json() == {"status": "success", "message": "Merge request processed successfully"}
-            
-            # 验证处理器被调用
-            mock_process.assert_called_once_with(1, 123)
-    
-    def test_webhook_merge_request_updated(self):
-        """测试合并请求更新事件"""
-        webhook_data = {
-            "object_kind": "merge_request",
-            "event_type": "merge_request",
-            "object_attributes": {
-                "action": "update",
-                "id": 124,
-                "target_project_id": 2
-            },
-            "project": {
-                "id": 2
-            }
-        }
+    @pytest.mark.parametrize("action,mr_id,project_id", [
+        ("open", 123, 1),
+        ("update", 124, 2),
+        ("reopen", 125, 3)
+    ], ids=["opened", "updated", "reopen"])
+    def test_webhook_merge_request_queued(self, client, mock_process, action, mr_id, project_id):
+        """测试合并请求打开、更新和重新打开事件放入后台处理"""
+        payload = mr_payload_bytes(action, mr_id, project_id)
+        response = client.post("/", content=payload, headers=JSON_HEADERS)
         
-        with patch.object(review_manager, 'process_merge_request', return_value=True) as mock_process:
-            response = self.client.post("/webhook", json=webhook_data)
-            
-            assert response.status_code == 200
-            assert response.json() == {"status": "success", "message": "Merge request processed successfully"}
-            
-            mock_process.assert_called_once_with(2, 124)
-    
-    def test_webhook_merge_request_reopen(self):
-        """测试合并请求重新打开事件"""
-        webhook_data = {
-            "object_kind": "merge_request",
-            "event_type": "merge_request",
-            "object_attributes": {
-                "action": "reopen",
-                "id": 125,
-                "target_project_id": 3
-            },
-            "project": {
-                "id": 3
-            }
-        }
+        assert response.status_code == 200
+        assert response.json() == queued_body()
         
-        with patch.object(review_manager, 'process_merge_request', return_value=True) as mock_process:
-            response = self.client.post("/webhook", json=webhook_data)
-            
-            assert response.status_code == 200
-            mock_process.assert_called_once_with(3, 125)
+        # 验证后台任务收到完整的事件数据
+        mock_process.assert_called_once_with(orjson.loads(payload))
     
-    def test_webhook_merge_request_ignored_actions(self):
-        """测试忽略的合并请求动作"""
-        ignored_actions = ["close", "merge", "approved", "unapproved"]
+    @pytest.mark.parametrize("action", ["close", "merge", "approved", "unapproved"])
+    def test_webhook_merge_request_other_actions_queued(self, client, mock_process, action):
+        """测试其他合并请求动作同样入队，按动作筛选由审查管理器负责"""
+        payload = mr_payload_bytes(action, 126, 4)
+        response = client.post("/", content=payload, headers=JSON_HEADERS)
         
-        for action in ignored_actions:
-            webhook_data = {
-                "object_kind": "merge_request",
-                "event_type": "merge_request",
-                "object_attributes": {
-                    "action": action,
-                    "id": 126,
-                    "target_project_id": 4
-                },
-                "project": {
-                    "id": 4
-                }
-            }
-            
-            with patch.object(review_manager, 'process_merge_request') as mock_process:
-                response = self.client.post("/webhook", json=webhook_data)
-                
-                assert response.status_code == 200
-                assert response.json() == {"status": "ignored", "message": f"Action '{action}' is not processed"}
-                
-                # 验证处理器没有被调用
-                mock_process.assert_not_called()
+        assert response.status_code == 200
+        assert response.json() == queued_body()
+        mock_process.assert_called_once_with(orjson.loads(payload))
     
-    def test_webhook_non_merge_request_events(self):
+    @pytest.mark.parametrize("event_data", [
+        {"object_kind": "push", "event_type": "push"},
+        {"object_kind": "issue", "event_type": "issue"},
+        {"object_kind": "note", "event_type": "note"},
+        {"object_kind": "pipeline", "event_type": "pipeline"}
+    ], ids=["push", "issue", "note", "pipeline"])
+    def test_webhook_non_merge_request_events(self, client, mock_process, event_data):
         """测试非合并请求事件"""
-        non_mr_events = [
-            {"object_kind": "push", "event_type": "push"},
-            {"object_kind": "issue", "event_type": "issue"},
-            {"object_kind": "note", "event_type": "note"},
-            {"object_kind": "pipeline", "event_type": "pipeline"}
-        ]
+        response = client.post("/", content=orjson.dumps(event_data), headers=JSON_HEADERS)
         
-        for event_data in non_mr_events:
-            with patch.object(review_manager, 'process_merge_request') as mock_process:
-                response = self.client.post("/webhook", json=event_data)
-                
-                assert response.status_code == 200
-                assert response.json() == {"status": "ignored", "message": "Not a merge request event"}
-                
-                mock_process.assert_not_called()
+        assert response.status_code == 200
+        assert response.json() == ignored_body(event_data["object_kind"])
+        
+        mock_process.assert_not_called()
     
-    def test_webhook_missing_required_fields(self):
-        """测试缺少必需字段的 webhook"""
-        incomplete_data_sets = [
-            # 缺少 object_kind
+    @pytest.mark.parametrize("payload,status_key,message_key,call_count", [
+        # 缺少 object_kind，按未处理的事件类型忽略
+        (
             {
                 "event_type": "merge_request",
                 "object_attributes": {"action": "open", "id": 123, "target_project_id": 1}
             },
-            # 缺少 object_attributes
+            'status.ignored', 'response.event_not_handled', 0
+        ),
+        # 缺少 object_attributes
+        (
             {
                 "object_kind": "merge_request",
                 "event_type": "merge_request"
             },
-            # 缺少 action
+            'status.accepted', 'response.merge_request_queued', 1
+        ),
+        # 缺少 action
+        (
             {
                 "object_kind": "merge_request",
                 "event_type": "merge_request",
                 "object_attributes": {"id": 123, "target_project_id": 1}
             },
-            # 缺少 id
+            'status.accepted', 'response.merge_request_queued', 1
+        ),
+        # 缺少 id
+        (
             {
                 "object_kind": "merge_request",
                 "event_type": "merge_request",
                 "object_attributes": {"action": "open", "target_project_id": 1}
             },
-            # 缺少 target_project_id
+            'status.accepted', 'response.merge_request_queued', 1
+        ),
+        # 缺少 target_project_id
+        (
             {
                 "object_kind": "merge_request",
                 "event_type": "merge_request",
                 "object_attributes": {"action": "open", "id": 123}
-            }
-        ]
-        
-        for incomplete_data in incomplete_data_sets:
-            response = self.client.post("/webhook", json=incomplete_data)
-            
-            # 应该返回 400 错误或忽略
-            assert response.status_code in [200, 400]
-            
-            if response.status_code == 200:
-                # 如果返回 200，应该是忽略消息
-                response_data = response.json()
-                assert response_data["status"] in ["ignored", "error"]
-    
-    def test_webhook_processing_error(self):
-        """测试处理过程中的错误"""
-        webhook_data = {
-            "object_kind": "merge_request",
-            "event_type": "merge_request",
-            "object_attributes": {
-                "action": "open",
-                "id": 127,
-                "target_project_id": 5
             },
-            "project": {
-                "id": 5
-            }
-        }
+            'status.accepted', 'response.merge_request_queued', 1
+        )
+    ], ids=["object_kind", "object_attributes", "action", "id", "target_project_id"])
+    def test_webhook_missing_fields(self, client, mock_process, payload, status_key, message_key, call_count):
+        """测试缺少字段的 webhook
+
+        路由只按 object_kind 分发，不校验其他字段：合并请求事件照常入队，字段检查由审查管理器在后台完成
+        """
+        response = client.post("/", content=orjson.dumps(payload), headers=JSON_HEADERS)
         
-        # 模拟处理错误
-        with patch.object(review_manager, 'process_merge_request', 
-                         side_effect=Exception("Processing failed")) as mock_process:
-            response = self.client.post("/webhook", json=webhook_data)
-            
-            assert response.status_code == 500
-            response_data = response.json()
-            assert response_data["status"] == "error"
-            assert "Processing failed" in response_data["message"]
-            
-            mock_process.assert_called_once_with(5, 127)
+        assert response.status_code == 200
+        assert response.json() == {"status": i18n.t(status_key), "message": i18n.t(message_key, event_type='')}
+        assert mock_process.call_args_list == [((payload,),)] * call_count
     
-    def test_webhook_invalid_json(self):
+    def test_webhook_invalid_json(self, client, mock_process):
         """测试无效的 JSON 数据"""
-        response = self.client.post("/webhook", data="invalid json")
+        response = client.post("/", content=b"invalid json", headers=JSON_HEADERS)
         
-        # FastAPI 应该返回 422 错误（无法解析 JSON）
-        assert response.status_code == 422
+        # 请求体解析失败同样走统一的异常处理，返回 500
+        assert response.status_code == 500
+        assert response.json()["detail"].startswith(i18n.t('response.internal_server_error'))
+        mock_process.assert_not_called()
     
-    def test_webhook_empty_payload(self):
+    def test_webhook_empty_payload(self, client, mock_process):
         """测试空的 payload"""
-        response = self.client.post("/webhook", json={})
+        response = client.post("/", content=b"{}", headers=JSON_HEADERS)
         
         assert response.status_code == 200
-        response_data = response.json()
-        assert response_data["status"] == "ignored"
-        assert "Not a merge request event" in response_data["message"]
+        assert response.json() == ignored_body('')
+        mock_process.assert_not_called()
 
 
 class TestHealthCheck:
     """健康检查测试"""
     
-    def setup_method(self):
-        """测试设置"""
-        self.client = TestClient(app)
-    
-    def test_root_endpoint(self):
-        """测试根端点"""
-        response = self.client.get("/")
+    def test_root_endpoint_post_only(self, client):
+        """测试根端点只接收 webhook 的 POST 请求"""
+        response = client.get("/")
         
-        assert response.status_code == 200
-        response_data = response.json()
-        assert "message" in response_data
-        assert "GitLab Code Review LLM Service" in response_data["message"]
+        assert response.status_code == 405
     
-    def test_health_endpoint_if_exists(self):
-        """测试健康检查端点（如果存在）"""
-        # 尝试访问常见的健康检查端点
-        health_endpoints = ["/health", "/healthz", "/status"]
-        
-        for endpoint in health_endpoints:
-            response = self.client.get(endpoint)
-            # 如果端点存在，应该返回 200；如果不存在，返回 404
-            assert response.status_code in [200, 404]
+    def test_health_endpoint_registered(self):
+        """测试健康检查路由已注册"""
+        # 直接按名称反查路由，无需发起 HTTP 请求
+        assert app.url_path_for("health_check") == "/health/"
 
 
 class TestLoggingConfiguration:
     """日志配置测试"""
     
-    @patch('main.Settings')
-    def test_logging_setup_debug_mode(self, mock_settings):
-        """测试调试模式下的日志配置"""
-        # 模拟调试模式
-        mock_settings_instance = Mock()
-        mock_settings_instance.debug = True
-        mock_settings.return_value = mock_settings_instance
+    @pytest.fixture
+    def root_logger(self, monkeypatch):
+        """根日志器，测试结束后恢复原有的级别和处理器"""
+        root = logging.getLogger()
+        monkeypatch.setattr(root, 'handlers', list(root.handlers))
+        monkeypatch.setattr(root, 'level', root.level)
+        return root
+    
+    @pytest.mark.parametrize("debug,level", [
+        (True, logging.DEBUG),
+        (False, logging.INFO)
+    ], ids=["debug", "prod"])
+    def test_logging_setup(self, root_logger, monkeypatch, tmp_path, debug, level):
+        """测试调试模式和生产模式下的日志配置"""
+        # 文件处理器创建时即打开 app.log，写到临时目录
+        monkeypatch.chdir(tmp_path)
+        basic_config = Mock()
+        monkeypatch.setattr('main.logging.basicConfig', basic_config)
+        root_logger.handlers = []
         
-        with patch('logging.basicConfig') as mock_basic_config:
-            # 重新导入以触发日志配置
-            import importlib
-            import main
-            importlib.reload(main)
-            
-            # 验证日志配置被调用
-            mock_basic_config.assert_called()
-            
-            # 检查是否设置了正确的日志级别
-            call_args = mock_basic_config.call_args
-            if call_args and 'level' in call_args[1]:
-                assert call_args[1]['level'] == logging.DEBUG
+        setup_logging(debug)
+        
+        # 根日志器未配置处理器时添加控制台和文件输出
+        basic_config.assert_called_once()
+        handlers = basic_config.call_args[1]['handlers']
+        assert len(handlers) == 2
+        assert root_logger.level == level
+        for handler in handlers:
+            handler.close()
     
-    @patch('main.Settings')
-    def test_logging_setup_production_mode(self, mock_settings):
-        """测试生产模式下的日志配置"""
-        # 模拟生产模式
-        mock_settings_instance = Mock()
-        mock_settings_instance.debug = False
-        mock_settings.return_value = mock_settings_instance
+    def test_logging_setup_keeps_host_handlers(self, root_logger):
+        """测试宿主已配置处理器时保留原处理器，日志级别仍随最新配置生效"""
+        host_handler = logging.NullHandler()
+        root_logger.handlers = [host_handler]
+        
+        setup_logging(debug=False)
+        setup_logging(debug=True)
         
-        with patch('logging.basicConfig') as mock_basic_config:
-            # 重新导入以触发日志配置
-            import importlib
-            import main
-            importlib.reload(main)
-            
-            # 验证日志配置被调用
-            mock_basic_config.assert_called()
-            
-            # 检查是否设置了正确的日志级别
-            call_args = mock_basic_config.call_args
-            if call_args and 'level' in call_args[1]:
-                assert call_args[1]['level'] == logging.INFO
+        assert root_logger.handlers == [host_handler]
+        assert root_logger.level == logging.DEBUG
+    
+    @pytest.mark.asyncio
+    async def test_lifespan_sets_up_logging(self, test_app):
+        """测试日志在 lifespan 中按应用配置初始化，而不是在创建应用时"""
+        with patch('main.setup_logging') as mock_setup:
+            async with lifespan(test_app):
+                mock_setup.assert_called_once_with(test_app.state.settings.debug)
 
 
 class TestIntegrationScenarios:
     """集成场景测试"""
     
-    def setup_method(self):
-        """测试设置"""
-        self.client = TestClient(app)
-    
-    def test_complete_merge_request_workflow(self):
+    def test_complete_merge_request_workflow(self, client, full_mr_payload_bytes, mock_process):
         """测试完整的合并请求工作流"""
-        # 模拟一个完整的 GitLab webhook 负载
-        webhook_data = {
-            "object_kind": "merge_request",
-            "event_type": "merge_request",
-            "user": {
-                "id": 1,
-                "name": "Test User",
-                "username": "testuser",
-                "email": "test@example.com"
-            },
-            "project": {
-                "id": 1,
-                "name": "Test Project",
-                "description": "A test project",
-                "web_url": "https://gitlab.example.com/test/project",
-                "namespace": "test",
-                "visibility_level": 20
-            },
-            "object_attributes": {
-                "id": 123,
-                "target_branch": "main",
-                "source_branch": "feature/test",
-                "source_project_id": 1,
-                "target_project_id": 1,
-                "title": "Test merge request",
-                "description": "This is a test merge request",
-                "state": "opened",
-                "action": "open",
-                "merge_status": "can_be_merged",
-                "url": "https://gitlab.example.com/test/project/-/merge_requests/123",
-                "source": {
-                    "name": "Test Project",
-                    "description": "A test project",
-                    "web_url": "https://gitlab.example.com/test/project",
-                    "namespace": "test",
-                    "visibility_level": 20
-                },
-                "target": {
-                    "name": "Test Project",
-                    "description": "A test project",
-                    "web_url": "https://gitlab.example.com/test/project",
-                    "namespace": "test",
-                    "visibility_level": 20
-                },
-                "last_commit": {
-                    "id": "abc123def456",
-                    "message": "Add new feature",
-                    "timestamp": "2023-01-01T12:00:00Z",
-                    "url": "https://gitlab.example.com/test/project/-/commit/abc123def456",
-                    "author": {
-                        "name": "Test User",
-                        "email": "test@example.com"
-                    }
-                },
-                "work_in_progress": False,
-                "assignee_id": None,
-                "assignee_ids": [],
-                "reviewer_ids": []
-            },
-            "labels": [],
-            "changes": {
-                "updated_at": {
-                    "previous": "2023-01-01T11:00:00Z",
-                    "current": "2023-01-01T12:00:00Z"
-                }
-            },
-            "repository": {
-                "name": "Test Project",
-                "url": "git@gitlab.example.com:test/project.git",
-                "description": "A test project",
-                "homepage": "https://gitlab.example.com/test/project"
-            }
-        }
+        response = client.post("/", content=full_mr_payload_bytes, headers=JSON_HEADERS)
         
-        with patch.object(review_manager, 'process_merge_request', return_value=True) as mock_process:
-            response = self.client.post("/webhook", json=webhook_data)
-            
-            assert response.status_code == 200
-            response_data = response.json()
-            assert response_data["status"] == "success"
-            assert "processed successfully" in response_data["message"]
-            
-            # 验证使用正确的参数调用了处理器
-            mock_process.assert_called_once_with(1, 123)
+        assert response.status_code == 200
+        assert response.json() == queued_body()
+        
+        # 验证使用完整的事件数据调用了处理器
+        mock_process.assert_called_once_with(orjson.loads(full_mr_payload_bytes))
     
-    def test_multiple_concurrent_webhooks(self):
+    @pytest.mark.asyncio
+    async def test_multiple_concurrent_webhooks(self, test_app, mock_process):
         """测试多个并发 webhook 请求"""
-        import threading
-        import time
-        
-        results = []
-        
-        def send_webhook(mr_id):
-            webhook_data = {
-                "object_kind": "merge_request",
-                "event_type": "merge_request",
-                "object_attributes": {
-                    "action": "open",
-                    "id": mr_id,
-                    "target_project_id": 1
-                },
-                "project": {"id": 1}
-            }
-            
-            with patch.object(review_manager, 'process_merge_request', return_value=True):
-                response = self.client.post("/webhook", json=webhook_data)
-                results.append((mr_id, response.status_code, response.json()))
-        
-        # 创建多个线程同时发送 webhook
-        threads = []
-        for i in range(5):
-            thread = threading.Thread(target=send_webhook, args=(100 + i,))
-            threads.append(thread)
-            thread.start()
+        # 在同一个事件循环中同时发送多个 webhook
+        async with AsyncClient(transport=ASGITransport(app=test_app), base_url="http://testserver") as async_client:
+            responses = await asyncio.gather(*[
+                async_client.post("/", content=mr_payload_bytes("open", 100 + i, 1), headers=JSON_HEADERS)
+                for i in range(5)
+            ])
         
-        # 等待所有线程完成
-        for thread in threads:
-            thread.join()
+        # 验证所有请求都成功入队
+        assert len(responses) == 5
+        for response in responses:
+            assert response.status_code == 200
+            assert response.json() == queued_body()
         
-        # 验证所有请求都成功处理
-        assert len(results) == 5
-        for mr_id, status_code, response_data in results:
-            assert status_code == 200
-            assert response_data["status"] == "success"
+        assert mock_process.call_count == 5
     
-    def test_webhook_with_special_characters(self):
+    def test_webhook_with_special_characters(self, client, mock_process):
         """测试包含特殊字符的 webhook"""
         webhook_data = {
             "object_kind": "merge_request",
@@ -483,110 +469,70 @@ class TestIntegrationScenarios:
             "project": {"id": 1}
         }
         
-        with patch.object(review_manager, 'process_merge_request', return_value=True) as mock_process:
-            response = self.client.post("/webhook", json=webhook_data)
-            
-            assert response.status_code == 200
-            response_data = response.json()
-            assert response_data["status"] == "success"
-            
-            mock_process.assert_called_once_with(1, 128)
+        response = client.post("/", content=orjson.dumps(webhook_data), headers=JSON_HEADERS)
+        
+        assert response.status_code == 200
+        assert response.json() == queued_body()
+        
+        # 特殊字符经过 JSON 往返后保持不变
+        mock_process.assert_called_once_with(webhook_data)
     
-    def test_webhook_large_payload(self):
+    def test_webhook_large_payload(self, client, large_payload_bytes, mock_process):
         """测试大型 payload"""
-        # 创建一个包含大量数据的 webhook
-        large_description = "This is a very long description. " * 1000  # 约 34KB
+        response = client.post("/", content=large_payload_bytes, headers=JSON_HEADERS)
         
-        webhook_data = {
-            "object_kind": "merge_request",
-            "event_type": "merge_request",
-            "object_attributes": {
-                "action": "open",
-                "id": 129,
-                "target_project_id": 1,
-                "description": large_description
-            },
-            "project": {"id": 1},
-            "changes": {
-                "files": [f"file_{i}.py" for i in range(100)]  # 100 个文件
-            }
-        }
+        assert response.status_code == 200
+        assert response.json() == queued_body()
         
-        with patch.object(review_manager, 'process_merge_request', return_value=True) as mock_process:
-            response = self.client.post("/webhook", json=webhook_data)
-            
-            assert response.status_code == 200
-            response_data = response.json()
-            assert response_data["status"] == "success"
-            
-            mock_process.assert_called_once_with(1, 129)
+        mock_process.assert_called_once_with(orjson.loads(large_payload_bytes))
 
 
 class TestErrorRecovery:
     """错误恢复测试"""
     
-    def setup_method(self):
-        """测试设置"""
-        self.client = TestClient(app)
+    def test_processing_error_and_recovery(self, client, mock_process):
+        """测试处理过程中的错误，以及同一客户端在错误后恢复正常处理"""
+        # 事件数据不是 JSON 对象，读取 object_kind 时出错
+        response = client.post("/", content=b'["not", "an", "object"]', headers=JSON_HEADERS)
+        
+        assert response.status_code == 500
+        mock_process.assert_not_called()
+        
+        # 紧接着发送正常的合并请求事件，同一应用仍能正常入队处理
+        body = mr_payload_bytes("open", 127, 5)
+        response = client.post("/", content=body, headers=JSON_HEADERS)
+        
+        assert response.status_code == 200
+        assert response.json() == queued_body()
+        mock_process.assert_called_once_with(orjson.loads(body))
     
-    def test_recovery_after_processing_error(self):
-        """测试处理错误后的恢复"""
-        webhook_data = {
+    @pytest.mark.parametrize("partial_data", [
+        # 最小有效数据
+        {
             "object_kind": "merge_request",
-            "event_type": "merge_request",
             "object_attributes": {
                 "action": "open",
-                "id": 130,
+                "id": 131,
                 "target_project_id": 1
-            },
-            "project": {"id": 1}
+            }
+        },
+        # 缺少一些可选字段
+        {
+            "object_kind": "merge_request",
+            "event_type": "merge_request",
+            "object_attributes": {
+                "action": "update",
+                "id": 132,
+                "target_project_id": 1
+            }
+            # 缺少 project 字段
         }
-        
-        # 第一次请求失败
-        with patch.object(review_manager, 'process_merge_request', 
-                         side_effect=Exception("Temporary failure")):
-            response1 = self.client.post("/webhook", json=webhook_data)
-            assert response1.status_code == 500
-        
-        # 第二次请求成功
-        with patch.object(review_manager, 'process_merge_request', return_value=True):
-            response2 = self.client.post("/webhook", json=webhook_data)
-            assert response2.status_code == 200
-            assert response2.json()["status"] == "success"
-    
-    def test_partial_data_handling(self):
+    ], ids=["minimal", "without_project"])
+    def test_partial_data_handling(self, client, mock_process, partial_data):
         """测试部分数据处理"""
-        # 测试各种不完整但仍可处理的数据
-        partial_data_sets = [
-            # 最小有效数据
-            {
-                "object_kind": "merge_request",
-                "object_attributes": {
-                    "action": "open",
-                    "id": 131,
-                    "target_project_id": 1
-                }
-            },
-            # 缺少一些可选字段
-            {
-                "object_kind": "merge_request",
-                "event_type": "merge_request",
-                "object_attributes": {
-                    "action": "update",
-                    "id": 132,
-                    "target_project_id": 1
-                }
-                # 缺少 project 字段
-            }
-        ]
+        response = client.post("/", content=orjson.dumps(partial_data), headers=JSON_HEADERS)
         
-        for i, partial_data in enumerate(partial_data_sets):
-            with patch.object(review_manager, 'process_merge_request', return_value=True) as mock_process:
-                response = self.client.post("/webhook", json=partial_data)
-                
-                # 应该能够处理或优雅地忽略
-                assert response.status_code in [200, 400]
-                
-                if response.status_code == 200:
-                    response_data = response.json()
-                    assert response_data["status"] in ["success", "ignored"]
\ No newline at end of file
+        # 缺少可选字段的合并请求事件照常入队
+        assert response.status_code == 200
+        assert response.json() == queued_body()
+        mock_process.assert_called_once_with(partial_data)
@@ -7,11 +7,70 @@
 from datetime import datetime
 
 import pytest
-from sqlalchemy import select
+from sqlalchemy import func, insert, select
+from sqlalchemy.orm import Session
 
 from models import Review, ReviewDiscussion, ReviewFileRecord, ReviewFileLLMMessage
 
 
+# 模块级复用的 INSERT 语句，避免每个测试重复构建语句对象，编译结果由引擎的语句缓存复用
+_REVIEW_INSERT = insert(Review)
+_REVIEW_ID_INSERT = _REVIEW_INSERT.returning(Review.id)
+_DISCUSSION_INSERT = insert(ReviewDiscussion)
+_DISCUSSION_ID_INSERT = _DISCUSSION_INSERT.returning(ReviewDiscussion.id)
+_LLM_MESSAGE_INSERT = insert(ReviewFileLLMMessage)
+
+
+def _make_review_and_discussion(session):
+    """用两条 INSERT ... RETURNING 创建依赖的评审和讨论记录，返回 (review_id, discussion_id)"""
+    review_id = session.execute(
+        _REVIEW_ID_INSERT,
+        {"project_id": 1, "merge_request_id": 123}
+    ).scalar_one()
+    discussion_id = session.execute(
+        _DISCUSSION_ID_INSERT,
+        {"review_id": review_id, "discussion_id": "discussion_123", "file_path": "src/main.py"}
+    ).scalar_one()
+    return review_id, discussion_id
+
+
+@pytest.fixture(scope="class")
+def class_db_connection(test_db_engine):
+    """类内共享的连接和外层事务，类中所有测试结束后整体回滚"""
+    connection = test_db_engine.connect()
+    transaction = connection.begin()
+    try:
+        yield connection
+    finally:
+        transaction.rollback()
+        connection.close()
+
+
+@pytest.fixture(scope="class")
+def shared_discussion(class_db_connection):
+    """类内共享的评审和讨论记录，只插入一次，返回讨论记录ID"""
+    return _make_review_and_discussion(class_db_connection)[1]
+
+
+@pytest.fixture
+def class_db_session(class_db_connection, shared_discussion):
+    """类内测试使用的会话
+
+    每个测试在独立的 SAVEPOINT 中运行，结束时回滚，叶子记录不会泄漏到同类其他测试，共享的父记录保持不变。
+    """
+    nested = class_db_connection.begin_nested()
+    session = Session(
+        bind=class_db_connection,
+        join_transaction_mode="create_savepoint",
+        expire_on_commit=False
+    )
+    try:
+        yield session
+    finally:
+        session.close()
+        nested.rollback()
+
+
 class TestReview:
     """Review 模型测试"""
     
@@ -30,8 +89,8 @@ class TestReview:
         assert review.project_id == 1
         assert review.merge_request_id == 123
         assert review.status == 'pending'
-        assert isinstance(review.created_at, datetime)
-        assert isinstance(review.updated_at, datetime)
+        assert type(review.created_at) is datetime
+        assert type(review.updated_at) is datetime
     
     def test_review_default_values(self, test_db_session):
         """测试评审记录默认值"""
@@ -70,19 +129,18 @@ class TestReview:
     
     def test_review_query(self, test_db_session):
         """测试评审记录查询"""
-        # 创建多个评审记录
-        review1 = Review(project_id=1, merge_request_id=123, status='pending')
-        review2 = Review(project_id=1, merge_request_id=124, status='approved')
-        review3 = Review(project_id=2, merge_request_id=123, status='rejected')
-        
-        test_db_session.add_all([review1, review2, review3])
+        # 创建多个评审记录，只需要数据行存在，批量插入跳过 ORM 对象构建和工作单元
+        test_db_session.execute(_REVIEW_INSERT, [
+            {"project_id": 1, "merge_request_id": 123, "status": "pending"},
+            {"project_id": 1, "merge_request_id": 124, "status": "approved"},
+            {"project_id": 2, "merge_request_id": 123, "status": "rejected"}
+        ])
         test_db_session.commit()
         
         # 按项目ID查询
-        project1_reviews = test_db_session.scalars(
-            select(Review).where(Review.project_id == 1)
-        ).all()
-        assert len(project1_reviews) == 2
+        assert test_db_session.scalar(
+            select(func.count()).select_from(Review).where(Review.project_id == 1)
+        ) == 2
         
         # 按状态查询
         pending_reviews = test_db_session.scalars(
@@ -97,14 +155,14 @@ class TestReviewDiscussion:
     
     def test_create_review_discussion(self, test_db_session):
         """测试创建评审讨论记录"""
-        # 先创建评审记录
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
+        # 先创建评审记录，只需要它的主键
+        review_id = test_db_session.execute(
+            _REVIEW_ID_INSERT, {"project_id": 1, "merge_request_id": 123}
+        ).scalar_one()
         
         # 创建讨论记录
         discussion = ReviewDiscussion(
-            review_id=review.id,
+            review_id=review_id,
             discussion_id='discussion_123',
             file_path='src/main.py'
         )
@@ -113,33 +171,25 @@ class TestReviewDiscussion:
         test_db_session.commit()
         
         assert discussion.id is not None
-        assert discussion.review_id == review.id
+        assert discussion.review_id == review_id
         assert discussion.discussion_id == 'discussion_123'
         assert discussion.file_path == 'src/main.py'
     
     def test_review_discussion_relationship(self, test_db_session):
         """测试评审讨论关系"""
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
-        
-        discussion1 = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_1',
-            file_path='file1.py'
-        )
-        discussion2 = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_2',
-            file_path='file2.py'
-        )
-        
-        test_db_session.add_all([discussion1, discussion2])
+        review_id = test_db_session.execute(
+            _REVIEW_ID_INSERT, {"project_id": 1, "merge_request_id": 123}
+        ).scalar_one()
+        
+        test_db_session.execute(_DISCUSSION_INSERT, [
+            {"review_id": review_id, "discussion_id": "discussion_1", "file_path": "file1.py"},
+            {"review_id": review_id, "discussion_id": "discussion_2", "file_path": "file2.py"}
+        ])
         test_db_session.commit()
         
         # 查询特定评审的所有讨论
         discussions = test_db_session.scalars(
-            select(ReviewDiscussion).where(ReviewDiscussion.review_id == review.id)
+            select(ReviewDiscussion).where(ReviewDiscussion.review_id == review_id)
         ).all()
         
         assert len(discussions) == 2
@@ -151,24 +201,11 @@ class TestReviewDiscussion:
 class TestReviewFileRecord:
     """ReviewFileRecord 模型测试"""
     
-    def test_create_review_file_record(self, test_db_session):
+    def test_create_review_file_record(self, class_db_session, shared_discussion):
         """测试创建评审文件记录"""
-        # 创建依赖记录
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
-        
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='src/main.py'
-        )
-        test_db_session.add(discussion)
-        test_db_session.commit()
-        
         # 创建文件记录
         file_record = ReviewFileRecord(
-            review_discussion_id=discussion.id,
+            review_discussion_id=shared_discussion,
             approved=True,
             score=8,
             issue=['缺少注释', '变量命名不规范'],
@@ -177,33 +214,21 @@ class TestReviewFileRecord:
             llm_model='gpt-4'
         )
         
-        test_db_session.add(file_record)
-        test_db_session.commit()
+        class_db_session.add(file_record)
+        class_db_session.commit()
         
         assert file_record.id is not None
-        assert file_record.review_discussion_id == discussion.id
+        assert file_record.review_discussion_id == shared_discussion
         assert file_record.approved is True
         assert file_record.score == 8
         assert file_record.issue == ['缺少注释', '变量命名不规范']
         assert file_record.suggestion == ['添加函数注释', '使用更描述性的变量名']
         assert file_record.summary == '代码质量良好，需要小幅改进'
         assert file_record.llm_model == 'gpt-4'
-        assert isinstance(file_record.created_at, datetime)
+        assert type(file_record.created_at) is datetime
     
-    def test_review_file_record_json_fields(self, test_db_session):
+    def test_review_file_record_json_fields(self, class_db_session, shared_discussion):
         """测试 JSON 字段"""
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
-        
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='src/main.py'
-        )
-        test_db_session.add(discussion)
-        test_db_session.commit()
-        
         # 测试复杂的 JSON 数据
         complex_issues = [
             '函数过长，建议拆分',
@@ -218,7 +243,7 @@ class TestReviewFileRecord:
         ]
         
         file_record = ReviewFileRecord(
-            review_discussion_id=discussion.id,
+            review_discussion_id=shared_discussion,
             approved=False,
             score=5,
             issue=complex_issues,
@@ -227,84 +252,50 @@ class TestReviewFileRecord:
             llm_model='gpt-4'
         )
         
-        test_db_session.add(file_record)
-        test_db_session.commit()
+        class_db_session.add(file_record)
+        class_db_session.commit()
         
-        # 重新查询验证 JSON 数据
-        retrieved_record = test_db_session.get(ReviewFileRecord, file_record.id)
-        assert retrieved_record.issue == complex_issues
-        assert retrieved_record.suggestion == complex_suggestions
+        # 让内存中的属性过期，下次访问时从数据库重新加载，验证 JSON 数据的读写往返
+        class_db_session.expire(file_record)
+        assert file_record.issue == complex_issues
+        assert file_record.suggestion == complex_suggestions
 
 
 class TestReviewFileLLMMessage:
     """ReviewFileLLMMessage 模型测试"""
     
-    def test_create_llm_message(self, test_db_session):
+    def test_create_llm_message(self, class_db_session, shared_discussion):
         """测试创建 LLM 消息记录"""
-        # 创建依赖记录
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
-        
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='src/main.py'
-        )
-        test_db_session.add(discussion)
-        test_db_session.commit()
-        
         # 创建 LLM 消息
         message = ReviewFileLLMMessage(
-            review_discussion_id=discussion.id,
+            review_discussion_id=shared_discussion,
             role='user',
             content='请审查这个文件的代码变更'
         )
         
-        test_db_session.add(message)
-        test_db_session.commit()
+        class_db_session.add(message)
+        class_db_session.commit()
         
         assert message.id is not None
-        assert message.review_discussion_id == discussion.id
+        assert message.review_discussion_id == shared_discussion
         assert message.role == 'user'
         assert message.content == '请审查这个文件的代码变更'
-        assert isinstance(message.created_at, datetime)
+        assert type(message.created_at) is datetime
     
-    def test_multiple_llm_messages(self, test_db_session):
+    def test_multiple_llm_messages(self, class_db_session, shared_discussion):
         """测试多条 LLM 消息"""
-        review = Review(project_id=1, merge_request_id=123)
-        test_db_session.add(review)
-        test_db_session.commit()
-        
-        discussion = ReviewDiscussion(
-            review_id=review.id,
-            discussion_id='discussion_123',
-            file_path='src/main.py'
-        )
-        test_db_session.add(discussion)
-        test_db_session.commit()
-        
         # 创建对话消息
-        user_message = ReviewFileLLMMessage(
-            review_discussion_id=discussion.id,
-            role='user',
-            content='请审查这个文件的代码变更'
-        )
-        
-        assistant_message = ReviewFileLLMMessage(
-            review_discussion_id=discussion.id,
-            role='assistant',
-            content='代码质量良好，建议添加更多注释'
-        )
-        
-        test_db_session.add_all([user_message, assistant_message])
-        test_db_session.commit()
-        
-        # 查询对话历史
-        messages = test_db_session.scalars(
+        class_db_session.execute(_LLM_MESSAGE_INSERT, [
+            {"review_discussion_id": shared_discussion, "role": "user", "content": "请审查这个文件的代码变更"},
+            {"review_discussion_id": shared_discussion, "role": "assistant", "content": "代码质量良好，建议添加更多注释"}
+        ])
+        class_db_session.commit()
+        
+        # 查询对话历史，批量插入的两行创建时间可能相同，按主键保证顺序
+        messages = class_db_session.scalars(
             select(ReviewFileLLMMessage)
-            .where(ReviewFileLLMMessage.review_discussion_id == discussion.id)
-            .order_by(ReviewFileLLMMessage.created_at)
+            .where(ReviewFileLLMMessage.review_discussion_id == shared_discussion)
+            .order_by(ReviewFileLLMMessage.created_at, ReviewFileLLMMessage.id)
         ).all()
         
         assert len(messages) == 2
@@ -319,10 +310,10 @@ class TestModelIntegration:
     
     def test_complete_review_workflow(self, test_db_session):
         """测试完整的评审工作流"""
-        # 1. 创建评审
+        # 1. 创建评审（整个流程只在最后提交一次，中间用 flush 获取自增主键）
         review = Review(project_id=1, merge_request_id=123, status='pending')
         test_db_session.add(review)
-        test_db_session.commit()
+        test_db_session.flush()
         
         # 2. 创建讨论
         discussion = ReviewDiscussion(
@@ -331,7 +322,7 @@ class TestModelIntegration:
             file_path='src/main.py'
         )
         test_db_session.add(discussion)
-        test_db_session.commit()
+        test_db_session.flush()
         
         # 3. 创建 LLM 消息
         user_message = ReviewFileLLMMessage(
@@ -347,7 +338,6 @@ class TestModelIntegration:
         )
         
         test_db_session.add_all([user_message, assistant_message])
-        test_db_session.commit()
         
         # 4. 创建文件记录
         file_record = ReviewFileRecord(
@@ -384,4 +374,4 @@ class TestModelIntegration:
         
         assert len(records) == 1
         assert records[0].approved is True
-        assert records[0].score == 8
\ No newline at end of file
+        assert records[0].score == 8
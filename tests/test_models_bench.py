@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据模型写入性能基准测试
+
+与 performance_baselines/ 中保存的基线对比，ORM 写入吞吐下降时使 CI 失败：
+    python run_tests.py --model-benchmark
+"""
+
+import pytest
+from sqlalchemy import insert, select
+
+from models import Review, ReviewDiscussion, ReviewFileLLMMessage, ReviewFileRecord
+
+pytest.importorskip("pytest_benchmark")
+
+pytestmark = pytest.mark.performance
+
+# 每轮写入的行数
+ROWS = 1000
+
+_REVIEW_ID_INSERT = insert(Review).returning(Review.id)
+_DISCUSSION_INSERT = insert(ReviewDiscussion)
+
+
+def _bulk_insert_reviews(session):
+    """批量插入评审记录，返回插入的主键"""
+    return session.scalars(_REVIEW_ID_INSERT, [
+        {"project_id": i % 10, "merge_request_id": i, "status": "pending"}
+        for i in range(ROWS)
+    ]).all()
+
+
+def _bulk_insert_discussions(session, review_id):
+    """为同一评审批量插入讨论记录"""
+    session.execute(_DISCUSSION_INSERT, [
+        {"review_id": review_id, "discussion_id": f"discussion_{i}", "file_path": f"src/file_{i}.py"}
+        for i in range(ROWS)
+    ])
+
+
+def _review_workflow(session):
+    """完整评审工作流：评审 → 讨论 → 消息和文件记录，最后按讨论查询消息和文件记录"""
+    review = Review(project_id=1, merge_request_id=123, status='pending')
+    session.add(review)
+    session.flush()
+    discussion = ReviewDiscussion(review_id=review.id, discussion_id='discussion_123', file_path='src/main.py')
+    session.add(discussion)
+    session.flush()
+    session.add_all([
+        ReviewFileLLMMessage(review_discussion_id=discussion.id, role='user', content='请审查代码'),
+        ReviewFileLLMMessage(review_discussion_id=discussion.id, role='assistant', content='审查完成'),
+        ReviewFileRecord(
+            review_discussion_id=discussion.id,
+            approved=True,
+            score=8,
+            issue=['小问题'],
+            suggestion=['小改进'],
+            summary='总体良好',
+            llm_model='gpt-4'
+        )
+    ])
+    session.flush()
+    messages = session.scalars(
+        select(ReviewFileLLMMessage).where(ReviewFileLLMMessage.review_discussion_id == discussion.id)
+    ).all()
+    records = session.scalars(
+        select(ReviewFileRecord).where(ReviewFileRecord.review_discussion_id == discussion.id)
+    ).all()
+    return messages, records
+
+
+@pytest.mark.benchmark(group="orm-insert")
+def test_bench_bulk_insert_reviews(benchmark, test_db_session):
+    """批量插入评审记录的吞吐"""
+    ids = benchmark(_bulk_insert_reviews, test_db_session)
+
+    assert len(ids) == ROWS
+
+
+@pytest.mark.benchmark(group="orm-insert")
+def test_bench_bulk_insert_discussions(benchmark, test_db_session):
+    """批量插入讨论记录的吞吐"""
+    review_id = test_db_session.execute(
+        _REVIEW_ID_INSERT, {"project_id": 1, "merge_request_id": 123}
+    ).scalar_one()
+
+    benchmark(_bulk_insert_discussions, test_db_session, review_id)
+
+
+@pytest.mark.benchmark(group="orm-workflow")
+def test_bench_review_workflow(benchmark, test_db_session):
+    """完整评审工作流的单次耗时"""
+    messages, records = benchmark(_review_workflow, test_db_session)
+
+    assert len(messages) == 2
+    assert len(records) == 1
@@ -2,189 +2,219 @@
 # -*- coding: utf-8 -*-
 """
 性能和压力测试
+
+各测试类相互独立，可用 pytest -n auto --dist loadgroup 并行运行：
+对计时敏感的测试归入 serial 组，读取进程内存和文件描述符的测试归入 resource 组，
+同组测试在同一个 worker 上顺序执行，互不干扰。
+使用 benchmark 夹具的基准测试由 pytest-benchmark 计时并与保存的基线对比，需要串行运行。
 """
 
+import asyncio
+import os
+import resource
 import time
 import threading
 import concurrent.futures
 from unittest.mock import patch, Mock
-import json
 import statistics
+from types import SimpleNamespace
 
+import orjson
 import pytest
-from fastapi.testclient import TestClient
+from httpx import ASGITransport, AsyncClient
+
+from llm import Service as LLMService
+from utils import get_discussion_content, get_file_system_prompt, get_file_user_prompt, get_file_user_prompt_template
+
+
+pytestmark = pytest.mark.performance
+
+JSON_HEADERS = {"content-type": "application/json"}
+
+# 模拟 LLM 返回的审查结果，内容固定，模块加载时编码一次
+_MOCK_LLM_JSON = orjson.dumps({
+    'approved': True,
+    'score': 8,
+    'issue': [],
+    'suggestion': [],
+    'summary': '代码质量良好'
+}).decode()
+
+# 只读的模拟响应对象，结构与 ChatCompletion 中被读取的字段一致；
+# SimpleNamespace 构造成本远低于 Mock，也不会对拼错的属性静默返回新的 Mock
+_MOCK_LLM_RESPONSE = SimpleNamespace(
+    choices=[SimpleNamespace(message=SimpleNamespace(content=_MOCK_LLM_JSON))],
+    usage=SimpleNamespace(total_tokens=100)
+)
 
-# 导入测试目标
-with patch('main.Settings'), \
-     patch('main.gitlab.Gitlab'), \
-     patch('main.LLMService'), \
-     patch('main.ReviewManager'), \
-     patch('main.init_i18n'):
-    from main import app
 
-from llm import LLMService
-from review_manager import ReviewManager
-from utils import render_template, generate_system_prompt, generate_user_prompt
+def mr_webhook_body(mr_id, project_id=1):
+    """用 orjson 编码合并请求 webhook 请求体，循环前预先生成，循环内直接发送字节"""
+    return orjson.dumps({
+        "object_kind": "merge_request",
+        "event_type": "merge_request",
+        "object_attributes": {
+            "action": "open",
+            "id": mr_id,
+            "target_project_id": project_id
+        },
+        "project": {"id": project_id}
+    })
+
+
+def summarize_timings(times):
+    """汇总耗时样本：一次排序后得到平均值、最值和 p50/p95/p99 分位数
+
+    statistics.fmean 按浮点直接求和，不像 statistics.mean 那样走精确分数运算；
+    尾部分位数比平均值更能反映偶发的慢请求。
+    """
+    ordered = sorted(times)
+    cut_points = statistics.quantiles(ordered, n=100, method='inclusive')
+    return {
+        'avg': statistics.fmean(ordered),
+        'min': ordered[0],
+        'max': ordered[-1],
+        'p50': cut_points[49],
+        'p95': cut_points[94],
+        'p99': cut_points[98]
+    }
 
 
 class TestPerformanceBenchmarks:
     """性能基准测试"""
     
-    def setup_method(self):
-        """测试设置"""
-        self.client = TestClient(app)
+    @pytest.fixture(autouse=True)
+    def _client(self, app_client):
+        """复用 worker 内共享的测试客户端"""
+        self.client = app_client
     
+    @pytest.mark.xdist_group("serial")
     def test_webhook_response_time(self):
         """测试 webhook 响应时间"""
-        webhook_data = {
-            "object_kind": "merge_request",
-            "event_type": "merge_request",
-            "object_attributes": {
-                "action": "open",
-                "id": 123,
-                "target_project_id": 1
-            },
-            "project": {"id": 1}
-        }
+        body = mr_webhook_body(123)
+        # 循环前绑定方法，循环内不再重复属性查找
+        post = self.client.post
         
         response_times = []
         
-        # 模拟快速处理
-        with patch('main.review_manager.process_merge_request', return_value=True):
-            for _ in range(10):
-                start_time = time.time()
-                response = self.client.post("/webhook", json=webhook_data)
-                end_time = time.time()
-                
-                assert response.status_code == 200
-                response_times.append(end_time - start_time)
+        for _ in range(10):
+            start_time = time.perf_counter()
+            response = post("/", content=body, headers=JSON_HEADERS)
+            end_time = time.perf_counter()
+            
+            assert response.status_code == 200
+            response_times.append(end_time - start_time)
         
         # 分析响应时间
-        avg_time = statistics.mean(response_times)
-        max_time = max(response_times)
-        min_time = min(response_times)
+        timings = summarize_timings(response_times)
+        avg_time = timings['avg']
+        max_time = timings['max']
         
         print(f"\n响应时间统计:")
         print(f"平均: {avg_time:.3f}s")
         print(f"最大: {max_time:.3f}s")
-        print(f"最小: {min_time:.3f}s")
+        print(f"最小: {timings['min']:.3f}s")
+        print(f"P50/P95/P99: {timings['p50']:.3f}s / {timings['p95']:.3f}s / {timings['p99']:.3f}s")
         
         # 断言响应时间在合理范围内（< 1秒）
         assert avg_time < 1.0
         assert max_time < 2.0
     
-    def test_template_rendering_performance(self):
+    @pytest.mark.benchmark(group="prompt")
+    def test_template_rendering_performance(self, benchmark):
         """测试模板渲染性能"""
-        test_data = {
-            'file_path': 'src/main.py',
-            'diff': '@@ -1,5 +1,8 @@\n def main():\n+    # 新增注释\n     print("Hello")\n+    print("World")\n     return 0',
-            'language': 'python'
+        # 经过 _update_llm_resp 处理后的评审结果，问题和建议已拼接为编号列表
+        llm_resp = {
+            'issues': '1. 缺少错误处理\n2. 变量命名不规范',
+            'suggestions': '1. 添加异常处理\n2. 使用更描述性的变量名',
+            'summary': '代码质量良好，需要小幅改进',
+            'score': 8,
+            'model': 'gpt-4'
         }
         
-        render_times = []
-        
-        for _ in range(100):
-            start_time = time.time()
-            result = render_template('system_prompt.j2', **test_data)
-            end_time = time.time()
-            
-            assert result is not None
-            assert len(result) > 0
-            render_times.append(end_time - start_time)
-        
-        avg_time = statistics.mean(render_times)
-        print(f"\n模板渲染平均时间: {avg_time:.4f}s")
+        # 迭代次数、预热和离群值由 pytest-benchmark 处理，退化通过与保存的基线对比发现
+        result = benchmark(get_discussion_content, llm_resp)
         
-        # 模板渲染应该很快（< 10ms）
-        assert avg_time < 0.01
+        assert result is not None
+        assert len(result) > 0
     
-    def test_prompt_generation_performance(self):
+    @pytest.mark.benchmark(group="prompt")
+    def test_prompt_generation_performance(self, benchmark):
         """测试提示生成性能"""
-        file_path = 'src/example.py'
-        diff = '@@ -1,10 +1,15 @@\n def example_function():\n+    """示例函数"""\n     pass\n+    return True'
-        
-        generation_times = []
+        change = {
+            'old_path': 'src/example.py',
+            'new_path': 'src/example.py',
+            'diff': '@@ -1,10 +1,15 @@\n def example_function():\n+    """示例函数"""\n     pass\n+    return True'
+        }
         
-        for _ in range(50):
-            start_time = time.time()
-            
-            system_prompt = generate_system_prompt()
-            user_prompt = generate_user_prompt(file_path, diff)
-            
-            end_time = time.time()
-            
-            assert system_prompt is not None
-            assert user_prompt is not None
-            generation_times.append(end_time - start_time)
+        def generate_prompts():
+            return get_file_system_prompt(), get_file_user_prompt(change)
         
-        avg_time = statistics.mean(generation_times)
-        print(f"\n提示生成平均时间: {avg_time:.4f}s")
+        system_prompt, user_prompt = benchmark(generate_prompts)
         
-        # 提示生成应该很快（< 50ms）
-        assert avg_time < 0.05
+        assert system_prompt is not None
+        assert user_prompt is not None
 
 
 class TestConcurrencyStress:
     """并发压力测试"""
     
-    def setup_method(self):
-        """测试设置"""
-        self.client = TestClient(app)
+    @pytest.fixture(autouse=True)
+    def _client(self, app_client):
+        """复用 worker 内共享的测试客户端"""
+        self.client = app_client
     
-    def test_concurrent_webhook_requests(self):
+    @pytest.mark.asyncio
+    async def test_concurrent_webhook_requests(self):
         """测试并发 webhook 请求"""
-        num_threads = 10
-        requests_per_thread = 5
+        num_clients = 10
+        requests_per_client = 5
         
-        def send_webhook_requests(thread_id):
-            """发送 webhook 请求的线程函数"""
-            results = []
-            
-            for i in range(requests_per_thread):
-                webhook_data = {
-                    "object_kind": "merge_request",
-                    "event_type": "merge_request",
-                    "object_attributes": {
-                        "action": "open",
-                        "id": thread_id * 100 + i,
-                        "target_project_id": thread_id
-                    },
-                    "project": {"id": thread_id}
-                }
-                
-                start_time = time.time()
-                
-                with patch('main.review_manager.process_merge_request', return_value=True):
-                    response = self.client.post("/webhook", json=webhook_data)
-                
-                end_time = time.time()
-                
-                results.append({
-                    'thread_id': thread_id,
-                    'request_id': i,
-                    'status_code': response.status_code,
-                    'response_time': end_time - start_time,
-                    'success': response.status_code == 200
-                })
-            
-            return results
+        # 在计时之前用 orjson 一次性编码所有请求体，协程内直接发送字节
+        bodies = [
+            (client_id, i, orjson.dumps({
+                "object_kind": "merge_request",
+                "event_type": "merge_request",
+                "object_attributes": {
+                    "action": "open",
+                    "id": client_id * 100 + i,
+                    "target_project_id": client_id
+                },
+                "project": {"id": client_id}
+            }))
+            for client_id in range(num_clients)
+            for i in range(requests_per_client)
+        ]
         
-        # 使用线程池执行并发请求
-        with concurrent.futures.ThreadPoolExecutor(max_workers=num_threads) as executor:
-            futures = [executor.submit(send_webhook_requests, i) for i in range(num_threads)]
+        async def send_webhook_request(async_client, client_id, request_id, body):
+            """发送单个 webhook 请求并记录耗时"""
+            start_time = time.perf_counter()
+            response = await async_client.post("/", content=body, headers=JSON_HEADERS)
+            end_time = time.perf_counter()
             
-            all_results = []
-            for future in concurrent.futures.as_completed(futures):
-                all_results.extend(future.result())
+            return {
+                'client_id': client_id,
+                'request_id': request_id,
+                'status_code': response.status_code,
+                'response_time': end_time - start_time,
+                'success': response.status_code == 200
+            }
+        
+        # 所有请求在同一个事件循环中并发发送
+        async with AsyncClient(transport=ASGITransport(app=self.client.app), base_url="http://testserver") as async_client:
+            all_results = await asyncio.gather(*[
+                send_webhook_request(async_client, client_id, request_id, body)
+                for client_id, request_id, body in bodies
+            ])
         
         # 分析结果
         total_requests = len(all_results)
         successful_requests = sum(1 for r in all_results if r['success'])
-        response_times = [r['response_time'] for r in all_results]
+        timings = summarize_timings([r['response_time'] for r in all_results])
         
         success_rate = successful_requests / total_requests
-        avg_response_time = statistics.mean(response_times)
-        max_response_time = max(response_times)
+        avg_response_time = timings['avg']
+        max_response_time = timings['max']
         
         print(f"\n并发测试结果:")
         print(f"总请求数: {total_requests}")
@@ -192,38 +222,29 @@ class TestConcurrencyStress:
         print(f"成功率: {success_rate:.2%}")
         print(f"平均响应时间: {avg_response_time:.3f}s")
         print(f"最大响应时间: {max_response_time:.3f}s")
+        print(f"P95 响应时间: {timings['p95']:.3f}s")
         
         # 断言性能要求
         assert success_rate >= 0.95  # 95% 成功率
         assert avg_response_time < 2.0  # 平均响应时间 < 2秒
         assert max_response_time < 5.0  # 最大响应时间 < 5秒
     
+    @pytest.mark.xdist_group("resource")
     def test_memory_usage_under_load(self):
         """测试负载下的内存使用"""
-        import psutil
-        import os
+        # 请求体在取初始内存之前生成，不计入负载期间的内存增长
+        bodies = [mr_webhook_body(i) for i in range(100)]
+        post = self.client.post
         
-        process = psutil.Process(os.getpid())
-        initial_memory = process.memory_info().rss / 1024 / 1024  # MB
+        # 只在循环前后各取一次峰值常驻内存，Linux 上 ru_maxrss 单位为 KB
+        initial_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # MB
         
         # 执行大量操作
-        for i in range(100):
-            webhook_data = {
-                "object_kind": "merge_request",
-                "event_type": "merge_request",
-                "object_attributes": {
-                    "action": "open",
-                    "id": i,
-                    "target_project_id": 1
-                },
-                "project": {"id": 1}
-            }
-            
-            with patch('main.review_manager.process_merge_request', return_value=True):
-                response = self.client.post("/webhook", json=webhook_data)
-                assert response.status_code == 200
+        for body in bodies:
+            response = post("/", content=body, headers=JSON_HEADERS)
+            assert response.status_code == 200
         
-        final_memory = process.memory_info().rss / 1024 / 1024  # MB
+        final_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # MB
         memory_increase = final_memory - initial_memory
         
         print(f"\n内存使用情况:")
@@ -238,35 +259,32 @@ class TestConcurrencyStress:
         """测试数据库连接池压力"""
         num_concurrent_operations = 20
         
+        from curd import update_or_create_review
+        
         def database_operation(operation_id):
             """模拟数据库操作"""
-            with patch('curd.Session') as mock_session_class:
-                mock_session = Mock()
-                mock_session_class.return_value.__enter__.return_value = mock_session
-                
-                # 模拟数据库操作延迟
-                time.sleep(0.1)
-                
-                from curd import update_or_create_review
-                result = update_or_create_review(1, operation_id, 'pending')
-                
-                return {'operation_id': operation_id, 'result': result, 'success': True}
-        
-        start_time = time.time()
+            result = update_or_create_review(1, operation_id, 'pending')
+            return {'operation_id': operation_id, 'result': result, 'success': True}
         
-        # 并发执行数据库操作
-        with concurrent.futures.ThreadPoolExecutor(max_workers=num_concurrent_operations) as executor:
-            futures = [executor.submit(database_operation, i) for i in range(num_concurrent_operations)]
+        # mock.patch 的进入和退出不是线程安全的，在所有线程外只替换一次 curd.Session
+        with patch('curd.Session') as mock_session_class:
+            mock_session_class.return_value.__enter__.return_value = Mock()
+            
+            start_time = time.perf_counter()
             
-            results = []
-            for future in concurrent.futures.as_completed(futures):
-                try:
-                    result = future.result(timeout=5.0)
-                    results.append(result)
-                except Exception as e:
-                    results.append({'success': False, 'error': str(e)})
-        
-        end_time = time.time()
+            # 并发执行数据库操作
+            with concurrent.futures.ThreadPoolExecutor(max_workers=num_concurrent_operations) as executor:
+                futures = [executor.submit(database_operation, i) for i in range(num_concurrent_operations)]
+                
+                # 一次等待全部完成后再统一取结果；超时未完成的操作按失败计入成功率
+                done, _ = concurrent.futures.wait(futures, timeout=10.0)
+                results = [
+                    future.result() if future.exception() is None
+                    else {'success': False, 'error': str(future.exception())}
+                    for future in done
+                ]
+        
+        end_time = time.perf_counter()
         total_time = end_time - start_time
         
         successful_operations = sum(1 for r in results if r.get('success', False))
@@ -285,19 +303,10 @@ class TestConcurrencyStress:
 class TestLLMServicePerformance:
     """LLM 服务性能测试"""
     
+    @pytest.mark.xdist_group("serial")
     def test_llm_service_response_time(self):
         """测试 LLM 服务响应时间"""
         mock_openai_client = Mock()
-        mock_response = Mock()
-        mock_response.choices = [Mock()]
-        mock_response.choices[0].message.content = json.dumps({
-            'approved': True,
-            'score': 8,
-            'issue': [],
-            'suggestion': [],
-            'summary': '代码质量良好'
-        })
-        mock_response.usage.total_tokens = 100
         
         # 模拟不同的响应时间
         response_times = [0.5, 1.0, 1.5, 2.0, 0.8]  # 秒
@@ -305,35 +314,38 @@ class TestLLMServicePerformance:
         def mock_chat_create(*args, **kwargs):
             # 模拟网络延迟
             time.sleep(response_times.pop(0) if response_times else 1.0)
-            return mock_response
+            return _MOCK_LLM_RESPONSE
         
         mock_openai_client.chat.completions.create = mock_chat_create
         
-        llm_service = LLMService(client=mock_openai_client)
+        llm_service = LLMService(model='gpt-4', api_key='test-key')
+        llm_service.client = mock_openai_client
         
         messages = [
             {'role': 'system', 'content': '你是一个代码审查助手'},
             {'role': 'user', 'content': '请审查这段代码'}
         ]
         
+        chat = llm_service.chat
         measured_times = []
         
-        for i in range(5):
-            start_time = time.time()
-            result = llm_service.chat(messages)
-            end_time = time.time()
+        for _ in range(5):
+            start_time = time.perf_counter()
+            result = chat(messages)
+            end_time = time.perf_counter()
             
             assert result is not None
             measured_times.append(end_time - start_time)
         
-        avg_time = statistics.mean(measured_times)
-        print(f"\nLLM 服务平均响应时间: {avg_time:.2f}s")
+        timings = summarize_timings(measured_times)
+        avg_time = timings['avg']
+        print(f"\nLLM 服务平均响应时间: {avg_time:.2f}s, 最大: {timings['max']:.2f}s")
         
         # LLM 响应时间应该在合理范围内
         assert avg_time < 5.0
     
-    def test_llm_service_retry_performance(self):
-        """测试 LLM 服务重试性能"""
+    def test_llm_service_retry_performance(self, no_sleep):
+        """测试 LLM 服务重试性能（退避等待被 no_sleep 替换，只记录等待秒数）"""
         mock_openai_client = Mock()
         
         # 模拟前两次失败，第三次成功
@@ -346,59 +358,57 @@ class TestLLMServicePerformance:
             if call_count <= 2:
                 raise Exception("API 暂时不可用")
             
-            mock_response = Mock()
-            mock_response.choices = [Mock()]
-            mock_response.choices[0].message.content = json.dumps({
-                'approved': True,
-                'score': 8,
-                'issue': [],
-                'suggestion': [],
-                'summary': '代码质量良好'
-            })
-            mock_response.usage.total_tokens = 100
-            return mock_response
+            return _MOCK_LLM_RESPONSE
         
         mock_openai_client.chat.completions.create = mock_chat_create
         
-        llm_service = LLMService(client=mock_openai_client, max_retries=3)
+        llm_service = LLMService(model='gpt-4', api_key='test-key', max_retries=3)
+        llm_service.client = mock_openai_client
         
         messages = [
             {'role': 'system', 'content': '你是一个代码审查助手'},
             {'role': 'user', 'content': '请审查这段代码'}
         ]
         
-        start_time = time.time()
+        start_time = time.perf_counter()
         result = llm_service.chat(messages)
-        end_time = time.time()
+        end_time = time.perf_counter()
         
         total_time = end_time - start_time
         
         assert result is not None
         assert call_count == 3  # 确认重试了 3 次
+        # 两次失败后的指数退避：1 秒、2 秒
+        assert no_sleep == [1, 2]
         
         print(f"\nLLM 重试总耗时: {total_time:.2f}s")
         print(f"重试次数: {call_count}")
         
-        # 重试总时间应该在合理范围内（考虑指数退避）
-        assert total_time < 10.0
+        # 不再实际等待，重试逻辑本身应该很快
+        assert total_time < 1.0
 
 
 class TestScalabilityLimits:
     """可扩展性限制测试"""
     
+    @pytest.fixture(autouse=True)
+    def _client(self, app_client):
+        """复用 worker 内共享的测试客户端"""
+        self.client = app_client
+    
     def test_large_diff_processing(self):
         """测试大型 diff 处理"""
-        # 生成大型 diff
-        large_diff = "@@ -1,1000 +1,1500 @@\n"
-        for i in range(1000):
-            large_diff += f"+    line_{i} = 'new content'\n"
+        # 生成大型 diff，一次 join 拼接，避免循环中反复复制整个字符串
+        large_diff = "@@ -1,1000 +1,1500 @@\n" + "".join(
+            f"+    line_{i} = 'new content'\n" for i in range(1000)
+        )
         
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         # 测试提示生成
-        user_prompt = generate_user_prompt('large_file.py', large_diff)
+        user_prompt = get_file_user_prompt({'old_path': 'large_file.py', 'new_path': 'large_file.py', 'diff': large_diff})
         
-        end_time = time.time()
+        end_time = time.perf_counter()
         processing_time = end_time - start_time
         
         assert user_prompt is not None
@@ -423,20 +433,14 @@ class TestScalabilityLimits:
                 'diff': f'@@ -1,1 +1,2 @@\n def function_{i}():\n+    pass\n     return True'
             })
         
-        start_time = time.time()
+        start_time = time.perf_counter()
         
-        # 模拟处理所有文件
-        processed_files = 0
-        for file_change in file_changes:
-            user_prompt = generate_user_prompt(
-                file_change['new_path'],
-                file_change['diff']
-            )
-            
-            if user_prompt:
-                processed_files += 1
+        # 模拟处理所有文件：模板只取一次，逐个渲染
+        template = get_file_user_prompt_template()
+        user_prompts = [template.render(change=file_change) for file_change in file_changes]
+        processed_files = sum(1 for user_prompt in user_prompts if user_prompt)
         
-        end_time = time.time()
+        end_time = time.perf_counter()
         total_time = end_time - start_time
         
         print(f"\n多文件处理结果:")
@@ -454,29 +458,28 @@ class TestScalabilityLimits:
         # 测试不同大小的 payload
         payload_sizes = [1, 10, 100, 500]  # KB
         
-        for size_kb in payload_sizes:
-            # 生成指定大小的描述
-            description_size = size_kb * 1024 // 4  # 假设每个字符 4 字节
-            large_description = "A" * description_size
-            
-            webhook_data = {
+        # 在计时之前一次性生成并编码各个大小的请求体，描述内容与测试无关
+        payloads = {
+            size_kb: orjson.dumps({
                 "object_kind": "merge_request",
                 "event_type": "merge_request",
                 "object_attributes": {
                     "action": "open",
                     "id": 200 + size_kb,
                     "target_project_id": 1,
-                    "description": large_description
+                    "description": "A" * (size_kb * 1024 // 4)  # 假设每个字符 4 字节
                 },
                 "project": {"id": 1}
-            }
-            
-            start_time = time.time()
+            })
+            for size_kb in payload_sizes
+        }
+        
+        for size_kb, body in payloads.items():
+            start_time = time.perf_counter()
             
-            with patch('main.review_manager.process_merge_request', return_value=True):
-                response = self.client.post("/webhook", json=webhook_data)
+            response = self.client.post("/", content=body, headers=JSON_HEADERS)
             
-            end_time = time.time()
+            end_time = time.perf_counter()
             processing_time = end_time - start_time
             
             print(f"\nPayload 大小: {size_kb}KB, 处理时间: {processing_time:.3f}s")
@@ -490,73 +493,65 @@ class TestScalabilityLimits:
 class TestResourceUsage:
     """资源使用测试"""
     
+    @pytest.fixture(autouse=True)
+    def _client(self, app_client):
+        """复用 worker 内共享的测试客户端"""
+        self.client = app_client
+    
     def test_cpu_usage_monitoring(self):
         """测试 CPU 使用率监控"""
         import psutil
-        import os
         
         process = psutil.Process(os.getpid())
         
-        # 记录初始 CPU 使用率
-        initial_cpu = process.cpu_percent()
+        # 首次调用只是建立基准（总是返回 0.0），之后的调用返回两次调用之间的平均使用率
+        process.cpu_percent(interval=None)
         
         # 执行 CPU 密集型操作
-        start_time = time.time()
+        start_time = time.perf_counter()
         
         for i in range(100):
             # 模拟模板渲染和提示生成
-            system_prompt = generate_system_prompt()
-            user_prompt = generate_user_prompt(
-                f'file_{i}.py',
-                f'@@ -1,1 +1,2 @@\n def func_{i}():\n+    pass\n     return True'
-            )
+            system_prompt = get_file_system_prompt()
+            user_prompt = get_file_user_prompt({
+                'old_path': f'file_{i}.py',
+                'new_path': f'file_{i}.py',
+                'diff': f'@@ -1,1 +1,2 @@\n def func_{i}():\n+    pass\n     return True'
+            })
         
-        end_time = time.time()
+        end_time = time.perf_counter()
         
-        # 记录最终 CPU 使用率
-        final_cpu = process.cpu_percent()
+        # 计时区间之外读取负载期间的 CPU 使用率
+        cpu_usage = process.cpu_percent(interval=None)
         
         processing_time = end_time - start_time
         
         print(f"\nCPU 使用情况:")
-        print(f"初始 CPU: {initial_cpu:.1f}%")
-        print(f"最终 CPU: {final_cpu:.1f}%")
+        print(f"负载期间 CPU: {cpu_usage:.1f}%")
         print(f"处理时间: {processing_time:.3f}s")
         
         # CPU 使用率应该在合理范围内
         assert processing_time < 5.0
     
+    @pytest.mark.xdist_group("resource")
     def test_file_descriptor_usage(self):
         """测试文件描述符使用"""
-        import psutil
-        import os
-        
-        process = psutil.Process(os.getpid())
-        
-        try:
-            initial_fds = process.num_fds()
-        except AttributeError:
-            # Windows 系统可能不支持
+        # 直接列出 /proc/self/fd，一次目录读取即可得到当前打开的描述符数量
+        fd_dir = '/proc/self/fd'
+        if not os.path.isdir(fd_dir):
+            # 非 Linux 系统没有 /proc
             pytest.skip("文件描述符监控在此系统上不可用")
         
+        initial_fds = len(os.listdir(fd_dir))
+        
         # 执行多次操作
-        for i in range(50):
-            webhook_data = {
-                "object_kind": "merge_request",
-                "event_type": "merge_request",
-                "object_attributes": {
-                    "action": "open",
-                    "id": 300 + i,
-                    "target_project_id": 1
-                },
-                "project": {"id": 1}
-            }
-            
-            with patch('main.review_manager.process_merge_request', return_value=True):
-                response = self.client.post("/webhook", json=webhook_data)
-                assert response.status_code == 200
+        bodies = [mr_webhook_body(300 + i) for i in range(50)]
+        post = self.client.post
+        for body in bodies:
+            response = post("/", content=body, headers=JSON_HEADERS)
+            assert response.status_code == 200
         
-        final_fds = process.num_fds()
+        final_fds = len(os.listdir(fd_dir))
         fd_increase = final_fds - initial_fds
         
         print(f"\n文件描述符使用:")
@@ -571,62 +566,22 @@ class TestResourceUsage:
 class TestPerformanceRegression:
     """性能回归测试"""
     
-    def test_baseline_performance_metrics(self):
-        """测试基线性能指标"""
-        # 定义性能基线
-        performance_baselines = {
-            'webhook_response_time': 1.0,  # 秒
-            'template_render_time': 0.01,  # 秒
-            'prompt_generation_time': 0.05,  # 秒
-            'concurrent_success_rate': 0.95,  # 95%
-        }
-        
-        # 测试 webhook 响应时间
-        webhook_data = {
-            "object_kind": "merge_request",
-            "event_type": "merge_request",
-            "object_attributes": {
-                "action": "open",
-                "id": 400,
-                "target_project_id": 1
-            },
-            "project": {"id": 1}
-        }
+    @pytest.fixture(autouse=True)
+    def _client(self, app_client):
+        """复用 worker 内共享的测试客户端"""
+        self.client = app_client
+    
+    @pytest.mark.benchmark(group="regression")
+    def test_baseline_performance_metrics(self, benchmark):
+        """测试基线性能指标
+
+        基线由 pytest-benchmark 保存在 performance_baselines/ 中，
+        python run_tests.py --performance 与之对比，平均耗时退化超过 10% 即失败。
+        模板渲染和提示生成的基线见 TestPerformanceBenchmarks。
+        """
+        body = mr_webhook_body(400)
+        post = self.client.post
         
-        start_time = time.time()
-        with patch('main.review_manager.process_merge_request', return_value=True):
-            response = TestClient(app).post("/webhook", json=webhook_data)
-        webhook_time = time.time() - start_time
+        response = benchmark(post, "/", content=body, headers=JSON_HEADERS)
         
         assert response.status_code == 200
-        assert webhook_time < performance_baselines['webhook_response_time']
-        
-        # 测试模板渲染时间
-        start_time = time.time()
-        result = render_template('system_prompt.j2', file_path='test.py', diff='test diff')
-        template_time = time.time() - start_time
-        
-        assert result is not None
-        assert template_time < performance_baselines['template_render_time']
-        
-        # 测试提示生成时间
-        start_time = time.time()
-        system_prompt = generate_system_prompt()
-        user_prompt = generate_user_prompt('test.py', 'test diff')
-        prompt_time = time.time() - start_time
-        
-        assert system_prompt is not None
-        assert user_prompt is not None
-        assert prompt_time < performance_baselines['prompt_generation_time']
-        
-        print(f"\n性能基线检查:")
-        print(f"Webhook 响应时间: {webhook_time:.3f}s (基线: {performance_baselines['webhook_response_time']}s)")
-        print(f"模板渲染时间: {template_time:.4f}s (基线: {performance_baselines['template_render_time']}s)")
-        print(f"提示生成时间: {prompt_time:.4f}s (基线: {performance_baselines['prompt_generation_time']}s)")
-        
-        # 所有指标都应该在基线范围内
-        assert all([
-            webhook_time < performance_baselines['webhook_response_time'],
-            template_time < performance_baselines['template_render_time'],
-            prompt_time < performance_baselines['prompt_generation_time']
-        ])
\ No newline at end of file
@@ -4,411 +4,308 @@
 ReviewManager 模块测试
 """
 
-from unittest.mock import patch, Mock, MagicMock, call
-import json
+from itertools import count
+from types import MappingProxyType, SimpleNamespace
+from unittest.mock import Mock
 
 import pytest
-from gitlab.exceptions import GitlabError
+from gitlab.exceptions import GitlabGetError
 
-from review_manager import ReviewManager
-from models import Review, ReviewDiscussion, ReviewFileRecord
+import review_manager
+from config import settings
+from i18n import i18n
+from review_manager import ReviewManager, ReviewStatus
+
+
+def _llm_review(**review) -> MappingProxyType:
+    """构造 LLM 服务 chat 返回的评审结果（parse_response 解析后的字典）"""
+    return MappingProxyType({'duration': 1.0, **review})
+
+
+def _chat_replies(*replies):
+    """按顺序返回评审结果的 chat 副作用
+
+    _update_llm_resp 会原地修改 chat 的返回值，因此每次返回共享常量的副本；异常实例按原样抛出。
+    """
+    pending = iter(replies)
+
+    def chat(messages):
+        reply = next(pending)
+        if isinstance(reply, Exception):
+            raise reply
+        return dict(reply)
+    return chat
+
+
+# 模块级复用的 LLM 评审结果，MappingProxyType 防止测试意外修改共享数据
+_LLM_RESP_APPROVED_8 = _llm_review(
+    approved=True, score=8, issues=['小问题'], suggestions=['改进建议'], summary='代码质量良好'
+)
+_LLM_RESP_APPROVED_9 = _llm_review(
+    approved=True, score=9, issues=[], suggestions=['很好的改进'], summary='代码改进合理'
+)
+_LLM_RESP_REJECTED_6 = _llm_review(
+    approved=False, score=6, issues=['需要改进'], suggestions=['添加注释'], summary='需要小幅改进'
+)
+_LLM_RESP_MAIN_PY = _llm_review(
+    approved=True, score=8, issues=['注释可以更详细'], suggestions=['添加函数文档'], summary='main.py 改进良好'
+)
+_LLM_RESP_UTILS_PY = _llm_review(
+    approved=False, score=6, issues=['新函数缺少文档', '函数名不够描述性'],
+    suggestions=['添加函数文档', '重命名函数'], summary='utils.py 需要改进'
+)
+_LLM_RESP_GOOD = _llm_review(approved=True, score=8, issues=[], suggestions=[], summary='良好')
+
+# 模块级复用的只读文件变更，传给 ReviewManager 前转换为 dict
+_CHANGE_PY_SMALL = MappingProxyType({
+    'old_path': 'src/main.py',
+    'new_path': 'src/main.py',
+    'diff': '@@ -1,3 +1,4 @@\n def hello():\n+    print("world")\n     pass'
+})
+_CHANGE_PY_PRINT = MappingProxyType({
+    'old_path': 'test.py',
+    'new_path': 'test.py',
+    'diff': '@@ -1,1 +1,2 @@\n print("hello")\n+print("world")'
+})
+_CHANGE_PY_DELETED = MappingProxyType({
+    'old_path': 'src/old.py', 'new_path': 'src/old.py', 'diff': '', 'deleted_file': True
+})
+# 只重命名，没有实际变更
+_CHANGE_PY_RENAMED = MappingProxyType({
+    'old_path': 'src/old.py', 'new_path': 'src/main.py', 'diff': '', 'renamed_file': True
+})
+_CHANGE_BINARY = MappingProxyType({'old_path': 'image.png', 'new_path': 'image.png', 'diff': 'Binary files differ'})
+
+# 合并请求打开事件，process_merge_request_event 只读取 object_kind 和 object_attributes
+_MR_OPEN_EVENT = MappingProxyType({
+    'object_kind': 'merge_request',
+    'object_attributes': MappingProxyType({'target_project_id': 1, 'iid': 123, 'action': 'open'})
+})
+
+
+def _changes(*file_changes) -> dict:
+    """构造 merge_request.changes() 的返回值"""
+    return {'changes': [dict(change) for change in file_changes], 'diff_refs': {}}
+
+
+@pytest.fixture(autouse=True)
+def patched_db(monkeypatch):
+    """替换 review_manager 中的数据库操作和文件类型检查
+
+    直接在已导入的模块上替换属性，不必每个测试按字符串路径逐个 patch；
+    测试需要特定行为时覆盖对应模拟对象的 return_value 或 side_effect。
+    """
+    mocks = {
+        'update_or_create_review': Mock(return_value=1),
+        'create_review_discussion': Mock(return_value=1),
+        'create_review_file_record': Mock(return_value=1),
+        'create_review_file_llm_message': Mock(return_value=1),
+        'get_discussion_id': Mock(return_value=None),
+        'get_review_file_llm_messages': Mock(return_value=[]),
+        'is_supported_file': Mock(return_value=True),
+    }
+    for name, mock in mocks.items():
+        monkeypatch.setattr(review_manager, name, mock)
+    return mocks
+
+
+@pytest.fixture
+def mock_llm_service():
+    """模拟 LLM 服务，测试通过 chat.side_effect 设置评审结果"""
+    return SimpleNamespace(chat=Mock(), model='gpt-4')
+
+
+@pytest.fixture
+def patched_clients(monkeypatch, mock_gitlab_client, mock_llm_service):
+    """让 ReviewManager 构造时创建的 GitLab 客户端和 LLM 服务返回模拟对象"""
+    clients = SimpleNamespace(
+        gitlab=Mock(return_value=mock_gitlab_client),
+        llm_service=Mock(return_value=mock_llm_service)
+    )
+    monkeypatch.setattr(review_manager, 'Gitlab', clients.gitlab)
+    monkeypatch.setattr(review_manager, 'LLMService', clients.llm_service)
+    return clients
+
+
+@pytest.fixture
+def manager(patched_clients):
+    """使用模拟 GitLab 客户端和 LLM 服务的 ReviewManager"""
+    return ReviewManager()
 
 
 class TestReviewManagerInit:
     """ReviewManager 初始化测试"""
     
-    def test_init_success(self, mock_settings, mock_gitlab_client, mock_llm_service):
+    def test_init_success(self, manager, patched_clients, mock_gitlab_client, mock_llm_service):
         """测试成功初始化"""
-        manager = ReviewManager()
-        
-        assert manager.settings == mock_settings
-        assert manager.gitlab_client == mock_gitlab_client
-        assert manager.llm_service == mock_llm_service
+        assert manager.gl is mock_gitlab_client
+        assert manager.llm_service is mock_llm_service
+        assert manager.reviewers is None
+        patched_clients.gitlab.assert_called_once_with(url=settings.gitlab_url, oauth_token=settings.gitlab_token)
     
-    def test_init_with_custom_params(self):
-        """测试使用自定义参数初始化"""
-        custom_settings = Mock()
-        custom_gitlab = Mock()
-        custom_llm = Mock()
-        
-        manager = ReviewManager(
-            settings=custom_settings,
-            gitlab_client=custom_gitlab,
-            llm_service=custom_llm
-        )
-        
-        assert manager.settings == custom_settings
-        assert manager.gitlab_client == custom_gitlab
-        assert manager.llm_service == custom_llm
+    @pytest.mark.asyncio
+    async def test_check_sets_reviewer(self, manager, mock_gitlab_client):
+        """测试连接性检查通过后记录机器人用户"""
+        bot = SimpleNamespace(id=42)
+        mock_gitlab_client.auth = Mock()
+        mock_gitlab_client.users = SimpleNamespace(list=Mock(return_value=[bot]))
+        
+        assert await manager.check() is True
+        assert manager.reviewers is bot
+        mock_gitlab_client.users.list.assert_called_once_with(username=settings.gitlab_bot_username)
+    
+    @pytest.mark.asyncio
+    async def test_check_bot_not_found(self, manager, mock_gitlab_client):
+        """测试找不到机器人用户时连接性检查失败"""
+        mock_gitlab_client.auth = Mock()
+        mock_gitlab_client.users = SimpleNamespace(list=Mock(return_value=[]))
+        
+        with pytest.raises(Exception, match=i18n.t('log.gitlab_bot_user_not_found')):
+            await manager.check()
 
 
 class TestProcessMergeRequest:
-    """处理合并请求测试"""
+    """处理合并请求事件测试"""
     
-    def test_process_merge_request_success(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试成功处理合并请求"""
-        # 设置模拟数据
-        project_id = 1
-        merge_request_id = 123
-        
-        # 模拟 GitLab 项目和 MR
-        mock_project = Mock()
-        mock_mr = Mock()
-        mock_mr.changes.return_value = [
-            {
-                'old_path': 'src/main.py',
-                'new_path': 'src/main.py',
-                'diff': '@@ -1,3 +1,4 @@\n def hello():\n+    print("world")\n     pass'
-            }
-        ]
-        
-        mock_gitlab_client.projects.get.return_value = mock_project
-        mock_project.mergerequests.get.return_value = mock_mr
-        
-        # 模拟 LLM 响应
-        mock_llm_service.chat.return_value = {
-            'content': json.dumps({
-                'approved': True,
-                'score': 8,
-                'issue': ['小问题'],
-                'suggestion': ['改进建议'],
-                'summary': '代码质量良好'
-            }),
-            'usage': {'total_tokens': 100}
-        }
-        
-        # 模拟数据库操作
-        with patch('review_manager.update_or_create_review', return_value=1), \
-             patch('review_manager.create_review_discussion', return_value=1), \
-             patch('review_manager.create_review_file_record', return_value=1), \
-             patch('review_manager.create_review_file_llm_message', return_value=1), \
-             patch('review_manager.get_discussion_id', return_value=None):
-            
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            result = manager.process_merge_request(project_id, merge_request_id)
-            
-            assert result is True
-            
-            # 验证 GitLab API 调用
-            mock_gitlab_client.projects.get.assert_called_once_with(project_id)
-            mock_project.mergerequests.get.assert_called_once_with(merge_request_id)
-            
-            # 验证 LLM 调用
-            assert mock_llm_service.chat.called
-    
-    def test_process_merge_request_no_changes(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试处理没有变更的合并请求"""
-        project_id = 1
-        merge_request_id = 123
-        
-        # 模拟没有变更的 MR
-        mock_project = Mock()
-        mock_mr = Mock()
-        mock_mr.changes.return_value = []
-        
-        mock_gitlab_client.projects.get.return_value = mock_project
-        mock_project.mergerequests.get.return_value = mock_mr
-        
-        with patch('review_manager.update_or_create_review', return_value=1):
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            result = manager.process_merge_request(project_id, merge_request_id)
-            
-            assert result is True
-            # 验证没有调用 LLM
-            assert not mock_llm_service.chat.called
+    @pytest.mark.parametrize("changes,replies,project_error,expected,llm_calls,approved", [
+        pytest.param(_changes(_CHANGE_PY_SMALL), (_LLM_RESP_APPROVED_8,), None, True, 1, True, id="success"),
+        # 没有变更时不调用 LLM
+        pytest.param(_changes(), (), None, True, 0, False, id="no_changes"),
+        # 获取项目失败时记录日志并放弃处理，不向外抛出
+        pytest.param(_changes(), (), GitlabGetError("项目不存在"), False, 0, False, id="gitlab_error"),
+        pytest.param(
+            _changes(), (), GitlabGetError("404: Project not found", 404), False, 0, False,
+            id="gitlab_404"
+        ),
+        pytest.param(_changes(), (), Exception("网络超时"), False, 0, False, id="gitlab_timeout"),
+        # LLM 出错时按默认的拒绝结果创建讨论，合并请求不会被批准
+        pytest.param(
+            _changes(_CHANGE_PY_PRINT), (Exception("LLM 服务不可用"),), None, True, 1, False,
+            id="llm_error"
+        ),
+    ])
+    @pytest.mark.asyncio
+    async def test_process_merge_request(self, manager, mock_gitlab_client, mock_project, mock_mr, mock_llm_service,
+                                         changes, replies, project_error, expected, llm_calls, approved):
+        """测试处理合并请求：正常、无变更、GitLab 错误（含 404 和网络超时）和 LLM 错误"""
+        mock_mr.changes.return_value = changes
+        mock_llm_service.chat.side_effect = _chat_replies(*replies)
+        mock_gitlab_client.projects.get.side_effect = project_error
+        
+        result = await manager.process_merge_request_event(dict(_MR_OPEN_EVENT))
+        
+        assert result is expected
+        mock_gitlab_client.projects.get.assert_called_once_with(1)
+        assert mock_llm_service.chat.call_count == llm_calls
+        # 所有文件都通过评审时才批准合并请求
+        assert mock_mr.approve.called is approved
     
-    def test_process_merge_request_gitlab_error(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试 GitLab API 错误"""
-        project_id = 1
-        merge_request_id = 123
-        
-        # 模拟 GitLab 错误
-        mock_gitlab_client.projects.get.side_effect = GitlabError("项目不存在")
-        
-        manager = ReviewManager(
-            settings=mock_settings,
-            gitlab_client=mock_gitlab_client,
-            llm_service=mock_llm_service
-        )
-        
-        with pytest.raises(GitlabError, match="项目不存在"):
-            manager.process_merge_request(project_id, merge_request_id)
-    
-    def test_process_merge_request_llm_error(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试 LLM 服务错误"""
-        project_id = 1
-        merge_request_id = 123
-        
-        # 设置正常的 GitLab 响应
-        mock_project = Mock()
-        mock_mr = Mock()
-        mock_mr.changes.return_value = [
-            {
-                'old_path': 'test.py',
-                'new_path': 'test.py',
-                'diff': '@@ -1,1 +1,2 @@\n print("hello")\n+print("world")'
-            }
-        ]
-        
-        mock_gitlab_client.projects.get.return_value = mock_project
-        mock_project.mergerequests.get.return_value = mock_mr
-        
-        # 模拟 LLM 错误
-        mock_llm_service.chat.side_effect = Exception("LLM 服务不可用")
-        
-        with patch('review_manager.update_or_create_review', return_value=1), \
-             patch('review_manager.create_review_discussion', return_value=1), \
-             patch('review_manager.get_discussion_id', return_value=None):
-            
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            with pytest.raises(Exception, match="LLM 服务不可用"):
-                manager.process_merge_request(project_id, merge_request_id)
+    @pytest.mark.parametrize("object_attributes", [
+        {'iid': 123, 'action': 'open'},
+        {'target_project_id': 1, 'action': 'open'},
+        {'target_project_id': 1, 'iid': 123},
+    ], ids=["target_project_id", "iid", "action"])
+    @pytest.mark.asyncio
+    async def test_process_merge_request_missing_fields(self, manager, mock_gitlab_client, object_attributes):
+        """测试事件缺少必需字段时不访问 GitLab"""
+        event = {'object_kind': 'merge_request', 'object_attributes': object_attributes}
+        
+        assert await manager.process_merge_request_event(event) is False
+        mock_gitlab_client.projects.get.assert_not_called()
     
-    def test_process_merge_request_invalid_llm_response(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试无效的 LLM 响应"""
-        project_id = 1
-        merge_request_id = 123
-        
-        # 设置正常的 GitLab 响应
-        mock_project = Mock()
-        mock_mr = Mock()
-        mock_mr.changes.return_value = [
-            {
-                'old_path': 'test.py',
-                'new_path': 'test.py',
-                'diff': '@@ -1,1 +1,2 @@\n print("hello")\n+print("world")'
-            }
-        ]
-        
-        mock_gitlab_client.projects.get.return_value = mock_project
-        mock_project.mergerequests.get.return_value = mock_mr
-        
-        # 模拟无效的 LLM 响应
-        mock_llm_service.chat.return_value = {
-            'content': 'invalid json',
-            'usage': {'total_tokens': 50}
+    @pytest.mark.parametrize("action", ["close", "merge"])
+    @pytest.mark.asyncio
+    async def test_process_merge_request_other_actions(self, manager, mock_mr, mock_llm_service, action):
+        """测试关闭、合并等动作不触发评审"""
+        event = {
+            'object_kind': 'merge_request',
+            'object_attributes': {**_MR_OPEN_EVENT['object_attributes'], 'action': action}
         }
         
-        with patch('review_manager.update_or_create_review', return_value=1), \
-             patch('review_manager.create_review_discussion', return_value=1), \
-             patch('review_manager.get_discussion_id', return_value=None), \
-             patch('review_manager.create_review_file_llm_message', return_value=1):
-            
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            # 应该处理 JSON 解析错误但不抛出异常
-            result = manager.process_merge_request(project_id, merge_request_id)
-            
-            # 即使 LLM 响应无效，也应该返回 True（已记录错误）
-            assert result is True
+        assert await manager.process_merge_request_event(event) is True
+        mock_mr.changes.assert_not_called()
+        mock_llm_service.chat.assert_not_called()
 
 
 class TestProcessFileChange:
     """处理文件变更测试"""
     
-    def test_process_file_change_new_discussion(self, mock_settings, mock_gitlab_client, mock_llm_service):
+    @pytest.mark.asyncio
+    async def test_process_file_change_new_discussion(self, manager, patched_db, mock_project, mock_mr,
+                                                      mock_discussion, mock_llm_service):
         """测试处理新文件变更（创建新讨论）"""
-        project_id = 1
-        merge_request_id = 123
-        file_change = {
-            'old_path': 'src/main.py',
-            'new_path': 'src/main.py',
-            'diff': '@@ -1,3 +1,4 @@\n def hello():\n+    print("world")\n     pass'
-        }
+        mock_llm_service.chat.side_effect = _chat_replies(_LLM_RESP_APPROVED_9)
         
-        # 模拟 LLM 响应
-        mock_llm_service.chat.return_value = {
-            'content': json.dumps({
-                'approved': True,
-                'score': 9,
-                'issue': [],
-                'suggestion': ['很好的改进'],
-                'summary': '代码改进合理'
-            }),
-            'usage': {'total_tokens': 80}
-        }
+        result = await manager._review_single_file(mock_project, mock_mr, dict(_CHANGE_PY_SMALL), _changes())
+        
+        assert result is True
         
-        with patch('review_manager.get_discussion_id', return_value=None), \
-             patch('review_manager.create_review_discussion', return_value=1) as mock_create_discussion, \
-             patch('review_manager.create_review_file_record', return_value=1) as mock_create_record, \
-             patch('review_manager.create_review_file_llm_message', return_value=1) as mock_create_message:
-            
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            result = manager._process_file_change(project_id, merge_request_id, file_change)
-            
-            assert result is True
-            
-            # 验证创建了新讨论
-            mock_create_discussion.assert_called_once()
-            mock_create_record.assert_called_once()
-            assert mock_create_message.call_count == 2  # user + assistant 消息
+        # 验证创建了新讨论，并在通过评审后标记为已解决
+        mock_mr.discussions.create.assert_called_once()
+        patched_db['create_review_discussion'].assert_called_once_with(1, 123, 'discussion_123', 'src/main.py')
+        patched_db['create_review_file_record'].assert_called_once()
+        assert patched_db['create_review_file_llm_message'].call_count == 2  # user + assistant 消息
+        mock_discussion.save.assert_called_once()
     
-    def test_process_file_change_existing_discussion(self, mock_settings, mock_gitlab_client, mock_llm_service):
+    @pytest.mark.asyncio
+    async def test_process_file_change_existing_discussion(self, manager, patched_db, mock_project, mock_mr,
+                                                           mock_discussion, mock_llm_service):
         """测试处理已存在讨论的文件变更"""
-        project_id = 1
-        merge_request_id = 123
-        file_change = {
-            'old_path': 'src/main.py',
-            'new_path': 'src/main.py',
-            'diff': '@@ -1,3 +1,4 @@\n def hello():\n+    print("world")\n     pass'
-        }
+        mock_llm_service.chat.side_effect = _chat_replies(_LLM_RESP_REJECTED_6)
+        patched_db['get_discussion_id'].return_value = 'existing_discussion_123'
         
-        # 模拟 LLM 响应
-        mock_llm_service.chat.return_value = {
-            'content': json.dumps({
-                'approved': False,
-                'score': 6,
-                'issue': ['需要改进'],
-                'suggestion': ['添加注释'],
-                'summary': '需要小幅改进'
-            }),
-            'usage': {'total_tokens': 90}
-        }
-        
-        with patch('review_manager.get_discussion_id', return_value='existing_discussion_123'), \
-             patch('review_manager.create_review_discussion') as mock_create_discussion, \
-             patch('review_manager.create_review_file_record', return_value=1) as mock_create_record, \
-             patch('review_manager.create_review_file_llm_message', return_value=1) as mock_create_message:
-            
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            result = manager._process_file_change(project_id, merge_request_id, file_change)
-            
-            assert result is True
-            
-            # 验证没有创建新讨论
-            mock_create_discussion.assert_not_called()
-            mock_create_record.assert_called_once()
-            assert mock_create_message.call_count == 2
-    
-    def test_process_file_change_unsupported_file(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试处理不支持的文件类型"""
-        project_id = 1
-        merge_request_id = 123
-        file_change = {
-            'old_path': 'image.png',
-            'new_path': 'image.png',
-            'diff': 'Binary files differ'
-        }
+        result = await manager._review_single_file(mock_project, mock_mr, dict(_CHANGE_PY_SMALL), _changes())
         
-        with patch('review_manager.is_supported_file', return_value=False):
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            result = manager._process_file_change(project_id, merge_request_id, file_change)
-            
-            assert result is True
-            # 验证没有调用 LLM
-            assert not mock_llm_service.chat.called
-    
-    def test_process_file_change_empty_diff(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试处理空的 diff"""
-        project_id = 1
-        merge_request_id = 123
-        file_change = {
-            'old_path': 'src/main.py',
-            'new_path': 'src/main.py',
-            'diff': ''
-        }
+        assert result is False
         
-        with patch('review_manager.is_supported_file', return_value=True):
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            result = manager._process_file_change(project_id, merge_request_id, file_change)
-            
-            assert result is True
-            # 验证没有调用 LLM（因为没有实际变更）
-            assert not mock_llm_service.chat.called
-
-
-class TestGenerateDiscussionId:
-    """生成讨论ID测试"""
+        # 验证在已有讨论中追加评论，没有创建新讨论
+        mock_mr.discussions.get.assert_called_once_with('existing_discussion_123')
+        patched_db['get_review_file_llm_messages'].assert_called_once_with('existing_discussion_123')
+        mock_discussion.notes.create.assert_called_once()
+        mock_mr.discussions.create.assert_not_called()
+        patched_db['create_review_discussion'].assert_not_called()
+        patched_db['create_review_file_record'].assert_called_once()
+        assert patched_db['create_review_file_llm_message'].call_count == 2
     
-    def test_generate_discussion_id_consistent(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试生成的讨论ID一致性"""
-        manager = ReviewManager(
-            settings=mock_settings,
-            gitlab_client=mock_gitlab_client,
-            llm_service=mock_llm_service
-        )
-        
-        # 相同输入应该生成相同的ID
-        id1 = manager._generate_discussion_id(1, 123, 'src/main.py')
-        id2 = manager._generate_discussion_id(1, 123, 'src/main.py')
-        
-        assert id1 == id2
-        assert isinstance(id1, str)
-        assert len(id1) > 0
+    @pytest.mark.parametrize("file_change,supported", [
+        pytest.param(_CHANGE_BINARY, False, id="unsupported_file"),
+        pytest.param(_CHANGE_PY_DELETED, True, id="deleted_file"),
+        pytest.param(_CHANGE_PY_RENAMED, True, id="renamed_without_diff"),
+    ])
+    def test_process_file_change_skipped(self, patched_db, mock_project, mock_mr, file_change, supported):
+        """测试不支持的文件类型、删除的文件和没有变更的重命名被跳过"""
+        patched_db['is_supported_file'].return_value = supported
+        
+        assert ReviewManager._should_review_file(dict(file_change), mock_project, mock_mr) is False
+
+
+class TestDiscussionLookup:
+    """讨论查找测试"""
     
-    def test_generate_discussion_id_different_inputs(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试不同输入生成不同的ID"""
-        manager = ReviewManager(
-            settings=mock_settings,
-            gitlab_client=mock_gitlab_client,
-            llm_service=mock_llm_service
-        )
-        
-        # 不同输入应该生成不同的ID
-        id1 = manager._generate_discussion_id(1, 123, 'src/main.py')
-        id2 = manager._generate_discussion_id(1, 124, 'src/main.py')
-        id3 = manager._generate_discussion_id(2, 123, 'src/main.py')
-        id4 = manager._generate_discussion_id(1, 123, 'src/utils.py')
-        
-        assert id1 != id2
-        assert id1 != id3
-        assert id1 != id4
-        assert id2 != id3
-        assert id2 != id4
-        assert id3 != id4
+    @pytest.mark.parametrize("file_change,file_path", [
+        pytest.param(_CHANGE_PY_RENAMED, 'src/main.py', id="new_path"),
+        pytest.param({'old_path': 'src/old.py', 'new_path': '', 'diff': '-pass'}, 'src/old.py', id="old_path"),
+    ])
+    @pytest.mark.asyncio
+    async def test_discussion_lookup_key(self, manager, patched_db, mock_project, mock_mr, mock_llm_service,
+                                         file_change, file_path):
+        """测试按项目、合并请求和文件路径查找已有讨论，新路径为空时使用旧路径"""
+        mock_llm_service.chat.side_effect = _chat_replies(_LLM_RESP_GOOD)
+        
+        await manager._review_single_file(mock_project, mock_mr, dict(file_change), _changes())
+        
+        patched_db['get_discussion_id'].assert_called_once_with(1, 123, file_path)
 
 
 class TestReviewManagerIntegration:
     """ReviewManager 集成测试"""
     
-    def test_complete_review_workflow(self, mock_settings, mock_gitlab_client, mock_llm_service):
+    @pytest.mark.asyncio
+    async def test_complete_review_workflow(self, manager, patched_db, mock_gitlab_client, mock_project, mock_mr,
+                                            mock_llm_service):
         """测试完整的代码审查工作流"""
-        project_id = 1
-        merge_request_id = 123
-        
-        # 设置复杂的 GitLab 响应
-        mock_project = Mock()
-        mock_mr = Mock()
-        mock_mr.changes.return_value = [
+        # 设置包含两个文件的变更
+        mock_mr.changes.return_value = _changes(
             {
                 'old_path': 'src/main.py',
                 'new_path': 'src/main.py',
@@ -419,71 +316,37 @@ class TestReviewManagerIntegration:
                 'new_path': 'src/utils.py',
                 'diff': '@@ -10,3 +10,6 @@\n def helper():\n     pass\n+\n+def new_function():\n+    return True'
             }
-        ]
+        )
         
-        mock_gitlab_client.projects.get.return_value = mock_project
-        mock_project.mergerequests.get.return_value = mock_mr
+        # 设置 LLM 响应（一个文件通过，一个文件未通过）
+        mock_llm_service.chat.side_effect = _chat_replies(_LLM_RESP_MAIN_PY, _LLM_RESP_UTILS_PY)
         
-        # 设置 LLM 响应（为每个文件返回不同的结果）
-        llm_responses = [
-            {
-                'content': json.dumps({
-                    'approved': True,
-                    'score': 8,
-                    'issue': ['注释可以更详细'],
-                    'suggestion': ['添加函数文档'],
-                    'summary': 'main.py 改进良好'
-                }),
-                'usage': {'total_tokens': 120}
-            },
-            {
-                'content': json.dumps({
-                    'approved': False,
-                    'score': 6,
-                    'issue': ['新函数缺少文档', '函数名不够描述性'],
-                    'suggestion': ['添加函数文档', '重命名函数'],
-                    'summary': 'utils.py 需要改进'
-                }),
-                'usage': {'total_tokens': 150}
-            }
-        ]
+        # 模拟数据库操作，每次调用返回递增的主键
+        patched_db['create_review_discussion'].side_effect = count(1)
+        patched_db['create_review_file_record'].side_effect = count(1)
+        patched_db['create_review_file_llm_message'].side_effect = count(1)
+        
+        result = await manager.process_merge_request_event(dict(_MR_OPEN_EVENT))
+        
+        assert result is True
+        
+        # 验证 LLM 被调用了两次（每个文件一次），每个文件各创建一个讨论
+        assert mock_llm_service.chat.call_count == 2
+        assert mock_mr.discussions.create.call_count == 2
+        assert patched_db['create_review_file_llm_message'].call_count == 4
         
-        mock_llm_service.chat.side_effect = llm_responses
+        # 验证 GitLab API 调用
+        mock_gitlab_client.projects.get.assert_called_once_with(1)
+        mock_project.mergerequests.get.assert_called_once_with(123)
         
-        # 模拟数据库操作
-        with patch('review_manager.update_or_create_review', return_value=1), \
-             patch('review_manager.create_review_discussion', side_effect=[1, 2]), \
-             patch('review_manager.create_review_file_record', side_effect=[1, 2]), \
-             patch('review_manager.create_review_file_llm_message', side_effect=[1, 2, 3, 4]), \
-             patch('review_manager.get_discussion_id', return_value=None), \
-             patch('review_manager.is_supported_file', return_value=True):
-            
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            result = manager.process_merge_request(project_id, merge_request_id)
-            
-            assert result is True
-            
-            # 验证 LLM 被调用了两次（每个文件一次）
-            assert mock_llm_service.chat.call_count == 2
-            
-            # 验证 GitLab API 调用
-            mock_gitlab_client.projects.get.assert_called_once_with(project_id)
-            mock_project.mergerequests.get.assert_called_once_with(merge_request_id)
+        # 有文件未通过评审，不批准合并请求
+        patched_db['update_or_create_review'].assert_called_once_with(1, 123, ReviewStatus.PENDING.value)
+        mock_mr.approve.assert_not_called()
     
-    def test_partial_failure_handling(self, mock_settings, mock_gitlab_client, mock_llm_service):
+    @pytest.mark.asyncio
+    async def test_partial_failure_handling(self, manager, patched_db, mock_mr, mock_llm_service):
         """测试部分失败的处理"""
-        project_id = 1
-        merge_request_id = 123
-        
-        # 设置 GitLab 响应
-        mock_project = Mock()
-        mock_mr = Mock()
-        mock_mr.changes.return_value = [
+        mock_mr.changes.return_value = _changes(
             {
                 'old_path': 'src/main.py',
                 'new_path': 'src/main.py',
@@ -494,140 +357,49 @@ class TestReviewManagerIntegration:
                 'new_path': 'src/utils.py',
                 'diff': '@@ -1,1 +1,2 @@\n def test():\n+    pass'
             }
-        ]
+        )
         
-        mock_gitlab_client.projects.get.return_value = mock_project
-        mock_project.mergerequests.get.return_value = mock_mr
+        # 第一次调用成功，第二次调用抛出异常
+        mock_llm_service.chat.side_effect = _chat_replies(_LLM_RESP_GOOD, Exception("LLM 错误"))
         
-        # 第一个文件成功，第二个文件失败
-        llm_responses = [
-            {
-                'content': json.dumps({
-                    'approved': True,
-                    'score': 8,
-                    'issue': [],
-                    'suggestion': [],
-                    'summary': '良好'
-                }),
-                'usage': {'total_tokens': 100}
-            }
-        ]
+        patched_db['create_review_discussion'].side_effect = count(1)
         
-        # 第二次调用抛出异常
-        mock_llm_service.chat.side_effect = llm_responses + [Exception("LLM 错误")]
+        # 单个文件的 LLM 错误不影响其他文件，出错的文件按拒绝结果记录，合并请求不被批准
+        result = await manager.process_merge_request_event(dict(_MR_OPEN_EVENT))
         
-        with patch('review_manager.update_or_create_review', return_value=1), \
-             patch('review_manager.create_review_discussion', side_effect=[1, 2]), \
-             patch('review_manager.create_review_file_record', return_value=1), \
-             patch('review_manager.create_review_file_llm_message', return_value=1), \
-             patch('review_manager.get_discussion_id', return_value=None), \
-             patch('review_manager.is_supported_file', return_value=True):
-            
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            # 应该处理部分失败但不完全崩溃
-            with pytest.raises(Exception, match="LLM 错误"):
-                manager.process_merge_request(project_id, merge_request_id)
+        assert result is True
+        assert mock_llm_service.chat.call_count == 2
+        assert mock_mr.discussions.create.call_count == 2
+        mock_mr.approve.assert_not_called()
     
-    def test_concurrent_processing_simulation(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试并发处理模拟"""
-        # 这个测试模拟多个 ReviewManager 实例同时处理不同的 MR
-        project_id = 1
-        
-        # 创建多个管理器实例
-        managers = [
-            ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            for _ in range(3)
-        ]
+    @pytest.mark.asyncio
+    async def test_concurrent_discussion_ids(self, manager, patched_db, mock_mr, mock_llm_service):
+        """测试并发评审多个文件时，每个文件记录 GitLab 为其创建的讨论ID"""
+        paths = [f'src/file_{i}.py' for i in range(3)]
+        mock_mr.changes.return_value = _changes(
+            *({'old_path': path, 'new_path': path, 'diff': '@@ -1,1 +1,2 @@\n+pass'} for path in paths)
+        )
+        mock_llm_service.chat.side_effect = _chat_replies(*[_LLM_RESP_GOOD] * len(paths))
+        mock_mr.discussions.create.side_effect = (SimpleNamespace(id=f'discussion_{i}') for i in count(1))
         
-        # 为每个管理器设置不同的 MR 数据
-        mr_ids = [123, 124, 125]
+        assert await manager.process_merge_request_event(dict(_MR_OPEN_EVENT)) is True
         
-        for i, (manager, mr_id) in enumerate(zip(managers, mr_ids)):
-            # 设置独立的模拟响应
-            mock_project = Mock()
-            mock_mr = Mock()
-            mock_mr.changes.return_value = [
-                {
-                    'old_path': f'src/file_{i}.py',
-                    'new_path': f'src/file_{i}.py',
-                    'diff': f'@@ -1,1 +1,2 @@\n print("file_{i}")\n+print("updated")'
-                }
-            ]
-            
-            # 每个管理器应该生成不同的讨论ID
-            discussion_id_1 = manager._generate_discussion_id(project_id, mr_id, f'src/file_{i}.py')
-            discussion_id_2 = managers[0]._generate_discussion_id(project_id, mr_ids[0], 'src/file_0.py')
-            
-            if i > 0:
-                assert discussion_id_1 != discussion_id_2
+        # 文件并发评审，创建讨论的顺序不固定，只比较记录下的组合
+        recorded = {c.args for c in patched_db['create_review_discussion'].call_args_list}
+        assert {path for _, _, _, path in recorded} == set(paths)
+        assert {discussion_id for _, _, discussion_id, _ in recorded} == {'discussion_1', 'discussion_2', 'discussion_3'}
+        assert {(project_id, mr_iid) for project_id, mr_iid, _, _ in recorded} == {(1, 123)}
 
 
 class TestErrorHandling:
     """错误处理测试"""
     
-    def test_database_connection_error(self, mock_settings, mock_gitlab_client, mock_llm_service):
+    @pytest.mark.asyncio
+    async def test_database_connection_error(self, manager, patched_db, mock_mr):
         """测试数据库连接错误"""
-        project_id = 1
-        merge_request_id = 123
-        
-        # 设置正常的 GitLab 响应
-        mock_project = Mock()
-        mock_mr = Mock()
-        mock_mr.changes.return_value = []
-        
-        mock_gitlab_client.projects.get.return_value = mock_project
-        mock_project.mergerequests.get.return_value = mock_mr
-        
         # 模拟数据库错误
-        with patch('review_manager.update_or_create_review', side_effect=Exception("数据库连接失败")):
-            manager = ReviewManager(
-                settings=mock_settings,
-                gitlab_client=mock_gitlab_client,
-                llm_service=mock_llm_service
-            )
-            
-            with pytest.raises(Exception, match="数据库连接失败"):
-                manager.process_merge_request(project_id, merge_request_id)
-    
-    def test_network_timeout_simulation(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试网络超时模拟"""
-        project_id = 1
-        merge_request_id = 123
-        
-        # 模拟网络超时
-        mock_gitlab_client.projects.get.side_effect = Exception("网络超时")
-        
-        manager = ReviewManager(
-            settings=mock_settings,
-            gitlab_client=mock_gitlab_client,
-            llm_service=mock_llm_service
-        )
-        
-        with pytest.raises(Exception, match="网络超时"):
-            manager.process_merge_request(project_id, merge_request_id)
-    
-    def test_invalid_project_or_mr(self, mock_settings, mock_gitlab_client, mock_llm_service):
-        """测试无效的项目或MR ID"""
-        project_id = 999
-        merge_request_id = 999
-        
-        # 模拟项目不存在
-        mock_gitlab_client.projects.get.side_effect = GitlabError("404: Project not found")
-        
-        manager = ReviewManager(
-            settings=mock_settings,
-            gitlab_client=mock_gitlab_client,
-            llm_service=mock_llm_service
-        )
+        patched_db['update_or_create_review'].side_effect = Exception("数据库连接失败")
         
-        with pytest.raises(GitlabError, match="404: Project not found"):
-            manager.process_merge_request(project_id, merge_request_id)
\ No newline at end of file
+        # 错误在事件处理中记录日志，不向外抛出
+        assert await manager.process_merge_request_event(dict(_MR_OPEN_EVENT)) is False
+        mock_mr.changes.assert_not_called()
@@ -6,28 +6,31 @@ utils 模块测试
 
 import json
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from unittest.mock import patch, Mock
 
 import pytest
 from jinja2 import TemplateNotFound
 
+import utils
 from utils import (
     _get_jinja_env, _render_template, get_file_system_prompt,
-    get_file_user_prompt, get_discussion_content, parse_response,
-    is_supported_file, SUPPORTED_EXTENSIONS
+    get_file_user_prompt, get_file_user_prompt_template, get_discussion_content, parse_response,
+    deserialize_llm_resp,
+    is_supported_file, filter_supported_files, SUPPORTED_EXTENSIONS
 )
 
 
 class TestJinjaEnvironment:
     """Jinja2 环境测试"""
     
-    def test_get_jinja_env(self, temp_template_dir):
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_get_jinja_env(self):
         """测试获取 Jinja2 环境"""
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            env = _get_jinja_env()
-            assert env is not None
-            assert env.loader is not None
+        env = _get_jinja_env()
+        assert env is not None
+        assert env.loader is not None
     
     def test_get_jinja_env_missing_dir(self):
         """测试模板目录不存在的情况"""
@@ -35,114 +38,151 @@ class TestJinjaEnvironment:
             with pytest.raises(FileNotFoundError, match="模板目录不存在"):
                 _get_jinja_env()
     
-    def test_jinja_env_singleton(self, temp_template_dir):
+    @pytest.mark.usefixtures('temp_jinja_env')
+    def test_jinja_env_singleton(self):
         """测试 Jinja2 环境单例模式"""
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            # 重置全局变量
-            import utils
-            utils._env = None
-            
-            env1 = _get_jinja_env()
-            env2 = _get_jinja_env()
-            assert env1 is env2
+        env1 = _get_jinja_env()
+        env2 = _get_jinja_env()
+        assert env1 is env2
+    
+    @pytest.mark.usefixtures('temp_jinja_env')
+    def test_jinja_env_concurrent_init(self):
+        """测试并发首次获取时只构建一个 Jinja2 环境"""
+        with patch('utils.Environment', wraps=utils.Environment) as env_cls:
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                envs = list(executor.map(lambda _: _get_jinja_env(), range(32)))
+        
+        assert env_cls.call_count == 1
+        assert all(env is envs[0] for env in envs)
+        assert envs[0].globals['i18n'] is utils.i18n
+    
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_jinja_env_caches_compiled_templates(self):
+        """测试编译后的模板被缓存复用"""
+        env = _get_jinja_env()
+        assert env.auto_reload is False
+        assert env.get_template('file_system_zh_CN.j2') is env.get_template('file_system_zh_CN.j2')
+    
+    @pytest.mark.usefixtures('temp_jinja_env')
+    def test_get_template_cache_reset_with_env(self):
+        """测试按名称缓存的模板在环境重建时一并清空"""
+        template = utils._get_template('file_system_zh_CN.j2')
+        assert utils._get_template('file_system_zh_CN.j2') is template
+        
+        utils._env = None
+        assert utils._get_template('file_system_zh_CN.j2') is not template
+    
+    @pytest.mark.usefixtures('temp_jinja_env')
+    def test_warmup_templates(self):
+        """测试预热后提示词使用的模板和系统提示词都已缓存"""
+        with patch('utils.i18n.get_locale', return_value='zh_CN'):
+            utils.warmup_templates()
+        
+        assert ('file_user_i18n.j2', 'file_user.j2') in utils._templates
+        assert ('discussion_i18n.j2', 'discussion.j2') in utils._templates
+        assert utils._file_system_prompts['zh_CN'] == '你是一个代码审查助手。请审查以下代码变更。'
+        # 只预热当前语言
+        assert ('file_system_en_US.j2', 'file_system.j2') not in utils._templates
+    
+    @pytest.mark.usefixtures('temp_jinja_env')
+    def test_bytecode_cache_reused_after_env_rebuild(self, tmp_path, monkeypatch):
+        """测试设置缓存目录后编译结果写入磁盘，重建环境时从字节码缓存加载"""
+        cache_dir = tmp_path / 'jinja_bc'
+        monkeypatch.setenv('JINJA_CACHE_DIR', str(cache_dir))
+        
+        first = _render_template('file_system_zh_CN.j2')
+        assert any(cache_dir.iterdir())
+        
+        utils._env = None
+        with patch.object(utils.Environment, 'compile', side_effect=AssertionError('不应重新编译')):
+            assert _render_template('file_system_zh_CN.j2') == first
 
 
 class TestTemplateRendering:
     """模板渲染测试"""
     
-    def test_render_template_success(self, temp_template_dir):
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_render_template_success(self):
         """测试成功渲染模板"""
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            # 重置环境
-            import utils
-            utils._env = None
-            
-            result = _render_template('file_system_zh_CN.j2')
-            assert result == '你是一个代码审查助手。请审查以下代码变更。'
+        result = _render_template('file_system_zh_CN.j2')
+        assert result == '你是一个代码审查助手。请审查以下代码变更。'
     
+    @pytest.mark.usefixtures('temp_jinja_env')
     def test_render_template_with_variables(self, temp_template_dir):
         """测试带变量的模板渲染"""
         # 创建带变量的模板
         template_content = '文件: {{ filename }}, 作者: {{ author }}'
         (temp_template_dir / 'test_vars.j2').write_text(template_content)
         
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            result = _render_template('test_vars.j2', filename='test.py', author='张三')
-            assert result == '文件: test.py, 作者: 张三'
+        result = _render_template('test_vars.j2', filename='test.py', author='张三')
+        assert result == '文件: test.py, 作者: 张三'
     
-    def test_render_template_not_found(self, temp_template_dir):
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_render_template_not_found(self):
         """测试模板文件不存在"""
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            with pytest.raises(TemplateNotFound, match="模板文件 nonexistent.j2 不存在"):
-                _render_template('nonexistent.j2')
+        with pytest.raises(TemplateNotFound, match="模板文件 nonexistent.j2 不存在"):
+            _render_template('nonexistent.j2')
     
+    @pytest.mark.usefixtures('temp_jinja_env')
     def test_render_template_with_i18n(self, temp_template_dir):
         """测试模板中的国际化功能"""
         # 创建使用 i18n 的模板
         template_content = '{{ i18n.t("status.accepted") }}'
         (temp_template_dir / 'test_i18n.j2').write_text(template_content)
         
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            result = _render_template('test_i18n.j2')
-            # 验证 i18n 对象被正确传递
-            assert 'accepted' in result or '已接受' in result
+        result = _render_template('test_i18n.j2')
+        # 验证 i18n 对象被正确传递
+        assert 'accepted' in result or '已接受' in result
 
 
 class TestSystemPrompt:
     """系统提示词测试"""
     
-    def test_get_file_system_prompt_with_locale(self, temp_template_dir):
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_get_file_system_prompt_with_locale(self):
         """测试根据语言获取系统提示词"""
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            # 测试中文
-            with patch('utils.i18n.get_locale', return_value='zh_CN'):
-                prompt = get_file_system_prompt()
-                assert prompt == '你是一个代码审查助手。请审查以下代码变更。'
-            
-            # 测试英文
-            with patch('utils.i18n.get_locale', return_value='en_US'):
-                prompt = get_file_system_prompt()
-                assert prompt == 'You are a code review assistant. Please review the following code changes.'
+        # 测试中文
+        with patch('utils.i18n.get_locale', return_value='zh_CN'):
+            prompt = get_file_system_prompt()
+            assert prompt == '你是一个代码审查助手。请审查以下代码变更。'
+        
+        # 测试英文
+        with patch('utils.i18n.get_locale', return_value='en_US'):
+            prompt = get_file_system_prompt()
+            assert prompt == 'You are a code review assistant. Please review the following code changes.'
     
+    @pytest.mark.usefixtures('temp_jinja_env')
     def test_get_file_system_prompt_fallback(self, temp_template_dir):
         """测试系统提示词回退机制"""
         # 创建默认模板
         (temp_template_dir / 'file_system.j2').write_text('Default system prompt')
         
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            # 测试不存在的语言，应该回退到默认模板
-            with patch('utils.i18n.get_locale', return_value='fr_FR'):
-                prompt = get_file_system_prompt()
-                assert prompt == 'Default system prompt'
+        # 测试不存在的语言，应该回退到默认模板
+        with patch('utils.i18n.get_locale', return_value='fr_FR'):
+            prompt = get_file_system_prompt()
+            assert prompt == 'Default system prompt'
+    
+    @pytest.mark.usefixtures('temp_jinja_env')
+    def test_get_file_system_prompt_cached(self):
+        """测试同一语言的系统提示词只渲染一次"""
+        with patch('utils.i18n.get_locale', return_value='zh_CN'), \
+                patch('utils._render_template', wraps=utils._render_template) as mock_render:
+            first = get_file_system_prompt()
+            second = get_file_system_prompt()
+        
+        assert first == second == '你是一个代码审查助手。请审查以下代码变更。'
+        mock_render.assert_called_once_with('file_system_zh_CN.j2', 'file_system.j2')
 
 
 class TestUserPrompt:
     """用户提示词测试"""
     
-    def test_get_file_user_prompt_success(self, temp_template_dir, sample_change_data):
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_get_file_user_prompt_success(self, sample_change_data):
         """测试成功获取用户提示词"""
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            prompt = get_file_user_prompt(sample_change_data)
-            assert 'a.py' in prompt
-            assert 'def merge(b, c):' in prompt
+        prompt = get_file_user_prompt(sample_change_data)
+        assert 'a.py' in prompt
+        assert 'def merge(b, c):' in prompt
     
     def test_get_file_user_prompt_invalid_input(self):
         """测试无效输入"""
@@ -150,75 +190,81 @@ class TestUserPrompt:
         with pytest.raises(TypeError, match="change 参数必须是字典类型"):
             get_file_user_prompt("invalid")
         
-        # 测试缺少必需字段
-        with pytest.raises(ValueError, match="change 字典缺少必需字段"):
+        # 测试缺少必需字段，缺失字段按名称排序列出
+        with pytest.raises(ValueError, match=r"change 字典缺少必需字段: \['diff', 'new_path'\]"):
             get_file_user_prompt({'old_path': 'test.py'})
     
-    def test_get_file_user_prompt_required_fields(self, temp_template_dir):
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_get_file_user_prompt_required_fields(self):
         """测试必需字段验证"""
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            # 包含所有必需字段
-            valid_change = {
-                'new_path': 'test.py',
-                'old_path': 'test.py',
-                'diff': '@@ -1,1 +1,1 @@\n-old\n+new'
-            }
-            
-            prompt = get_file_user_prompt(valid_change)
-            assert 'test.py' in prompt
+        # 包含所有必需字段
+        valid_change = {
+            'new_path': 'test.py',
+            'old_path': 'test.py',
+            'diff': '@@ -1,1 +1,1 @@\n-old\n+new'
+        }
+        
+        prompt = get_file_user_prompt(valid_change)
+        assert 'test.py' in prompt
     
+    @pytest.mark.usefixtures('temp_jinja_env')
     def test_get_file_user_prompt_fallback(self, temp_template_dir, sample_change_data):
         """测试用户提示词回退机制"""
         # 创建默认模板
         (temp_template_dir / 'file_user.j2').write_text('Default user prompt: {{ change.new_path }}')
         
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            # 删除国际化模板，测试回退
-            (temp_template_dir / 'file_user_i18n.j2').unlink()
-            
-            prompt = get_file_user_prompt(sample_change_data)
-            assert prompt == 'Default user prompt: a.py'
+        # 删除国际化模板，测试回退
+        (temp_template_dir / 'file_user_i18n.j2').unlink()
+        
+        prompt = get_file_user_prompt(sample_change_data)
+        assert prompt == 'Default user prompt: a.py'
+    
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_get_file_user_prompt_template_batch_render(self, sample_change_data):
+        """测试取一次模板后批量渲染，结果与逐个生成一致"""
+        template = get_file_user_prompt_template()
+        assert template is get_file_user_prompt_template()
+        
+        changes = [dict(sample_change_data, new_path=f'file_{i}.py') for i in range(3)]
+        prompts = [template.render(change=change) for change in changes]
+        assert prompts == [get_file_user_prompt(change) for change in changes]
 
 
 class TestDiscussionContent:
     """讨论内容测试"""
     
-    def test_get_discussion_content_success(self, temp_template_dir, sample_llm_response):
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_get_discussion_content_success(self, sample_llm_response):
         """测试成功获取讨论内容"""
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            content = get_discussion_content(sample_llm_response)
-            assert '## 代码审查结果' in content
-            assert '评分: 7/10' in content
-            assert '代码质量良好，需要小幅改进' in content
+        content = get_discussion_content(sample_llm_response)
+        assert '## 代码审查结果' in content
+        assert '评分: 7/10' in content
+        assert '代码质量良好，需要小幅改进' in content
     
+    @pytest.mark.usefixtures('temp_jinja_env')
     def test_get_discussion_content_fallback(self, temp_template_dir, sample_llm_response):
         """测试讨论内容回退机制"""
         # 创建默认模板
         (temp_template_dir / 'discussion.j2').write_text('Score: {{ score }}, Summary: {{ summary }}')
         
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            # 删除国际化模板
-            (temp_template_dir / 'discussion_i18n.j2').unlink()
-            
-            content = get_discussion_content(sample_llm_response)
-            assert content == 'Score: 7, Summary: 代码质量良好，需要小幅改进'
+        # 删除国际化模板
+        (temp_template_dir / 'discussion_i18n.j2').unlink()
+        
+        content = get_discussion_content(sample_llm_response)
+        assert content == 'Score: 7, Summary: 代码质量良好，需要小幅改进'
 
 
 class TestResponseParsing:
     """响应解析测试"""
     
+    def test_deserialize_llm_resp(self, sample_llm_response):
+        """测试序列化后的回复是不转义中文的 JSON 代码块，且能还原"""
+        content = deserialize_llm_resp(sample_llm_response)
+        
+        assert content.startswith('```json\n') and content.endswith('\n```')
+        assert '代码质量良好' in content
+        assert json.loads(content[len('```json\n'):-len('\n```')]) == sample_llm_response
+    
     def test_parse_response_success(self):
         """测试成功解析响应"""
         response_text = '''
@@ -259,6 +305,14 @@ class TestResponseParsing:
         with pytest.raises(ValueError, match="JSON解析失败"):
             parse_response(response_text, 1.0)
     
+    def test_parse_response_trailing_braces(self):
+        """测试 JSON 之后的说明文字中含有括号时只解析第一个完整的 JSON 对象"""
+        response_text = '{"score": 8, "summary": "包含 } 的总结"}\n说明：可参考 {示例} 修改'
+        
+        result = parse_response(response_text, 1.0)
+        
+        assert result == {'score': 8, 'summary': '包含 } 的总结', 'duration': 1.0}
+    
     def test_parse_response_non_dict_json(self):
         """测试非字典 JSON"""
         response_text = '["这是一个数组", "不是字典"]'
@@ -313,7 +367,7 @@ class TestFileSupportCheck:
     
     def test_supported_extensions_exist(self):
         """测试支持的扩展名集合存在"""
-        assert isinstance(SUPPORTED_EXTENSIONS, set)
+        assert isinstance(SUPPORTED_EXTENSIONS, frozenset)
         assert len(SUPPORTED_EXTENSIONS) > 0
     
     def test_is_supported_file_python(self):
@@ -371,6 +425,32 @@ class TestFileSupportCheck:
         assert is_supported_file('config.local.py') is True
         assert is_supported_file('app.test.ts') is True
     
+    def test_is_supported_file_dot_outside_extension(self):
+        """测试目录名中的点和以点开头的文件名不被当作扩展名"""
+        assert is_supported_file('lib.py/README') is False
+        assert is_supported_file('.py') is False
+        assert is_supported_file('src/.js') is False
+        assert is_supported_file('src/.config/app.js') is True
+    
+    def test_filter_supported_files(self):
+        """测试批量筛选与逐个判断结果一致并保持顺序"""
+        paths = [
+            'src/main.py', 'README.md', '', 'Makefile', 'Test.PY', 'lib.py/README',
+            '.py', 'src/.config/app.js', 'test.min.js', 'image.png'
+        ]
+        
+        assert filter_supported_files(paths) == [p for p in paths if is_supported_file(p)]
+        assert filter_supported_files(iter(['a.go', 'b.txt'])) == ['a.go']
+        assert filter_supported_files([]) == []
+    
+    @pytest.mark.parametrize('path', [
+        'a.b/Makefile', 'src.v2/main', 'lib.py/README', 'pkg.d/.py', 'dir.go/', 'a/b.c/d.rs',
+        'src/.config/app.js', '.py', 'Dockerfile', 'docs/Dockerfile', 'Test.PY', 'main.', ''
+    ])
+    def test_filter_agrees_with_is_supported_file(self, path):
+        """测试批量筛选与逐个判断对每个路径的结论一致，包括目录名带点的路径"""
+        assert (filter_supported_files([path]) == [path]) is is_supported_file(path)
+    
     def test_supported_extensions_completeness(self):
         """测试支持的扩展名完整性"""
         # 验证常见编程语言的扩展名都被包含
@@ -386,34 +466,28 @@ class TestFileSupportCheck:
 class TestUtilsIntegration:
     """utils 模块集成测试"""
     
-    def test_complete_template_workflow(self, temp_template_dir, sample_change_data, sample_llm_response):
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_complete_template_workflow(self, sample_change_data, sample_llm_response):
         """测试完整的模板工作流"""
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            # 1. 获取系统提示词
-            system_prompt = get_file_system_prompt()
-            assert len(system_prompt) > 0
-            
-            # 2. 获取用户提示词
-            user_prompt = get_file_user_prompt(sample_change_data)
-            assert 'a.py' in user_prompt
-            
-            # 3. 获取讨论内容
-            discussion = get_discussion_content(sample_llm_response)
-            assert '代码审查结果' in discussion
-    
-    def test_error_handling_chain(self, temp_template_dir):
+        # 1. 获取系统提示词
+        system_prompt = get_file_system_prompt()
+        assert len(system_prompt) > 0
+        
+        # 2. 获取用户提示词
+        user_prompt = get_file_user_prompt(sample_change_data)
+        assert 'a.py' in user_prompt
+        
+        # 3. 获取讨论内容
+        discussion = get_discussion_content(sample_llm_response)
+        assert '代码审查结果' in discussion
+    
+    @pytest.mark.usefixtures('shared_jinja_env')
+    def test_error_handling_chain(self):
         """测试错误处理链"""
-        with patch('utils.TEMPLATE_DIR', temp_template_dir):
-            import utils
-            utils._env = None
-            
-            # 测试模板不存在时的错误传播
-            with pytest.raises(TemplateNotFound):
-                _render_template('nonexistent_template.j2')
-            
-            # 测试无效变更数据的错误传播
-            with pytest.raises(TypeError):
-                get_file_user_prompt(None)
\ No newline at end of file
+        # 测试模板不存在时的错误传播
+        with pytest.raises(TemplateNotFound):
+            _render_template('nonexistent_template.j2')
+        
+        # 测试无效变更数据的错误传播
+        with pytest.raises(TypeError):
+            get_file_user_prompt(None)
\ No newline at end of file
@@ -1,8 +1,11 @@
 import json
+import os
+import threading
 from pathlib import Path
-from typing import Optional, Dict, Any, Union
+from typing import Optional, Dict, Any, Union, Tuple, Iterable, List
 
-from jinja2 import Environment, FileSystemLoader, TemplateNotFound
+import orjson
+from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader, Template, TemplateNotFound
 
 from i18n import i18n
 
@@ -12,22 +15,73 @@ TEMPLATE_DIR = Path(__file__).parent / 'templates'
 # 懒加载 Jinja2 环境
 _env: Optional[Environment] = None
 
+# 保护 Jinja2 环境的首次构建，避免并发请求各自构建环境并互相覆盖
+_env_lock = threading.Lock()
+
+# 按候选模板名缓存的已编译模板，与 Jinja2 环境同生命周期
+_templates: Dict[Tuple[str, ...], Template] = {}
+
+# 按语言缓存的系统提示词，与 Jinja2 环境同生命周期
+_file_system_prompts: Dict[str, str] = {}
+
+# 回退解析时使用，raw_decode 从指定位置解析出第一个完整的 JSON 值后即停止
+_json_decoder = json.JSONDecoder()
+
 
 def _get_jinja_env() -> Environment:
     """获取 Jinja2 环境实例（懒加载）"""
     global _env
+    # 双重检查：环境构建完成后直接返回，不再获取锁
     if _env is None:
-        if not TEMPLATE_DIR.exists():
-            raise FileNotFoundError(f"模板目录不存在: {TEMPLATE_DIR}")
-        _env = Environment(loader=FileSystemLoader(str(TEMPLATE_DIR)))
+        with _env_lock:
+            if _env is None:
+                if not TEMPLATE_DIR.exists():
+                    raise FileNotFoundError(f"模板目录不存在: {TEMPLATE_DIR}")
+                bytecode_cache = None
+                # 构建环境时才读取缓存目录，导入本模块不依赖数据库等其他配置
+                cache_dir = os.getenv('JINJA_CACHE_DIR')
+                if cache_dir:
+                    # 编译结果持久化到磁盘，进程重启时跳过模板源码的解析和编译；
+                    # 缓存按模板名和源码校验和失效，模板内容变化后会重新编译
+                    os.makedirs(cache_dir, exist_ok=True)
+                    bytecode_cache = FileSystemBytecodeCache(cache_dir)
+                # 模板随代码发布，运行期间不会修改：关闭 auto_reload，省去每次 get_template 时的文件 stat 检查，
+                # 编译后的模板直接从环境缓存中取出
+                env = Environment(
+                    loader=FileSystemLoader(str(TEMPLATE_DIR)),
+                    auto_reload=False,
+                    bytecode_cache=bytecode_cache
+                )
+                # 模板都通过 i18n 取文案，放入全局变量后直接渲染已编译模板也能使用
+                env.globals['i18n'] = i18n
+                _templates.clear()
+                _file_system_prompts.clear()
+                # 初始化完成后再发布，其他线程不会在锁外拿到未设置全局变量的环境
+                _env = env
     return _env
 
 
-def _render_template(template_name: str, **kwargs) -> str:
+def _get_template(*template_names: str) -> Template:
+    """获取已编译的模板
+
+    传入多个模板名时按顺序选取第一个存在的模板，用于国际化模板不存在时回退到默认模板。
+    同一组模板名只向 Jinja2 环境查找一次，之后直接从字典中取出，回退时也不会每次都抛出再捕获 TemplateNotFound。
+
+    Raises:
+        TemplateNotFound: 模板文件都不存在
+    """
+    env = _get_jinja_env()
+    template = _templates.get(template_names)
+    if template is None:
+        template = _templates[template_names] = env.select_template(template_names)
+    return template
+
+
+def _render_template(*template_names: str, **kwargs) -> str:
     """渲染模板的通用方法
 
     Args:
-        template_name: 模板文件名
+        *template_names: 模板文件名，多个时按顺序使用第一个存在的模板
         **kwargs: 模板变量
 
     Returns:
@@ -38,15 +92,12 @@ def _render_template(template_name: str, **kwargs) -> str:
         Exception: 模板渲染失败
     """
     try:
-        env = _get_jinja_env()
-        template = env.get_template(template_name)
-        # 添加i18n到模板上下文
-        kwargs['i18n'] = i18n
-        return template.render(**kwargs)
+        # i18n 已放入环境全局变量，包含和继承的模板中也可直接使用
+        return _get_template(*template_names).render(**kwargs)
     except TemplateNotFound as e:
-        raise TemplateNotFound(f"模板文件 {template_name} 不存在") from e
+        raise TemplateNotFound(f"模板文件 {'、'.join(template_names)} 不存在") from e
     except Exception as e:
-        raise Exception(f"渲染模板 {template_name} 失败: {str(e)}") from e
+        raise Exception(f"渲染模板 {'、'.join(template_names)} 失败: {str(e)}") from e
 
 
 def get_file_system_prompt() -> str:
@@ -55,15 +106,21 @@ def get_file_system_prompt() -> str:
     Returns:
         系统提示词字符串
     """
-    # 尝试使用国际化模板
+    # 系统提示词不含变量，同一语言只渲染一次；先取环境，确保环境重建时缓存已被清空
+    _get_jinja_env()
     locale = i18n.get_locale()
-    template_name = f'file_system_{locale}.j2'
+    prompt = _file_system_prompts.get(locale)
+    if prompt is not None:
+        return prompt
 
-    try:
-        return _render_template(template_name)
-    except TemplateNotFound:
-        # 如果国际化模板不存在，使用默认模板
-        return _render_template('file_system.j2')
+    # 优先使用国际化模板，不存在时使用默认模板
+    prompt = _render_template(f'file_system_{locale}.j2', 'file_system.j2')
+    _file_system_prompts[locale] = prompt
+    return prompt
+
+
+# 生成用户提示词时 change 字典必须包含的字段
+_REQUIRED_CHANGE_FIELDS = frozenset(('new_path', 'old_path', 'diff'))
 
 
 def get_file_user_prompt(change: Dict[str, Any]) -> str:
@@ -101,33 +158,52 @@ def get_file_user_prompt(change: Dict[str, Any]) -> str:
     if not isinstance(change, dict):
         raise TypeError("change 参数必须是字典类型")
 
-    required_fields = ['new_path', 'old_path', 'diff']
-    missing_fields = [field for field in required_fields if field not in change]
+    # 集合差集直接与字典键视图比较，无需逐个字段判断
+    missing_fields = _REQUIRED_CHANGE_FIELDS - change.keys()
     if missing_fields:
-        raise ValueError(f"change 字典缺少必需字段: {missing_fields}")
+        raise ValueError(f"change 字典缺少必需字段: {sorted(missing_fields)}")
 
-    # 尝试使用国际化模板
-    try:
-        return _render_template('file_user_i18n.j2', change=change)
-    except TemplateNotFound:
-        # 如果国际化模板不存在，使用默认模板
-        return _render_template('file_user.j2', change=change)
+    # 优先使用国际化模板，不存在时使用默认模板
+    return _render_template('file_user_i18n.j2', 'file_user.j2', change=change)
+
+
+def get_file_user_prompt_template() -> Template:
+    """获取审核用户提示词的已编译模板
+
+    批量生成多个文件的提示词时，取一次模板后逐个调用 render(change=...)，
+    避免每个文件重复查找模板和构建上下文。
+
+    Returns:
+        用户提示词模板
+    """
+    # 优先使用国际化模板，不存在时使用默认模板
+    return _get_template('file_user_i18n.j2', 'file_user.j2')
+
+
+def warmup_templates() -> None:
+    """预热模板
+
+    Jinja2 在首次获取模板时才把源码编译为 Python 代码。启动时只选出并编译当前语言实际使用的模板、
+    渲染当前语言的系统提示词，避免重启后的第一次审查串行付出这些开销；其他语言的模板在切换语言后首次使用时再编译。
+    """
+    get_file_system_prompt()
+    get_file_user_prompt_template()
+    _get_template('discussion_i18n.j2', 'discussion.j2')
 
 
 def get_discussion_content(llm_resp: Dict[str, Any]) -> str:
     """获取讨论内容"""
-    # 尝试使用国际化模板
-    try:
-        return _render_template('discussion_i18n.j2', **llm_resp)
-    except TemplateNotFound:
-        # 如果国际化模板不存在，使用默认模板
-        return _render_template('discussion.j2', **llm_resp)
+    # 优先使用国际化模板，不存在时使用默认模板
+    return _render_template('discussion_i18n.j2', 'discussion.j2', **llm_resp)
 
 
 def deserialize_llm_resp(llm_resp: Dict[str, Any]) -> str:
-    """反序列化llm_resp的json格式"""
+    """反序列化llm_resp的json格式
+
+    orjson 直接输出 UTF-8，中文不转义；只支持两空格缩进，保存的消息也因此更短。
+    """
     return f"""```json
-{json.dumps(llm_resp, indent=4, ensure_ascii=False)}
+{orjson.dumps(llm_resp, option=orjson.OPT_INDENT_2).decode()}
 ```"""
 
 
@@ -153,20 +229,28 @@ def parse_response(result_text: str, duration: Union[int, float]) -> Dict[str, A
             raise ValueError("未找到有效的JSON部分")
 
         json_text = result_text[start_idx:end_idx]
-        parsed_data = json.loads(json_text)
+        try:
+            parsed_data = orjson.loads(json_text)
+        except orjson.JSONDecodeError:
+            # 最后一个右括号之后可能还有带括号的说明文字，改为只解析从第一个左括号开始的完整 JSON 对象，
+            # 括号配对和字符串内的括号都由 C 实现的扫描器处理
+            parsed_data, _ = _json_decoder.raw_decode(result_text, start_idx)
 
         if not isinstance(parsed_data, dict):
             raise ValueError("JSON内容不是字典格式")
 
-        return {**parsed_data, 'duration': duration}
+        # 解析结果是新建的字典，直接写入耗时，不再整体复制一份
+        parsed_data['duration'] = duration
+        return parsed_data
     except json.JSONDecodeError as e:
+        # orjson.JSONDecodeError 是 json.JSONDecodeError 的子类，两种解析失败都在这里处理
         raise ValueError(f"JSON解析失败: {e}") from e
     except Exception as e:
         raise ValueError(f"解析响应失败: {e}") from e
 
 
-# 支持的文件扩展名集合（使用集合提高查找效率）
-SUPPORTED_EXTENSIONS = {
+# 支持的文件扩展名集合（使用不可变集合提高查找效率，并防止运行期间被意外修改）
+SUPPORTED_EXTENSIONS = frozenset({
     # C/C++
     ".c", ".h", ".cpp", ".cc", ".cxx", ".c++", ".hpp", ".hh", ".hxx", ".h++",
     # C#
@@ -215,10 +299,10 @@ SUPPORTED_EXTENSIONS = {
     ".json", ".yaml", ".yml", ".xml",
     # Makefile
     ".mk",
-}
+})
 
 # 特殊文件名（不带扩展名）
-SPECIAL_FILENAMES = {"Makefile"}
+SPECIAL_FILENAMES = frozenset({"Makefile"})
 
 
 def is_supported_file(file_path: str) -> bool:
@@ -245,9 +329,28 @@ def is_supported_file(file_path: str) -> bool:
     if file_path in SPECIAL_FILENAMES:
         return True
 
-    # 检查文件扩展名
-    path = Path(file_path)
-    if path.suffix.lower() in SUPPORTED_EXTENSIONS:
-        return True
+    # 检查文件扩展名：直接在字符串上取最后一个点之后的部分，不构造 Path 对象；
+    # 与 Path.suffix 一致，点必须在文件名内且不是文件名的第一个字符（如 .bashrc 没有扩展名）
+    dot = file_path.rfind('.')
+    if dot <= file_path.rfind('/') + 1:
+        return False
+
+    return file_path[dot:].lower() in SUPPORTED_EXTENSIONS
 
-    return False
+
+def filter_supported_files(file_paths: Iterable[str]) -> List[str]:
+    """批量筛选支持的文件类型
+
+    判断规则与 is_supported_file 相同。
+
+    Args:
+        file_paths: 文件路径序列
+
+    Returns:
+        支持的文件路径列表，保持原有顺序
+
+    Example:
+        >>> filter_supported_files(["main.py", "README.md", "Makefile"])
+        ['main.py', 'Makefile']
+    """
+    return [file_path for file_path in file_paths if is_supported_file(file_path)]